@@ -1,48 +1,142 @@
+import importlib
 import os
 import sys
 
 import click
-import langchain_core
 
 from aicodebot import AICODEBOT
 from aicodebot import version as aicodebot_version
-from aicodebot.commands import alignment, commit, configure, debug, review, sidekick
 from aicodebot.config import read_config
-from aicodebot.output import get_console
+from aicodebot.profiling import IMPORTS, profiler, span
 
-# -------------------------- Top level command group ------------------------- #
+# -------------------------- Lazy loading of subcommands ------------------------- #
+
+
+class LazyGroup(click.Group):
+    """A click Group that only imports a subcommand's module when that subcommand is invoked.
+
+    The subcommands pull in langchain, tiktoken, pygments, etc. We get called from git hooks a lot,
+    so `aicodebot --help` and `aicodebot --version` shouldn't pay for importing all of that.
+    """
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # command name -> short help. The command is aicodebot.commands.<name>.<name>
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted([*super().list_commands(ctx), *self.lazy_commands])
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.lazy_commands:
+            return super().get_command(ctx, cmd_name)
+
+        with span(IMPORTS):
+            module = importlib.import_module(f"aicodebot.commands.{cmd_name}")
+        return getattr(module, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        """List the subcommands with their short help, without importing them."""
+        names = self.list_commands(ctx)
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in self.lazy_commands:
+                rows.append((name, click.utils.make_default_short_help(self.lazy_commands[name], limit)))
+            else:
+                rows.append((name, super().get_command(ctx, name).get_short_help_str(limit)))
+
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+# --------------------------------- Profiling -------------------------------- #
 
-console = get_console()
 
+def start_profiling(ctx, param, value):
+    """Start the profiler as soon as the option is parsed, so loading the subcommand is timed too."""
+    if not value:
+        return
+    if not profiler.enabled:
+        profiler.start()
+        ctx.call_on_close(print_profile)
+    if param.name == "profile_output":
+        profiler.start_cprofile(value)
 
-@click.group()
+
+def print_profile():
+    """Stop the profiler and print the time spent in each phase (to stderr, so it doesn't mix with the output)."""
+    # Imported here so that rich isn't loaded when we aren't profiling
+    from rich.console import Console  # noqa: PLC0415
+    from rich.table import Table  # noqa: PLC0415
+
+    profiler.stop()
+    table = Table(title="Profile (phases can overlap)", show_header=True, header_style="bold magenta")
+    table.add_column("Phase")
+    table.add_column("Calls", justify="right")
+    table.add_column("Seconds", justify="right")
+    for name, calls, seconds in profiler.summary():
+        table.add_row(name, "" if calls is None else str(calls), f"{seconds:.3f}")
+
+    console = Console(stderr=True)
+    console.print(table)
+    if profiler.pstats_file:
+        console.print(f"cProfile stats written to {profiler.pstats_file}")
+
+
+# -------------------------- Top level command group ------------------------- #
+
+
+@click.group(
+    cls=LazyGroup,
+    lazy_commands={
+        "alignment": "A message about AI Alignment 🤖 + ❤",
+        "commit": "Generate a commit message based on your changes.",
+        "configure": "Create or update the configuration file with dynamic provider and model selection",
+        "debug": "Run a command and debug the output.",
+        "review": "Do a code review, with [un]staged changes, or a specified commit.",
+        "sidekick": "Coding help from your AI sidekick coding assistant",
+    },
+)
 @click.version_option(aicodebot_version, "--version", "-V")
 @click.help_option("--help", "-h")
 @click.option("-d", "--debug-output", is_flag=True, help="Enable debug output")
+@click.option(
+    "--profile",
+    is_flag=True,
+    is_eager=True,
+    expose_value=False,
+    callback=start_profiling,
+    help="Show how long each phase (imports, config, git, context, tokens, model, rendering) took",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True),
+    is_eager=True,
+    expose_value=False,
+    callback=start_profiling,
+    help="Also write cProfile stats to this file (implies --profile)",
+)
 @click.pass_context
 def cli(ctx, debug_output):
     ctx.ensure_object(dict)
     ctx.obj["config"] = existing_config = read_config()
     if not existing_config:
         if ctx.invoked_subcommand != "configure":
+            # Imported here to keep the heavy output dependencies (rich markdown, langchain) off the fast path
+            from aicodebot.output import get_console  # noqa: PLC0415
+
+            console = get_console()
             console.print(f"Welcome to {AICODEBOT}. Let's set up your config file.\n", style=console.bot_style)
+            configure = cli.get_command(ctx, "configure")
             configure.callback(
                 openai_api_key=os.getenv("OPENAI_API_KEY"), anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"), verbose=0
             )
             sys.exit(0)
 
-    # Turn on langchain debug output if requested
-    langchain_core.debug = debug_output
-
-
-# -------------------------- Subcommands ------------------------- #
-
-cli.add_command(alignment)
-cli.add_command(configure)
-cli.add_command(commit)
-cli.add_command(debug)
-cli.add_command(review)
-cli.add_command(sidekick)
+    # Turn on langchain debug output if requested (only importing langchain when we need it)
+    if debug_output:
+        importlib.import_module("langchain_core").debug = True
 
 
 if __name__ == "__main__":  # pragma: no cover
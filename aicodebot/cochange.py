@@ -0,0 +1,140 @@
+import functools
+import itertools
+import sqlite3
+from pathlib import Path
+
+from aicodebot.config import get_local_data_dir
+from aicodebot.helpers import logger
+
+
+class CoChangeIndex:
+    """How often pairs of files were changed in the same commit, mined from git history.
+
+    Stored in SQLite in the local data directory, compactly: each path gets an integer id, and only
+    the pairs that were changed together have a row, with the count. We remember the last commit we
+    indexed, so new commits are added to the counts rather than reading the history again.
+    """
+
+    # Commits touching more files than this are reformats, renames, vendoring, etc. They say little
+    # about which files belong together, and the number of pairs grows with the square of the files
+    MAX_FILES_PER_COMMIT = 30
+
+    def __init__(self, root, path):
+        self.root = str(Path(root).resolve())
+        self.connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cochange_state (root TEXT PRIMARY KEY, head TEXT)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cochange_paths ("
+                "root TEXT, id INTEGER, path TEXT, commits INTEGER, PRIMARY KEY (root, id)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS cochange_paths_by_path ON cochange_paths (root, path)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cochange_pairs ("
+                "root TEXT, a INTEGER, b INTEGER, count INTEGER, PRIMARY KEY (root, a, b)) WITHOUT ROWID"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS cochange_pairs_by_b ON cochange_pairs (root, b)")
+
+    @property
+    def head(self):
+        """The last commit we indexed, or None."""
+        row = self.connection.execute("SELECT head FROM cochange_state WHERE root = ?", (self.root,)).fetchone()
+        return row[0] if row else None
+
+    def reset(self):
+        with self.connection:
+            for table in ["cochange_state", "cochange_paths", "cochange_pairs"]:
+                self.connection.execute(f"DELETE FROM {table} WHERE root = ?", (self.root,))  # noqa: S608
+
+    def add_commits(self, commits, head, since=None):
+        """Count the files changed in commits (a list of (sha, [files]), like Coder.git_log_files), the
+        commits after since (the head they were read from, None for all of them), now indexed up to head.
+
+        Other sessions in the same repo can be updating the index too, so it all happens in one write
+        transaction, and if the index is no longer at since, the commits are left to whoever moved it.
+        Returns whether they were added."""
+        with self.connection:
+            # Take the write lock before reading, so no one else can hand out the same path ids
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self.head != since:
+                logger.debug(f"Co-change index: already updated to {self.head}, not adding commits")
+                return False
+
+            ids = dict(self.connection.execute("SELECT path, id FROM cochange_paths WHERE root = ?", (self.root,)))
+            next_id = max(ids.values(), default=-1) + 1
+            file_commits = {}
+            pairs = {}
+            for _sha, commit_files in commits:
+                files = sorted(set(commit_files))
+                for file in files:
+                    if file not in ids:
+                        ids[file] = next_id
+                        next_id += 1
+                    file_commits[ids[file]] = file_commits.get(ids[file], 0) + 1
+                if len(files) > self.MAX_FILES_PER_COMMIT:
+                    continue
+                for a, b in itertools.combinations(sorted(ids[file] for file in files), 2):
+                    pairs[a, b] = pairs.get((a, b), 0) + 1
+
+            new_paths = {path: path_id for path, path_id in ids.items() if path_id in file_commits}
+            self.connection.executemany(
+                "INSERT INTO cochange_paths (root, id, path, commits) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (root, id) DO UPDATE SET commits = commits + excluded.commits",
+                [(self.root, path_id, path, file_commits[path_id]) for path, path_id in new_paths.items()],
+            )
+            self.connection.executemany(
+                "INSERT INTO cochange_pairs (root, a, b, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (root, a, b) DO UPDATE SET count = count + excluded.count",
+                [(self.root, a, b, count) for (a, b), count in pairs.items()],
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cochange_state (root, head) VALUES (?, ?)", (self.root, head)
+            )
+        logger.debug(f"Co-change index: added {len(commits)} commits, {len(pairs)} pairs")
+        return True
+
+    def related(self, files, max_files=10):
+        """The files most often changed together with files, best first, not including files.
+
+        Each time a file was changed with one of files counts toward it, as a fraction of how often
+        that one of files was changed. Ties go to the file name, so the order is deterministic."""
+        files = list(files)
+        scores = {}
+        # Stay well below SQLite's limit on the number of query parameters
+        for start in range(0, len(files), 500):
+            chunk = files[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            # Each pair is stored once (a < b), so look for the given files on both sides
+            rows = self.connection.execute(
+                "WITH given AS ("  # noqa: S608
+                f"  SELECT id, commits FROM cochange_paths WHERE root = ? AND path IN ({placeholders})"
+                "), neighbors AS ("
+                "  SELECT pairs.b AS id, CAST(pairs.count AS REAL) / given.commits AS score"
+                "  FROM given JOIN cochange_pairs pairs ON pairs.root = ? AND pairs.a = given.id"
+                "  UNION ALL"
+                "  SELECT pairs.a AS id, CAST(pairs.count AS REAL) / given.commits AS score"
+                "  FROM given JOIN cochange_pairs pairs ON pairs.root = ? AND pairs.b = given.id"
+                ") "
+                "SELECT paths.path, SUM(neighbors.score) "
+                "FROM neighbors JOIN cochange_paths paths ON paths.root = ? AND paths.id = neighbors.id "
+                "GROUP BY paths.path",
+                [self.root, *chunk, self.root, self.root, self.root],
+            )
+            for path, score in rows:
+                scores[path] = scores.get(path, 0) + score
+
+        for file in files:
+            scores.pop(file, None)
+        return sorted(scores, key=lambda path: (-scores[path], path))[:max_files]
+
+
+@functools.cache
+def _cochange_index(root, path):
+    return CoChangeIndex(root, path)
+
+
+def get_cochange_index(root="."):
+    """Get the co-change index for the repo at root, stored in the local data directory."""
+    return _cochange_index(Path(root).resolve(), get_local_data_dir() / "cochange.sqlite")
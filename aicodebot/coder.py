@@ -1,78 +1,125 @@
-import fnmatch
-import mimetypes
+import hashlib
+import os
 import re
+import stat
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 
-from pygments.lexers import ClassNotFound, get_lexer_for_mimetype, guess_lexer_for_filename
-
+from aicodebot.cochange import get_cochange_index
 from aicodebot.helpers import exec_and_get_output, logger
-from aicodebot.lm import token_size
+from aicodebot.import_graph import get_import_graph
+from aicodebot.languages import UNKNOWN_FILE_TYPE, get_file_type
+from aicodebot.packing import LARGER_THAN_BUDGET, pack, rank_relevance
+from aicodebot.profiling import CONTEXT, span
+from aicodebot.repo import get_git_backend, in_git_repo
+from aicodebot.tokens import (
+    count_tokens_many,
+    estimate_token_range,
+    fits_token_budget,
+    get_encoding,
+    get_token_count_cache,
+    get_tokenizer_workers,
+)
+from aicodebot.walk import fnmatch_any, get_directory_tree, walk
 
+# Like git, we call a file binary if there's a null byte near the start
+BINARY_SNIFF_BYTES = 8_000
 
-class Coder:
-    """
-    The Coder class encapsulates the functionality of git, and the local file system.
-    """
+# Files bigger than this are never read into memory (like a stray log file), override with AICODEBOT_MAX_FILE_BYTES
+DEFAULT_MAX_FILE_BYTES = 2_000_000
 
-    UNKNOWN_FILE_TYPE = "unknown"
 
-    @staticmethod
-    def auto_file_context(max_tokens, max_file_tokens):
-        """Automatically generate a file context based on what we think the user is working on"""
-        files_to_include = []
-        file_scores = {}
+def get_max_file_bytes():
+    return int(os.getenv("AICODEBOT_MAX_FILE_BYTES", DEFAULT_MAX_FILE_BYTES))
 
-        # To determine the pool of possible files, we start with files that have been recently committed
-        possible_files = Coder.git_recent_committed_files()
 
-        # then we add any staged and unstaged files
-        possible_files += Coder.git_staged_files()
-        possible_files += Coder.git_unstaged_files()
+class LoadedFile(NamedTuple):
+    """A file, read once, for everything that needs its contents."""
 
-        for file in possible_files:
-            # Skip directories and files that don't exist
-            if not Path(file).exists() or Path(file).is_dir():
-                continue
+    path: str
+    data: bytes | None  # None if the file is bigger than the limit, so we didn't read it
+    text: str | None  # None for binary files, or if we didn't read it
+    is_binary: bool
+    size: int
+    mtime_ns: int
 
-            # empty files
-            file_status = Path(file).stat()
-            if file_status.st_size == 0:
-                continue
+    @property
+    def too_big(self):
+        return self.data is None
 
-            # Get the modification and access times
-            modification_time = file_status.st_mtime
-            access_time = file_status.st_atime
 
-            # Skip binary files
-            if Coder.is_binary_file(file):
-                continue
+class Coder:
+    """
+    The Coder class encapsulates the functionality of git, and the local file system.
+    """
 
-            # Calculate the score based on the modification and access times
-            # For now, we'll just add the two times together, giving a slight preference to modification time
-            score = modification_time + (access_time * 0.9)
+    UNKNOWN_FILE_TYPE = UNKNOWN_FILE_TYPE
 
-            # Store the score in the dictionary
-            # Store the file without the directory
-            file_scores[str(file)] = score
+    @staticmethod
+    def auto_file_context(max_tokens, max_file_tokens, snapshot=None):
+        """Automatically choose the files for the context, see pack_file_context."""
+        return Coder.pack_file_context(max_tokens, max_file_tokens, snapshot).selected
 
-        # Sort the files by score in descending order
-        sorted_files = sorted(file_scores, key=file_scores.get, reverse=True)
+    @staticmethod
+    @span(CONTEXT)
+    def pack_file_context(max_tokens, max_file_tokens, snapshot=None):
+        """Automatically choose the files for the context based on what we think the user is working on
+
+        We start from the files being changed (most recently modified first), then the files that
+        historically change together with them, then the files changed in the last few commits, then
+        the files connected to those through imports (nearest first). The earlier a file is in that
+        order the more relevant it is. The files being changed go in first, as long as they fit, then we
+        pack the other files with the most relevance in total into what's left of max_tokens (see packing.pack).
+
+        Returns a Packing, with the files left out and why in excluded."""
+        snapshot = snapshot or RepoSnapshot()
+
+        changed_files = list(dict.fromkeys(snapshot.staged_files() + snapshot.unstaged_files()))
+        changed_files.sort(key=lambda file: snapshot.stat(file).st_mtime if snapshot.exists(file) else 0, reverse=True)
+        cochanged_files = Coder.git_cochanged_files(changed_files) if changed_files else []
+        possible_files = list(dict.fromkeys(changed_files + cochanged_files + Coder.git_recent_committed_files()))
+        possible_files += get_import_graph(snapshot=snapshot).related(possible_files)
+        possible_files = [str(file) for file in dict.fromkeys(possible_files)]
+        relevance = rank_relevance(possible_files)
+
+        excluded = {}
+        sorted_files = []
+        for file in possible_files:
+            # Skip directories and files that don't exist
+            file_status = snapshot.stat(file)
+            if file_status is None:
+                excluded[file] = "not found"
+            elif stat.S_ISDIR(file_status.st_mode):
+                excluded[file] = "a directory"
+            elif file_status.st_size == 0:
+                excluded[file] = "empty"
+            elif fits_token_budget(file_status.st_size, min(max_tokens, max_file_tokens)) is False:
+                # Reject files that are obviously too big from their size alone, so we never read them
+                logger.debug(f"Skipping {file}, it's too big for the token budget ({file_status.st_size} bytes)")
+                excluded[file] = "over the file limit" if max_file_tokens < max_tokens else LARGER_THAN_BUDGET
+            else:
+                sorted_files.append(file)
 
-        # Add files to the list until we reach the max_tokens limit
+        # Exact counts keep us within the budget. They come from the cache for files that haven't changed,
+        # so we don't re-read them
+        token_counts = {}
+        file_token_counts = Coder.file_token_counts(sorted_files, snapshot=snapshot)
         for file in sorted_files:
-            tokens = token_size(Path(file).read_text())
-            if tokens > max_file_tokens:
-                continue
-
-            if tokens <= max_tokens:
-                files_to_include.append(file)
-                max_tokens -= tokens
-
-            if max_tokens <= 0:
-                break
+            tokens = file_token_counts[file]
+            if tokens is None:
+                excluded[file] = "binary"
+            elif tokens > max_file_tokens:
+                excluded[file] = "over the file limit"
+            else:
+                token_counts[file] = tokens
 
-        return files_to_include
+        packing = pack(token_counts, max_tokens, relevance, required=changed_files)
+        excluded.update(packing.excluded)
+        for file, reason in excluded.items():
+            logger.debug(f"Left {file} out of the context, {reason}")
+        return packing._replace(excluded={file: excluded[file] for file in possible_files if file in excluded})
 
     @staticmethod
     def clone_repo(repo_url, repo_dir):
@@ -87,88 +134,111 @@ class Coder:
             logger.info(f"Cloning {repo_url} to {repo_dir}")
             subprocess.run(["git", "clone", repo_url, repo_dir], check=True)
 
+    @staticmethod
+    def file_token_counts(files, workers=None, snapshot=None):
+        """Count the tokens in each file, returning a dict of file -> token count (None for binary files).
+
+        Counts are cached by git blob SHA, so files that haven't changed since they were last counted
+        are neither read nor encoded again. Everything else is loaded (through the snapshot, so it's
+        read once) and tokenized on a thread pool. Files too big to load get the most tokens their size
+        allows (see estimate_token_range), which isn't cached, since it's not a count."""
+        workers = workers or get_tokenizer_workers()
+        snapshot = snapshot or RepoSnapshot()
+        cache = get_token_count_cache()
+        encoding_name = get_encoding().name
+        blob_shas = Coder.git_blob_shas(files) if Coder.is_inside_git_repo() else {}
+
+        # Untracked or modified files aren't in the index, so we have to hash the contents ourselves
+        loaded = snapshot.load_many([file for file in files if Path(file).as_posix() not in blob_shas], workers)
+        estimates = {file: estimate_token_range(loaded[file].size)[1] for file in loaded if loaded[file].too_big}
+        file_shas = {
+            file: blob_shas.get(Path(file).as_posix()) or Coder.git_blob_sha(loaded[file].data)
+            for file in files
+            if file not in estimates
+        }
+
+        token_counts = cache.get_many(file_shas.values(), encoding_name)
+
+        missing = {sha: file for file, sha in file_shas.items() if sha not in token_counts}
+        loaded.update(snapshot.load_many([file for file in missing.values() if file not in loaded], workers))
+        texts, upper_bounds = {}, {}
+        for sha, file in missing.items():
+            if loaded[file].is_binary:
+                token_counts[sha] = None
+            elif loaded[file].too_big:  # Tracked, but too big to load and count
+                upper_bounds[sha] = estimate_token_range(loaded[file].size)[1]
+            else:
+                texts[sha] = loaded[file].text
+
+        token_counts.update(zip(texts, count_tokens_many(texts.values(), workers), strict=True))
+        cache.set_many({sha: token_counts[sha] for sha in missing if sha not in upper_bounds}, encoding_name)
+        token_counts.update(upper_bounds)
+        logger.debug(f"Token count cache stats: {cache.stats}")
+
+        return {file: estimates[file] if file in estimates else token_counts[file_shas[file]] for file in files}
+
     @classmethod
     def filtered_file_list(cls, path, ignore_patterns=None, use_gitignore=True):
-        """Walks through a directory and returns a list of files that are not ignored
+        """Walks through a directory and returns a list of files (and directories) that are not ignored
         based on the provided ignore patterns and .gitignore files."""
-        ignore_patterns = ignore_patterns.copy() if ignore_patterns else []
-
         base_path = Path(path)
+        if fnmatch_any(base_path.name, ignore_patterns):
+            return []
+        if not base_path.is_dir():
+            return [base_path]
 
-        if use_gitignore:
-            # Note: .gitignore files can exist in sub directories as well, such as * in __pycache__ directories
-            gitignore_file = base_path / ".gitignore"
-            if gitignore_file.exists():
-                with gitignore_file.open() as f:
-                    ignore_patterns.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
-
-        out = []
-        if base_path.is_dir():
-            if not any(fnmatch.fnmatch(base_path.name, pattern) for pattern in ignore_patterns):
-                out.append(base_path)
-                for item in base_path.iterdir():
-                    out += cls.filtered_file_list(item, ignore_patterns, use_gitignore)
-        elif not any(fnmatch.fnmatch(base_path.name, pattern) for pattern in ignore_patterns):
-            out.append(base_path)
-
-        return out
+        return [base_path, *(base_path / entry.path for entry in walk(base_path, ignore_patterns, use_gitignore))]
 
     @classmethod
-    def generate_directory_structure(cls, path, ignore_patterns=None, use_gitignore=True, indent=0):
-        """Generate a text representation of the directory structure of a path, used for context for prompts"""
-        ignore_patterns = ignore_patterns.copy() if ignore_patterns else []
-
+    @span(CONTEXT)
+    def generate_directory_structure(
+        cls, path, ignore_patterns=None, use_gitignore=True, indent=0, *, max_tokens=None, focus_files=None
+    ):
+        """Generate a text representation of the directory structure of a path, used for context for prompts
+
+        With max_tokens, the structure is kept (approximately) within that many tokens by collapsing
+        directories into a line with their file count. Directories near focus_files are expanded first.
+
+        The tree is kept between calls, so calling this again (like on each sidekick turn) only walks
+        the directories that changed.
+        """
         base_path = Path(path)
+        if fnmatch_any(base_path.name, ignore_patterns):
+            return ""
+        if not base_path.is_dir():
+            return "  " * indent + f"- [File] {base_path.name}\n"
 
-        if use_gitignore:
-            # Note: .gitignore files can exist in sub directories as well, such as * in __pycache__ directories
-            gitignore_file = base_path / ".gitignore"
-            if gitignore_file.exists():
-                with gitignore_file.open() as f:
-                    ignore_patterns.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
-
-        structure = ""
-        if base_path.is_dir():
-            if not any(fnmatch.fnmatch(base_path.name, pattern) for pattern in ignore_patterns):
-                structure += "  " * indent + f"- [Directory] {base_path.name}\n"
-                for item in base_path.iterdir():
-                    structure += cls.generate_directory_structure(item, ignore_patterns, use_gitignore, indent + 1)
-        elif not any(fnmatch.fnmatch(base_path.name, pattern) for pattern in ignore_patterns):
-            structure += "  " * indent + f"- [File] {base_path.name}\n"
-
-        return structure
+        focus = [os.path.relpath(file, base_path) for file in focus_files or []]
+        tree = get_directory_tree(base_path, ignore_patterns, use_gitignore)
+        return tree.render(indent, max_tokens=max_tokens, focus=focus)
 
     @classmethod
     def get_file_info(cls, file_path):
         """Gets information about a file, including whether it's binary and its file type."""
+        return cls.is_binary_file(file_path), cls.get_file_type(file_path)
 
-        mime_type = mimetypes.guess_type(file_path)[0]
+    @staticmethod
+    def get_file_type(file_path):
+        """The file type (language) of a file, from its name."""
+        return get_file_type(file_path)
 
-        # Use the is_binary_file function to check if the file is binary
-        is_binary = cls.is_binary_file(file_path)
+    @staticmethod
+    def git_blob_sha(data):
+        """Hash bytes the same way git does for a blob (git hash-object)."""
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
 
-        try:
-            # Try to get the lexer for the MIME type
-            lexer = get_lexer_for_mimetype(mime_type)
-        except ClassNotFound:
-            try:
-                # If that fails, try to guess the lexer based on the file name
-                lexer = guess_lexer_for_filename(file_path, "")
-            except ClassNotFound:
-                # If that also fails, set the file type to UNKNOWN_FILE_TYPE
-                file_type = cls.UNKNOWN_FILE_TYPE
-            else:
-                file_type = lexer.name
-        else:
-            file_type = lexer.name
+    @staticmethod
+    def git_blob_shas(files=None):
+        """Map each tracked file that is unchanged in the working tree to its git blob SHA, from the index.
 
-        return is_binary, file_type
+        Files with unstaged changes are left out, since their index SHA no longer matches what's on disk."""
+        return get_git_backend().blob_shas(files)
 
     @staticmethod
-    def git_diff_context(commit=None, files=None):
+    @span(CONTEXT)
+    def git_diff_context(commit=None, files=None, snapshot=None):
         """Get a text representation of the git diff for the current commit or staged files, including new files"""
-        base_git_diff = ["git", "diff", "-U10"]  # Tell diff to provide 10 lines of context
-
+        snapshot = snapshot or RepoSnapshot()
         if commit:
             # If a commit is provided, just get the diff for that commit
             logger.debug(f"Getting diff for commit {commit}")
@@ -178,7 +248,7 @@ class Coder:
             return show
         else:
             # Otherwise, get the diff for the staged files, or if there are none, the diff for the unstaged files
-            staged_files = Coder.git_staged_files()
+            staged_files = snapshot.staged_files()
             if staged_files:
                 logger.debug(f"Getting diff for staged files: {staged_files}")
                 diff_type = "--cached"
@@ -188,26 +258,34 @@ class Coder:
             file_status = exec_and_get_output(
                 ["git", "diff", diff_type, "--name-status"] + list(files or [])
             ).splitlines()
+            statuses = [status.split("\t") for status in file_status]
+
+            # Get the diffs for all the changed (and renamed) files with one git process, rather than one per file
+            file_diffs = Coder.git_diff_per_file(
+                diff_type, [parts[-1] for parts in statuses if parts[0][0] not in ("A", "D")]
+            )
 
             diffs = []
-            for status in file_status:
-                status_parts = status.split("\t")
+            for status_parts in statuses:
                 status_code = status_parts[0][0]  # Get the first character of the status code
                 if status_code == "A":
                     # If the file is new, include the entire file content
                     file_name = status_parts[1]
-                    if Coder.is_binary_file(file_name):
+                    loaded = snapshot.load(file_name)
+                    if loaded.is_binary:
                         # Don't include the diff for binary files
                         diffs.append(f"## New binary file added: {file_name}")
+                    elif loaded.too_big:
+                        diffs.append(f"## New file added: {file_name} (too big to include, {loaded.size:,} bytes)")
                     else:
                         diffs.append(f"## New file added: {file_name}")
-                        contents = Path(file_name).read_text()
-                        diffs.append(contents)
-                elif status_code == "R":
-                    # If the file is renamed, get the diff and note the old and new names
+                        diffs.append(loaded.text)
+                elif status_code in ("R", "C"):
+                    # If the file is renamed (or copied, with diff.renames=copies), get the diff and note the old and new names
                     old_file_name, new_file_name = status_parts[1], status_parts[2]
-                    diffs.append(f"## File renamed: {old_file_name} -> {new_file_name}")
-                    diffs.append(exec_and_get_output(base_git_diff + [diff_type, "--", new_file_name]))
+                    action = "renamed" if status_code == "R" else "copied"
+                    diffs.append(f"## File {action}: {old_file_name} -> {new_file_name}")
+                    diffs.append(file_diffs[new_file_name])
                 elif status_code == "D":
                     # If the file is deleted, note the deletion
                     file_name = status_parts[1]
@@ -216,65 +294,198 @@ class Coder:
                     # If the file is not new, renamed, or deleted, get the diff
                     file_name = status_parts[1]
                     diffs.append(f"## File changed: {file_name}")
-                    diffs.append(exec_and_get_output(base_git_diff + [diff_type, "--", file_name]))
+                    diffs.append(file_diffs[file_name])
 
             return "\n".join(diffs)
 
     @staticmethod
-    def git_recent_committed_files(max_files=10, max_commits=3):
-        """Get a list of files that have been in the last max_days days."""
-        recent_commits = exec_and_get_output(["git", "log", "--format=%H", f"-{max_commits}"]).splitlines()
-        if not recent_commits:
+    def git_diff_per_file(diff_type, files, chunk_size=500):
+        """Get the `git diff -U10` output for each file, as a dict of file name -> diff.
+
+        The diffs come from one git process per chunk_size files, split up per file here. Each
+        file's diff is the same as running git diff on just that file. Renames aren't detected for a
+        single path, so we turn off rename detection to keep it that way for the batch.
+        """
+        base_git_diff = ["git", "diff", "-U10", "--no-renames"]  # Tell diff to provide 10 lines of context
+        file_diffs = {}
+        for start in range(0, len(files), chunk_size):
+            chunk = files[start : start + chunk_size]
+            headers = {f"diff --git a/{file_name} b/{file_name}": file_name for file_name in chunk}
+            output = exec_and_get_output(base_git_diff + [diff_type, "--"] + chunk)
+            # Lines inside a diff start with a space, + or -, so every line starting with "diff --git" is a header
+            for block in re.split(r"^(?=diff --git )", output, flags=re.MULTILINE):
+                file_name = headers.get(block.split("\n", 1)[0])
+                if file_name:
+                    # A type change (file -> symlink) shows up as two diffs for the same file
+                    file_diffs[file_name] = file_diffs.get(file_name, "") + block
+
+        for file_name in files:
+            if file_name not in file_diffs:
+                # We couldn't match up the header (quoted file names, diff.noprefix, etc.), so ask for it by itself
+                file_diffs[file_name] = exec_and_get_output(base_git_diff + [diff_type, "--", file_name])
+
+        return file_diffs
+
+    @staticmethod
+    def git_changed_lines(files):
+        """Map each of files that changed since the last commit to the set of its line numbers that changed.
+
+        From one `git diff -U0 HEAD`. Where lines were only deleted, the line before them counts as changed
+        (the first line, for deletions at the top).
+        Untracked files aren't in the diff, and there's no diff before the first commit."""
+        if not files:
+            return {}
+        try:
+            output = exec_and_get_output(
+                ["git", "diff", "-U0", "--no-color", "--no-ext-diff", "--no-renames", "--relative", "HEAD", "--"]
+                + list(files)
+            )
+        except Exception:
+            return {}
+
+        changed_lines = {}
+        lines = None
+        for line in output.splitlines():
+            if line.startswith("+++ "):
+                # Git ends the line with a tab when the name has a space in it
+                file_name = Coder.git_unquote_path(line[4:].rstrip("\t"))
+                lines = (
+                    None if file_name == "/dev/null" else changed_lines.setdefault(file_name.removeprefix("b/"), set())
+                )
+            elif line.startswith("@@") and lines is not None:
+                match = re.match(r"@@ -\S+ \+(\d+)(?:,(\d+))? @@", line)
+                if match:
+                    start, count = int(match.group(1)), int(match.group(2) or 1)
+                    # Deletions at the top are reported as after line 0
+                    start = max(start, 1)
+                    lines.update(range(start, start + max(count, 1)))
+        return changed_lines
+
+    @staticmethod
+    def git_unquote_path(path):
+        """Undo git's C-style quoting of a file name with unusual characters in it, like "caf\\303\\251.py"."""
+        if len(path) < 2 or not path.startswith('"') or not path.endswith('"'):
+            return path
+        # The escapes are for bytes of UTF-8, so decode them to bytes first
+        return path[1:-1].encode().decode("unicode_escape").encode("latin-1").decode(errors="replace")
+
+    @staticmethod
+    def git_log_files(max_commits, since=None):
+        """Get the files changed in each of the last max_commits commits, as a list of (sha, [files]), newest first.
+
+        One git log for all the commits. Each commit is compared to its parent, merges list no files.
+        With since (a commit), only the commits after it. File names are relative to the top of the repo."""
+        command = ["git", "log", f"-{max_commits}", "--name-only", "-z", "--format=%x1e%H"]
+        if since:
+            command.append(f"{since}..HEAD")
+        output = exec_and_get_output(command)
+        commits = []
+        for record in output.split("\x1e")[1:]:
+            sha, _, names = record.partition("\0")
+            commits.append((sha, [name for name in names.removeprefix("\n").split("\0") if name]))
+        return commits
+
+    @staticmethod
+    def git_recent_committed_files(max_files=10, max_commits=3, half_life=10):
+        """Get the files changed in the last max_commits commits, most relevant first.
+
+        Each time a file was changed adds to its score, with the weight halving every half_life commits,
+        so files that change often and recently come first. Ties go to the most recently changed file,
+        then the file name, so the order is deterministic. Files that no longer exist are left out.
+        """
+        scores = {}
+        last_changed = {}
+        for age, (_sha, files) in enumerate(Coder.git_log_files(max_commits)):
+            for file in files:
+                scores[file] = scores.get(file, 0) + 0.5 ** (age / half_life)
+                last_changed.setdefault(file, age)
+
+        ranked = sorted(scores, key=lambda file: (-scores[file], last_changed[file], file))
+        return [file for file in ranked if Path(file).exists()][:max_files]
+
+    @staticmethod
+    def git_cochanged_files(files, max_files=10, max_commits=1_000):
+        """Get the files most often changed in the same commits as files, best first.
+
+        The counts come from the co-change index, which only reads the commits since it was last
+        updated (up to max_commits of them). If history was rewritten so the commit it was updated to
+        is no longer in it, the index starts over."""
+        backend = get_git_backend()
+        head = backend.head_sha()
+        if head is None:
             return []
-        else:
-            # Get the list of files that have been changed in those commits
-            out = set()
-            for commit in recent_commits:
-                out.update(exec_and_get_output(["git", "diff", "--name-only", commit]).splitlines())
 
-            return list(out)[:max_files]
+        index = get_cochange_index(backend.root)
+        since = index.head
+        if since != head:
+            if since and not Coder.git_is_ancestor(since, head):
+                logger.debug(f"Co-change index: {since} is no longer in the history, starting over")
+                index.reset()
+                since = None
+            index.add_commits(Coder.git_log_files(max_commits, since=since), head, since=since)
+
+        return [file for file in index.related(files, max_files=max_files * 2) if Path(file).exists()][:max_files]
+
+    @staticmethod
+    def git_is_ancestor(ancestor, commit):
+        """Whether ancestor is in the history of commit (False if either is unknown)."""
+        try:
+            exec_and_get_output(["git", "merge-base", "--is-ancestor", ancestor, commit])
+        except Exception:
+            return False
+        return True
 
     @staticmethod
     def git_staged_files():
-        return exec_and_get_output(["git", "diff", "--cached", "--name-only"]).splitlines()
+        return get_git_backend().staged_files()
 
     @staticmethod
     def git_unstaged_files():
-        return exec_and_get_output(["git", "diff", "HEAD", "--name-only"]).splitlines()
+        return get_git_backend().unstaged_files()
 
     @staticmethod
     def identify_languages(files):
-        """Identify the languages of a list of files."""
-        languages = set()
-        for file in files:
-            _, language = Coder.get_file_info(file)
-            if language != Coder.UNKNOWN_FILE_TYPE:
-                languages.add(language)
-
-        return sorted(list(languages))
+        """Identify the languages of a list of files, from their names."""
+        languages = {get_file_type(file) for file in files}
+        languages.discard(Coder.UNKNOWN_FILE_TYPE)
+        return sorted(languages)
 
     def is_inside_git_repo():
         """Checks if the current directory is inside a git repository."""
-        out = subprocess.run(["git", "rev-parse", "--is-inside-work-tree"], capture_output=True, text=True, check=False)
-        if out.returncode == 0:
-            return True
-        else:
-            logger.debug(f"Not inside a git repo: {out.stderr}")
-            return False
+        return in_git_repo()
 
     @staticmethod
     def is_binary_file(file_path):
-        """Checks if a file is binary or not byt looking for a null byte,
-        stopping when you find one or reach the end of the file."""
-        chunksize = 4000
+        """Checks if a file is binary or not by looking for a null byte in the first BINARY_SNIFF_BYTES, like git."""
+        with Path(file_path).open("rb") as file:
+            return b"\0" in file.read(BINARY_SNIFF_BYTES)
+
+    @staticmethod
+    def load_file(file_path, max_bytes=None):
+        """Read a file once, returning a LoadedFile with its bytes, and its text if it's not binary.
+
+        Files over max_bytes (default from get_max_file_bytes) aren't read, beyond the start to see if they're binary.
+        """
+        max_bytes = get_max_file_bytes() if max_bytes is None else max_bytes
         with Path(file_path).open("rb") as file:
-            while True:
-                chunk = file.read(chunksize)
-                if b"\0" in chunk:  # Null byte
-                    return True
-                if len(chunk) < chunksize:
-                    break  # End of file
-        return False
+            file_stat = os.fstat(file.fileno())
+            if file_stat.st_size > max_bytes:
+                logger.debug(f"Not loading {file_path}, it's over {max_bytes} bytes ({file_stat.st_size} bytes)")
+                is_binary = b"\0" in file.read(BINARY_SNIFF_BYTES)
+                return LoadedFile(str(file_path), None, None, is_binary, file_stat.st_size, file_stat.st_mtime_ns)
+            data = file.read()
+
+        is_binary = b"\0" in data[:BINARY_SNIFF_BYTES]
+        text = None if is_binary else data.decode("utf-8", errors="replace")
+        return LoadedFile(str(file_path), data, text, is_binary, len(data), file_stat.st_mtime_ns)
+
+    @staticmethod
+    def load_files(files, workers=None):
+        """Load many files on a thread pool, returning a dict of file -> LoadedFile."""
+        if not files:
+            return {}
+        with ThreadPoolExecutor(max_workers=workers or get_tokenizer_workers()) as executor:
+            return dict(zip(files, executor.map(Coder.load_file, files), strict=True))
 
     @staticmethod
     def parse_github_url(repo_url):
@@ -287,3 +498,93 @@ class Coder:
 
         owner, repo = match.groups()
         return owner, repo
+
+
+class RepoSnapshot:
+    """What we know about the working tree, gathered once for the duration of a command.
+
+    Git status comes from a single `git status --porcelain=v2 -z` (run the first time it's needed),
+    and each path is stat'ed and classified (binary or not, language) at most once, no matter how
+    many helpers ask. Make a new snapshot when the working tree may have changed.
+    """
+
+    def __init__(self):
+        self._status = None
+        self._stats = {}
+        self._file_info = {}
+        self._loaded = {}
+
+    @property
+    def status(self):
+        """A list of (path, index status, working tree status), see `git help status` for the codes."""
+        if self._status is None:
+            self._status = self.parse_status(
+                exec_and_get_output(
+                    ["git", "--no-optional-locks", "status", "--porcelain=v2", "-z", "--untracked-files=no"]
+                )
+            )
+        return self._status
+
+    @staticmethod
+    def parse_status(output):
+        status = []
+        entries = iter(output.split("\0"))
+        for entry in entries:
+            kind = entry[:1]
+            if kind == "1":  # Ordinary change
+                fields = entry.split(" ", 8)
+            elif kind == "2":  # Rename or copy, followed by the original path, which we don't need
+                fields = entry.split(" ", 9)
+                next(entries)
+            elif kind == "u":  # Unmerged
+                fields = entry.split(" ", 10)
+            else:  # Untracked, ignored, headers and the trailing empty entry
+                continue
+            index_status, worktree_status = fields[1]
+            status.append((fields[-1], index_status, worktree_status))
+        return status
+
+    def staged_files(self):
+        """The same files as `git diff --cached --name-only`"""
+        return [path for path, index_status, _ in self.status if index_status != "."]
+
+    def unstaged_files(self):
+        """The same files as `git diff HEAD --name-only`, everything that differs from HEAD"""
+        return [
+            path for path, index_status, worktree_status in self.status if (index_status, worktree_status) != (".", ".")
+        ]
+
+    def stat(self, path):
+        """os.stat the path (once), returning None if it doesn't exist."""
+        path = str(path)
+        if path not in self._stats:
+            try:
+                self._stats[path] = Path(path).stat()
+            except FileNotFoundError:
+                self._stats[path] = None
+        return self._stats[path]
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def file_info(self, path):
+        """Coder.get_file_info for the path (once), which is (is_binary, file_type)."""
+        path = str(path)
+        if path not in self._file_info:
+            self._file_info[path] = (self.load(path).is_binary, Coder.get_file_type(path))
+        return self._file_info[path]
+
+    def load(self, path):
+        """Coder.load_file the path (once), for everything that needs its contents."""
+        path = str(path)
+        if path not in self._loaded:
+            self._loaded[path] = Coder.load_file(path)
+        return self._loaded[path]
+
+    def load_many(self, files, workers=None):
+        """Load the files (the ones not loaded yet on a thread pool), returning a dict of file -> LoadedFile."""
+        self._loaded.update(Coder.load_files([str(file) for file in files if str(file) not in self._loaded], workers))
+        return {file: self._loaded[str(file)] for file in files}
+
+    def is_binary(self, path):
+        return self.file_info(path)[0]
@@ -1,8 +1,2 @@
-from .alignment import alignment
-from .commit import commit
-from .configure import configure
-from .debug import debug
-from .review import review
-from .sidekick import sidekick
-
-__all__ = ["alignment", "commit", "configure", "debug", "review", "sidekick"]
+# Each subcommand lives in its own module, aicodebot.commands.<name>, and is imported lazily by
+# aicodebot.cli so that running one command doesn't pay for importing all of them.
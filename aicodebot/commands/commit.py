@@ -9,7 +9,7 @@ import click
 from pydantic import BaseModel, Field
 from rich.panel import Panel
 
-from aicodebot.coder import Coder
+from aicodebot.coder import Coder, RepoSnapshot
 from aicodebot.helpers import exec_and_get_output, logger
 from aicodebot.lm import LanguageModelManager
 from aicodebot.output import OurMarkdown, get_console
@@ -44,14 +44,17 @@ def commit(response_token_size, yes, skip_pre_commit, files):  # noqa: PLR0915
         console.print("🛑 This command must be run from within a git repository.", style=console.error_style)
         sys.exit(1)
 
+    # Look at git status and the files once, for everything below
+    snapshot = RepoSnapshot()
+
     # If files are specified, only consider those files
     if files:
-        staged_files = [f for f in Coder.git_staged_files() if f in files]
-        unstaged_files = [f for f in Coder.git_unstaged_files() if f in files]
+        staged_files = [f for f in snapshot.staged_files() if f in files]
+        unstaged_files = [f for f in snapshot.unstaged_files() if f in files]
     else:
         # Otherwise use git
-        staged_files = Coder.git_staged_files()
-        unstaged_files = Coder.git_unstaged_files()
+        staged_files = snapshot.staged_files()
+        unstaged_files = snapshot.unstaged_files()
 
     if not staged_files:
         # If no files are staged, they probably want to commit all changed files, confirm.
@@ -74,9 +77,9 @@ def commit(response_token_size, yes, skip_pre_commit, files):  # noqa: PLR0915
         files = staged_files
 
     # Don't look at files that were deleted/moved
-    files = [f for f in files if Path(f).exists()]
+    files = [f for f in files if snapshot.exists(f)]
 
-    diff_context = Coder.git_diff_context()
+    diff_context = Coder.git_diff_context(snapshot=snapshot)
     languages = ",".join(Coder.identify_languages(files))
     if not diff_context:
         console.print("No changes to commit. 🤷")
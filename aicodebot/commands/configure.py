@@ -6,7 +6,7 @@ import click
 import yaml
 
 from aicodebot import AICODEBOT
-from aicodebot.config import detect_api_keys, fetch_models_for_provider, get_config_file, read_config
+from aicodebot.config import detect_api_keys, fetch_models_for_provider, get_config_file, read_config, reload
 from aicodebot.helpers import create_and_write_file
 from aicodebot.output import get_console
 from aicodebot.prompts import DEFAULT_PERSONALITY, PERSONALITIES
@@ -22,6 +22,7 @@ def configure(verbose, openai_api_key, anthropic_api_key):  # noqa: ARG001 - ver
 
     def write_config_file(config_data):
         create_and_write_file(get_config_file(), yaml.dump(config_data), overwrite=True)
+        reload()
         console.print(f"✅ Updated config file at {get_config_file()}")
 
     # Check if we're in a terminal for interactive mode
@@ -4,7 +4,7 @@ import sys
 import click
 from rich.live import Live
 
-from aicodebot.coder import Coder
+from aicodebot.coder import Coder, RepoSnapshot
 from aicodebot.helpers import logger
 from aicodebot.lm import DEFAULT_RESPONSE_TOKENS, LanguageModelManager
 from aicodebot.output import OurMarkdown, RichLiveCallbackHandler, get_console
@@ -23,14 +23,17 @@ def review(commit, output_format, response_token_size, files):
         console.print("🛑 This command must be run from within a git repository.", style=console.error_style)
         sys.exit(1)
 
+    # Look at git status and the files once, for everything below
+    snapshot = RepoSnapshot()
+
     # If files are specified, only consider those files
     # Otherwise, use git to get the list of files
     if not files:
-        files = Coder.git_staged_files()
+        files = snapshot.staged_files()
         if not files:
-            files = Coder.git_unstaged_files()
+            files = snapshot.unstaged_files()
 
-    diff_context = Coder.git_diff_context(commit, files)
+    diff_context = Coder.git_diff_context(commit, files, snapshot)
     if not diff_context:
         console.print("No changes detected for review. 🤷")
         return
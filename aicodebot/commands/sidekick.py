@@ -1,17 +1,19 @@
 import sys
+from collections import Counter
 
 import click
 from rich.live import Live
 from rich.panel import Panel
 
 from aicodebot import AICODEBOT
-from aicodebot.coder import Coder
+from aicodebot.coder import Coder, RepoSnapshot
 from aicodebot.config import Session
 from aicodebot.helpers import logger
 from aicodebot.input import Chat, generate_prompt_session
-from aicodebot.lm import DEFAULT_CONTEXT_TOKENS, LanguageModelManager
+from aicodebot.lm import DEFAULT_CONTEXT_TOKENS, LanguageModelManager, prompt_cache_usage
 from aicodebot.output import OurMarkdown, RichLiveCallbackHandler, get_console
 from aicodebot.prompts import generate_files_context, get_prompt
+from aicodebot.repo import get_git_backend
 
 
 @click.command()
@@ -19,8 +21,21 @@ from aicodebot.prompts import generate_files_context, get_prompt
 @click.option("-r", "--request", help="What to ask your sidekick to do")
 @click.option("-n", "--no-files", is_flag=True, help="Don't automatically load any files for context")
 @click.option("-m", "--max-file-tokens", type=int, default=10_000, help="Don't load files larger than this")
+@click.option(
+    "-o",
+    "--outline",
+    is_flag=True,
+    help="Show large source files as outlines, except what changed or is named in the request",
+)
+@click.option(
+    "-k",
+    "--top-k",
+    type=int,
+    default=0,
+    help="Search the repo (offline) for the N parts most relevant to each request, and add them to the context",
+)
 @click.argument("files", nargs=-1, type=click.Path(exists=True, readable=True))
-def sidekick(apply, request, no_files, max_file_tokens, files):  # noqa: PLR0915
+def sidekick(apply, request, no_files, max_file_tokens, files, *, outline, top_k):  # noqa: PLR0915
     """
     Coding help from your AI sidekick coding assistant
     FILES: List of files to be used as context for the session
@@ -36,21 +51,31 @@ def sidekick(apply, request, no_files, max_file_tokens, files):  # noqa: PLR0915
 
     # ----------------- Determine which files to use for context ----------------- #
 
+    # Keep the session in memory for the whole run, it's only written when the files change
+    session = Session()
+    snapshot = RepoSnapshot()
+
     if files:  # User supplied list of files
-        context = generate_files_context(files)
+        context = generate_files_context(files, snapshot)
     elif not no_files:
         # Determine which files to use for context automagically, with git
-        session_data = Session.read()
-        if session_data.get("files"):
+        if session.get("files"):
             console.print("Using files from the last session for context.", style="dim")
-            files = session_data["files"]
+            files = session.get("files")
         else:
             console.print("Using recent git commits and current changes for context.", style="dim")
-            files = Coder.auto_file_context(DEFAULT_CONTEXT_TOKENS, max_file_tokens)
+            packing = Coder.pack_file_context(DEFAULT_CONTEXT_TOKENS, max_file_tokens, snapshot)
+            files = packing.selected
+            if packing.excluded:
+                reasons = Counter(packing.excluded.values())
+                console.print(
+                    "Left out: " + ", ".join(f"{count} {reason}" for reason, count in reasons.most_common()),
+                    style="dim",
+                )
 
-        context = generate_files_context(files)
+        context = generate_files_context(files, snapshot)
     else:
-        context = generate_files_context([])
+        context = generate_files_context([], snapshot)
 
     # Convert it from a list or a tuple to a set to remove duplicates
     files = set(files)
@@ -67,7 +92,7 @@ def sidekick(apply, request, no_files, max_file_tokens, files):  # noqa: PLR0915
     our_input_session = generate_prompt_session()
 
     lmm = LanguageModelManager()
-    prompt = get_prompt("sidekick")
+    prompt = get_prompt("sidekick", cache_control=lmm.provider == lmm.ANTHROPIC)
 
     while True:  # continuous loop for multiple questions
         if request:
@@ -79,15 +104,23 @@ def sidekick(apply, request, no_files, max_file_tokens, files):  # noqa: PLR0915
         if parsed_human_input == chat.BREAK:
             break
 
+        # Files may have been edited since the last turn, so ask git and the file system again
+        get_git_backend().invalidate()
+        snapshot = RepoSnapshot()
+
         # Update the context for the new list of files
-        context = generate_files_context(chat.file_context)
+        context = generate_files_context(
+            chat.file_context,
+            snapshot,
+            outline=outline,
+            request=parsed_human_input if isinstance(parsed_human_input, str) else None,
+            top_k=top_k,
+        )
         languages = ",".join(Coder.identify_languages(chat.file_context))
         our_input_session.completer.file_context = chat.file_context
 
         # Save the files for the next session
-        session_data = Session.read()
-        session_data["files"] = list(chat.file_context)
-        Session.write(session_data)
+        session.set("files", sorted(chat.file_context))
 
         if parsed_human_input == chat.CONTINUE:
             continue
@@ -108,7 +141,7 @@ def sidekick(apply, request, no_files, max_file_tokens, files):  # noqa: PLR0915
                 chain = prompt | llm
 
                 chat.raw_response = chain.invoke(
-                    {"task": parsed_human_input, "context": context, "languages": languages}
+                    {"task": parsed_human_input, "languages": languages, **context._asdict()}
                 )
 
                 # One last "live" update with the full response
@@ -136,6 +169,13 @@ def sidekick(apply, request, no_files, max_file_tokens, files):  # noqa: PLR0915
             console.print("\n\nOk, I'll stop talking. Hit Ctrl-C again to quit.", style=console.bot_style)
             continue
 
+        usage = prompt_cache_usage(chat.raw_response)
+        if usage:
+            prompt_tokens, cached_tokens = usage
+            console.print(f"Prompt: {prompt_tokens:,} tokens, {cached_tokens:,} from the cache", style="dim")
+
         if request:
             # If we were given a request, then we only want to run once
             break
+
+    session.flush()
@@ -1,9 +1,20 @@
+import atexit
+import copy
 import os
+import stat
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 import yaml
 
-from aicodebot.helpers import create_and_write_file, logger
+from aicodebot.helpers import logger
+from aicodebot.profiling import CONFIG, span
+
+try:
+    import fcntl
+except ImportError:  # Windows doesn't have fcntl, so we skip the inter-process lock there
+    fcntl = None
 
 
 def get_local_data_dir():
@@ -23,22 +34,53 @@ def get_config_file():
     return Path(os.getenv("AICODEBOT_CONFIG_FILE", get_local_data_dir() / "config.yaml"))
 
 
+# Parsed YAML files, keyed by path, along with the (mtime, size) they were parsed at
+_yaml_cache = {}
+_MISSING = object()
+
+
+@span(CONFIG)
+def load_yaml_file(path, default=None):
+    """Load a YAML file, parsing it only once per process unless its mtime or size changes.
+
+    Returns a copy, so callers can modify it without touching the cache. Returns default if the file doesn't exist.
+    """
+    path = Path(path)
+    try:
+        file_stat = path.stat()
+    except FileNotFoundError:
+        _yaml_cache.pop(path, None)
+        return default
+
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    cached_signature, data = _yaml_cache.get(path, (None, _MISSING))
+    if cached_signature != signature:
+        logger.debug(f"Parsing {path}")
+        with path.open("r") as f:
+            data = yaml.safe_load(f)
+        _yaml_cache[path] = (signature, data)
+
+    return copy.deepcopy(data)
+
+
+def reload():
+    """Forget the cached config and session files, so the next read comes from disk (used after we write them)."""
+    _yaml_cache.clear()
+
+
 def read_config():
     """Read the config file and return its contents as a dictionary."""
     config_file = get_config_file()
     logger.debug(f"Using config file {config_file}")
-    if config_file.exists():
-        logger.debug(f"Config file {config_file} exists")
-        with Path(config_file).open("r") as f:
-            out = yaml.safe_load(f)
-
-            # Load the session data
-            out["session"] = Session.read()
-            return out
-    else:
+    out = load_yaml_file(config_file, default=_MISSING)
+    if out is _MISSING:
         logger.debug(f"Config file {config_file} does not exist")
         return None
 
+    # Load the session data
+    out["session"] = Session.read()
+    return out
+
 
 def detect_api_keys():
     """Detect existing API keys from environment variables."""
@@ -108,7 +150,62 @@ async def fetch_models_for_provider(provider, api_key):
 
 
 class Session:
-    """Read and write local session data"""
+    """Read and write local session data
+
+    The classmethods read and write the session file directly. For long running commands like sidekick,
+    create a Session instance instead: it keeps the data in memory, tracks which keys changed, and only
+    writes those changes, in a background flush shortly after they happen (and at exit).
+    """
+
+    FLUSH_DELAY_SECONDS = 1
+
+    def __init__(self):
+        self.data = self.read()
+        self.dirty_keys = set()
+        self._flush_timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):  # noqa: A003
+        """Set a value, scheduling a write only if it actually changed."""
+        if self.data.get(key) == value:
+            return
+
+        with self._lock:
+            self.data[key] = copy.deepcopy(value)
+            self.dirty_keys.add(key)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.FLUSH_DELAY_SECONDS, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        """Write our changed keys to disk, merged into what's there now, so other sessions' changes survive."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self.dirty_keys:
+                return
+
+            with self.locked():
+                session_data = self.read()
+                session_data.update({key: self.data[key] for key in self.dirty_keys})
+                self.write(session_data)
+            self.dirty_keys.clear()
+
+    @classmethod
+    @contextmanager
+    def locked(cls):
+        """Hold an exclusive lock on the session file, so concurrent read-modify-writes don't interleave."""
+        lock_file = cls.get_config_file().with_name(cls.get_config_file().name + ".lock")
+        with lock_file.open("a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # The lock is released when the file is closed
 
     @classmethod
     def get_config_file(cls):
@@ -119,17 +216,24 @@ class Session:
         """Read the session file and return its contents as a dictionary."""
         session_file = cls.get_config_file()
         logger.debug(f"Using session file {session_file}")
-        if session_file.exists():
-            logger.debug(f"Session file {session_file} exists")
-            with Path(session_file).open("r") as f:
-                return yaml.safe_load(f)
-        else:
-            logger.debug(f"Session file {session_file} does not exist")
-            return {}
+        return load_yaml_file(session_file, default={})
 
     @classmethod
     def write(cls, session_data):
         session_file = cls.get_config_file()
         logger.debug(f"Writing session data to {session_file}")
         data = yaml.safe_dump(session_data)
-        create_and_write_file(session_file, data, overwrite=True)
+
+        # Write to a temp file and rename it into place, so no one ever reads a half written file.
+        # The temp file gets the mode of the file it replaces, or for a new one the default (from the umask)
+        try:
+            mode = stat.S_IMODE(session_file.stat().st_mode)
+        except FileNotFoundError:
+            mode = None
+        temp_path = session_file.with_name(f".{session_file.name}.{os.getpid()}.{threading.get_ident()}")
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666), "w") as temp_file:
+            temp_file.write(data)
+        if mode is not None:
+            temp_path.chmod(mode)
+        temp_path.replace(session_file)
+        _yaml_cache.pop(session_file, None)
@@ -5,6 +5,8 @@ from pathlib import Path
 
 from loguru import logger
 
+from aicodebot.profiling import GIT, span
+
 # ---------------------------------------------------------------------------- #
 #                    Global logging configuration for loguru                   #
 # ---------------------------------------------------------------------------- #
@@ -32,6 +34,7 @@ def create_and_write_file(filename, text, overwrite=False):
         f.write(text)
 
 
+@span(GIT)
 def exec_and_get_output(command):
     """Execute a command and return its output as a string."""
     logger.debug(f"Executing command: {' '.join(command)}")
@@ -0,0 +1,226 @@
+import ast
+import functools
+import json
+import posixpath
+import re
+import sqlite3
+import weakref
+from collections import deque
+from pathlib import Path
+
+from aicodebot.config import get_local_data_dir
+from aicodebot.helpers import logger
+from aicodebot.walk import git_ls_files, walk
+
+PYTHON_EXTENSIONS = (".py", ".pyi")
+JAVASCRIPT_EXTENSIONS = (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx")
+
+# Bigger source files than this are generated, or vendored, and not worth parsing
+MAX_SOURCE_BYTES = 1_000_000
+
+# ---------------------------------------------------------------------------- #
+#                                Import scanners                               #
+# ---------------------------------------------------------------------------- #
+
+
+def python_imports(source, path):
+    """The modules a Python file imports. Relative imports are made absolute from path.
+
+    Each import is a list of dotted names, where the first one that's a module in the project is the
+    one imported: `from a import b` is [a.b, a], since b may be a module, or a name in a."""
+    try:
+        tree = ast.parse(source, filename=path)
+    except (SyntaxError, ValueError) as e:
+        logger.debug(f"Unable to parse {path} for imports: {e}")
+        return []
+
+    package = path.rsplit("/", 1)[0].replace("/", ".") if "/" in path else ""
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend([alias.name] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                # from . import x is relative to the file's package, each extra dot goes up one more
+                base = package.split(".") if package else []
+                base = base[: len(base) - (node.level - 1)] if node.level > 1 else base
+                module = ".".join(part for part in [*base, node.module or ""] if part)
+            else:
+                module = node.module
+            for alias in node.names:
+                imports.append([f"{module}.{alias.name}", module] if module else [alias.name])
+    return [list(names) for names in dict.fromkeys(tuple(names) for names in imports)]
+
+
+JAVASCRIPT_IMPORT_PATTERN = re.compile(
+    r"""(?:\bimport\s+(?:[\w*{}\s,$]+\s+from\s+)?|\bexport\s+[\w*{}\s,$]+\s+from\s+|\b(?:require|import)\s*\(\s*)"""
+    r"""["']([^"'\n]+)["']"""
+)
+
+
+def javascript_imports(source):
+    """The module specifiers a JavaScript or TypeScript file imports (import, export from, require, import())."""
+    return list(dict.fromkeys(JAVASCRIPT_IMPORT_PATTERN.findall(source)))
+
+
+# ---------------------------------------------------------------------------- #
+#                                 Import graph                                 #
+# ---------------------------------------------------------------------------- #
+
+
+class ImportGraph:
+    """Which source files import which, for the Python and JavaScript/TypeScript files under a directory.
+
+    What each file imports is stored in SQLite in the local data directory, with the file's mtime and
+    size, so only the files that changed since last time are parsed again. Imports are stored as
+    written (module names, specifiers) and resolved to files when the graph is built, since what they
+    resolve to depends on which files exist.
+    """
+
+    def __init__(self, root, path):
+        self.root = Path(root).resolve()
+        self.key = str(self.root)
+        self.connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS file_imports ("
+                "root TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, imports TEXT, "
+                "PRIMARY KEY (root, path)) WITHOUT ROWID"
+            )
+        self.imports = {}  # path -> list of imports, as written
+        self.snapshot = None  # A weak reference to the RepoSnapshot we were last brought up to date for
+
+    def source_files(self):
+        """The source files we scan, relative to the root (from git ls-files, when in a repo)."""
+        paths = git_ls_files(self.root)
+        if paths is None:
+            paths = [entry.path for entry in walk(self.root) if not entry.is_dir]
+        return [path for path in paths if path.endswith(PYTHON_EXTENSIONS + JAVASCRIPT_EXTENSIONS)]
+
+    def update(self):
+        """Bring the stored imports up to date with the files on disk. Returns how many files were parsed."""
+        stored = {
+            path: (mtime_ns, size, imports)
+            for path, mtime_ns, size, imports in self.connection.execute(
+                "SELECT path, mtime_ns, size, imports FROM file_imports WHERE root = ?", (self.key,)
+            )
+        }
+
+        self.imports = {}
+        changed = []
+        for path in self.source_files():
+            try:
+                file_stat = (self.root / path).stat()
+            except OSError:
+                continue
+            if path in stored and stored[path][:2] == (file_stat.st_mtime_ns, file_stat.st_size):
+                self.imports[path] = json.loads(stored[path][2])
+                continue
+
+            imports = []
+            if file_stat.st_size <= MAX_SOURCE_BYTES:
+                source = (self.root / path).read_text(errors="replace")
+                if path.endswith(PYTHON_EXTENSIONS):
+                    imports = python_imports(source, path)
+                else:
+                    imports = javascript_imports(source)
+            self.imports[path] = imports
+            changed.append((self.key, path, file_stat.st_mtime_ns, file_stat.st_size, json.dumps(imports)))
+
+        removed = [(self.key, path) for path in stored if path not in self.imports]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO file_imports VALUES (?, ?, ?, ?, ?)", changed)
+            self.connection.executemany("DELETE FROM file_imports WHERE root = ? AND path = ?", removed)
+        if changed or removed:
+            logger.debug(f"Import graph: parsed {len(changed)} files, forgot {len(removed)}")
+        return len(changed)
+
+    # ------------------------------ Resolving imports ----------------------------- #
+
+    def python_modules(self):
+        """Map the module names a Python file can be imported by to its path.
+
+        A file can be imported relative to any directory that isn't a package itself (the repo, src/,
+        tests/ etc.), so pkg/sub/mod.py is pkg.sub.mod, but not sub.mod, as long as pkg/ has an __init__.py.
+        """
+        packages = {path.rsplit("/", 1)[0] for path in self.imports if path.endswith("/__init__.py")}
+        modules = {}
+        for path in sorted(self.imports, key=lambda path: (path.count("/"), path)):
+            if not path.endswith(PYTHON_EXTENSIONS):
+                continue
+            parts = path.rsplit(".", 1)[0].split("/")
+            if parts[-1] == "__init__":
+                parts = parts[:-1]
+            for start in range(len(parts)):
+                parent = "/".join(parts[:start])
+                if start == 0 or parent not in packages:
+                    modules.setdefault(".".join(parts[start:]), path)
+        return modules
+
+    def resolve_javascript(self, path, specifier):
+        """The file a relative import specifier refers to, or None (packages from node_modules, missing files)."""
+        if not specifier.startswith("."):
+            return None
+        base = posixpath.normpath(posixpath.join(posixpath.dirname(path), specifier))
+        candidates = [base]
+        candidates += [base + extension for extension in JAVASCRIPT_EXTENSIONS]
+        candidates += [f"{base}/index{extension}" for extension in JAVASCRIPT_EXTENSIONS]
+        stem, extension = posixpath.splitext(base)
+        if extension in (".js", ".jsx", ".mjs"):
+            # TypeScript imports the compiled name, import "./a.js" is a.ts
+            candidates += [stem + ".ts", stem + ".tsx"]
+        return next((candidate for candidate in candidates if candidate in self.imports), None)
+
+    def edges(self):
+        """Map each source file to the set of files it imports."""
+        modules = self.python_modules()
+        edges = {}
+        for path, imports in self.imports.items():
+            if path.endswith(PYTHON_EXTENSIONS):
+                targets = {next((modules[name] for name in names if name in modules), None) for names in imports}
+            else:
+                targets = {self.resolve_javascript(path, specifier) for specifier in imports}
+            edges[path] = targets - {None, path}
+        return edges
+
+    def related(self, files, max_depth=2, max_files=50):
+        """Files connected to files through imports (either way), nearest first, not including files.
+
+        Breadth first from files in the order given, so the neighbors of the first file come first.
+        At each file, what it imports comes before what imports it."""
+        imports = self.edges()
+        imported_by = {}
+        for path, targets in imports.items():
+            for target in targets:
+                imported_by.setdefault(target, set()).add(path)
+
+        seen = set(files)
+        queue = deque((file, 0) for file in files)
+        related = []
+        while queue and len(related) < max_files:
+            file, depth = queue.popleft()
+            if depth >= max_depth:
+                continue
+            for neighbor in [*sorted(imports.get(file, ())), *sorted(imported_by.get(file, ()))]:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    related.append(neighbor)
+                    queue.append((neighbor, depth + 1))
+        return related[:max_files]
+
+
+@functools.cache
+def _import_graph(root, path):
+    return ImportGraph(root, path)
+
+
+def get_import_graph(root=".", snapshot=None):
+    """Get the import graph for root (brought up to date), stored in the local data directory.
+
+    Bringing it up to date stats every source file, so with a snapshot (a RepoSnapshot, while it's in
+    use the working tree is taken not to change) that's only done the first time for that snapshot."""
+    graph = _import_graph(Path(root).resolve(), get_local_data_dir() / "import_graph.sqlite")
+    if snapshot is None or graph.snapshot is None or graph.snapshot() is not snapshot:
+        graph.update()
+        graph.snapshot = weakref.ref(snapshot) if snapshot is not None else None
+    return graph
@@ -12,8 +12,8 @@ from rich.panel import Panel
 from rich.table import Table
 
 from aicodebot.coder import Coder
-from aicodebot.commands import commit, review
-from aicodebot.lm import token_size
+from aicodebot.commands.commit import commit
+from aicodebot.commands.review import review
 from aicodebot.patch import Patch
 
 
@@ -62,9 +62,10 @@ class Chat:
         table = Table(show_header=True, header_style="bold magenta")
         table.add_column("File")
         table.add_column("Token Size")
+        token_counts = Coder.file_token_counts(self.file_context)
         for file in self.file_context:
-            tokens = token_size(Path(file).read_text())
-            table.add_row(file, humanize.intcomma(tokens))
+            tokens = token_counts[file]
+            table.add_row(file, "binary" if tokens is None else humanize.intcomma(tokens))
         self.console.print(table)
 
     # ----------------------- Sidekick / commands ----------------------- #
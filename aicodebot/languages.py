@@ -0,0 +1,130 @@
+import functools
+import mimetypes
+from pathlib import PurePath
+
+UNKNOWN_FILE_TYPE = "unknown"
+
+# ---------------------------------------------------------------------------- #
+#                      File type (language) from the file name                  #
+# ---------------------------------------------------------------------------- #
+
+# What pygments says for the file names we see the most, so we don't have to ask it (importing and
+# scanning its lexer modules is slow). tests/test_languages.py checks these still match pygments.
+FILE_TYPES_BY_NAME = {
+    "Dockerfile": "Docker",
+    "Gemfile": "Ruby",
+    "Makefile": "Makefile",
+    "Rakefile": "Ruby",
+    "LICENSE": UNKNOWN_FILE_TYPE,
+    "README": UNKNOWN_FILE_TYPE,
+}
+
+FILE_TYPES_BY_EXTENSION = {
+    ".bash": "Bash",
+    ".bat": "Batchfile",
+    ".c": "C",
+    ".cc": "C++",
+    ".cfg": "INI",
+    ".cjs": "JavaScript",
+    ".clj": "Clojure",
+    ".cmake": "CMake",
+    ".cpp": "C++",
+    ".cs": "C#",
+    ".css": "CSS",
+    ".cxx": "C++",
+    ".dart": "Dart",
+    ".diff": "Diff",
+    ".ex": "Elixir",
+    ".exs": "Elixir",
+    ".go": "Go",
+    ".graphql": "GraphQL",
+    ".groovy": "Groovy",
+    ".h": "C",
+    ".hpp": "C++",
+    ".hs": "Haskell",
+    ".htm": "HTML",
+    ".html": "HTML",
+    ".ini": "INI",
+    ".java": "Java",
+    ".jl": "Julia",
+    ".js": "JavaScript",
+    ".json": "JSON",
+    ".jsx": "JSX",
+    ".kt": "Kotlin",
+    ".kts": "Kotlin",
+    ".lua": "Lua",
+    ".md": "Markdown",
+    ".mjs": "JavaScript",
+    ".php": "PHP",
+    ".pl": "Perl",
+    ".proto": "Protocol Buffer",
+    ".ps1": "PowerShell",
+    ".py": "Python",
+    ".pyi": "Python",
+    ".rb": "Ruby",
+    ".rs": "Rust",
+    ".rst": "reStructuredText",
+    ".sass": "Sass",
+    ".scala": "Scala",
+    ".scss": "SCSS",
+    ".sh": "Bash",
+    ".svg": "XML",
+    ".swift": "Swift",
+    ".tex": "TeX",
+    ".tf": "Terraform",
+    ".toml": "TOML",
+    ".ts": "TypeScript",
+    ".tsx": "TSX",
+    ".txt": "Text only",
+    ".vue": "Vue",
+    ".xml": "XML",
+    ".yaml": "YAML",
+    ".yml": "YAML",
+    ".zig": "Zig",
+    ".zsh": "Bash",
+    # Binary files
+    ".gif": UNKNOWN_FILE_TYPE,
+    ".ico": UNKNOWN_FILE_TYPE,
+    ".jpeg": UNKNOWN_FILE_TYPE,
+    ".jpg": UNKNOWN_FILE_TYPE,
+    ".pdf": UNKNOWN_FILE_TYPE,
+    ".png": UNKNOWN_FILE_TYPE,
+    ".pyc": UNKNOWN_FILE_TYPE,
+    ".zip": UNKNOWN_FILE_TYPE,
+}
+
+
+def get_file_type(file_path):
+    """The file type (language) of a file, from its name, like "Python". No I/O.
+
+    Common names come from the tables above, anything else from pygments, once per extension
+    (or per name, for files without one).
+    """
+    name = PurePath(file_path).name
+    if name in FILE_TYPES_BY_NAME:
+        return FILE_TYPES_BY_NAME[name]
+
+    extension = PurePath(name).suffix
+    if extension in FILE_TYPES_BY_EXTENSION:
+        return FILE_TYPES_BY_EXTENSION[extension]
+
+    # Ask about a made up name with the same extension, so the answer only depends on the extension
+    return pygments_file_type(f"file{extension}" if extension else name)
+
+
+@functools.cache
+def pygments_file_type(file_name):
+    """Ask pygments for the file type, by the MIME type for the name, or else the lexer file name patterns."""
+    # Imported here, loading pygments' lexer registry is slow and usually not needed
+    from pygments.lexers import ClassNotFound, get_lexer_for_mimetype, guess_lexer_for_filename  # noqa: PLC0415
+
+    mime_type = mimetypes.guess_type(file_name)[0]
+    try:
+        # Try to get the lexer for the MIME type
+        return get_lexer_for_mimetype(mime_type).name
+    except ClassNotFound:
+        try:
+            # If that fails, try to guess the lexer based on the file name
+            return guess_lexer_for_filename(file_name, "").name
+        except ClassNotFound:
+            return UNKNOWN_FILE_TYPE
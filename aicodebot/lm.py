@@ -1,9 +1,13 @@
-import tiktoken
+import time
+
 from langchain_anthropic import ChatAnthropic
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_openai import ChatOpenAI
 
 from aicodebot.config import read_config
 from aicodebot.helpers import logger
+from aicodebot.profiling import FIRST_TOKEN, STREAM, profiler
+from aicodebot.tokens import TIKTOKEN_MODEL_NAME, count_tokens
 
 DEFAULT_RESPONSE_TOKENS = 1_000
 DEFAULT_MEMORY_TOKENS = DEFAULT_RESPONSE_TOKENS * 2
@@ -41,6 +45,8 @@ class LanguageModelManager:
         """Get a model object for the specified model name."""
 
         provider, model_name = self.read_model_config()
+        if profiler.enabled:
+            callbacks = [*(callbacks or []), TimingCallbackHandler()]
 
         if provider == self.OPENAI:
             api_key = self.get_api_key("OPENAI_API_KEY")
@@ -51,6 +57,8 @@ class LanguageModelManager:
                 max_tokens=response_token_size,
                 temperature=temperature,
                 streaming=streaming,
+                # So streamed responses include the token usage, like how much of the prompt was cached
+                stream_usage=True,
                 callbacks=callbacks,
             )
         elif provider == self.ANTHROPIC:
@@ -95,9 +103,7 @@ class LanguageModelManager:
 
     def get_token_size(self, text):
         """Get the number of tokens in a string using the tiktoken library."""
-        encoding = tiktoken.encoding_for_model(self.tiktoken_model_name)
-        tokens = encoding.encode(text)
-        return len(tokens)
+        return count_tokens(text)
 
     def read_model_config(self):
         # Figure out which model to use, based on the configuration file or environment variables
@@ -142,8 +148,7 @@ class LanguageModelManager:
 
     @property
     def tiktoken_model_name(self):
-        # This seems to work for both OpenAI and Anthropic
-        return "gpt-4o"
+        return TIKTOKEN_MODEL_NAME
 
     def use_appropriate_sized_model(self, chain, token_size):
         current_model = self.model_name
@@ -174,6 +179,39 @@ class LanguageModelManager:
         return current_model, self.model_name
 
 
+class TimingCallbackHandler(BaseCallbackHandler):
+    """Records the time to the first token and the time for the full response, for `aicodebot --profile`"""
+
+    def __init__(self):
+        self.start = None
+        self.waiting_for_first_token = False
+
+    def on_llm_start(self, *args, **kwargs):
+        self.start = time.perf_counter()
+        self.waiting_for_first_token = True
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.waiting_for_first_token:
+            profiler.record(FIRST_TOKEN, time.perf_counter() - self.start)
+            self.waiting_for_first_token = False
+
+    def on_llm_end(self, *args, **kwargs):
+        if self.start is not None:
+            profiler.record(STREAM, time.perf_counter() - self.start)
+            self.start = None
+
+
+def prompt_cache_usage(response):
+    """How many of the prompt tokens for a response were read from the provider's prompt cache.
+
+    Returns (prompt tokens, cached tokens), or None if the provider didn't report usage."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None
+    details = usage.get("input_token_details") or {}
+    return usage["input_tokens"], details.get("cache_read", 0)
+
+
 def token_size(text):
-    # Shortcut
-    return LanguageModelManager().get_token_size(text)
+    # Shortcut, kept for backwards compatibility. Doesn't need a model (or the config), so skip the manager.
+    return count_tokens(text)
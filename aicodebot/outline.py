@@ -0,0 +1,382 @@
+import ast
+import bisect
+import functools
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from aicodebot.config import get_local_data_dir
+from aicodebot.helpers import logger
+from aicodebot.search import STOP_WORDS
+
+# Bump this when outlines come out differently, so the cached ones are built again
+OUTLINE_VERSION = 1
+
+# Statements (other than imports) longer than this many lines are cut to their first line
+MAX_STATEMENT_LINES = 3
+
+# Keywords that start a definition, for the languages where pygments doesn't mark the name
+DECLARATION_KEYWORDS = {
+    "class",
+    "def",
+    "enum",
+    "extension",
+    "fn",
+    "func",
+    "function",
+    "impl",
+    "interface",
+    "module",
+    "object",
+    "protocol",
+    "struct",
+    "trait",
+    "type",
+}
+IMPORT_KEYWORDS = {"import", "from", "package", "require", "use", "using"}
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*")
+CALL_PATTERN = re.compile(r"([A-Za-z_][A-Za-z0-9_.]*)\(")
+CODE_SPAN_PATTERN = re.compile(r"`([^`]*)`")
+
+# Words in requests that are also common function names, but don't say which function. Plain words
+# like these only count as names when they're written as code: `get`, or get()
+COMMON_WORDS = {
+    "add",
+    "call",
+    "change",
+    "check",
+    "fix",
+    "get",
+    "make",
+    "new",
+    "remove",
+    "run",
+    "set",
+    "show",
+    "test",
+    "update",
+    "use",
+}
+
+
+class Outline(NamedTuple):
+    """The outline of a source file: which lines to show, and where each function and class is."""
+
+    ranges: list  # [start, end] line ranges (from 1, inclusive) that make up the outline
+    symbols: list  # [qualified name, start, end] for each function and class
+
+
+# ---------------------------------------------------------------------------- #
+#                                Building outlines                             #
+# ---------------------------------------------------------------------------- #
+
+
+def outline_language(file_name):
+    """What we outline file_name as: "python", the name of the pygments lexer for it, or "" for neither."""
+    return _outline_language(Path(file_name).name)
+
+
+@functools.lru_cache(maxsize=1_000)
+def _outline_language(name):
+    if name.endswith((".py", ".pyi")):
+        return "python"
+    # Imported here, loading pygments' lexer registry is slow and usually not needed
+    from pygments.lexers import get_lexer_for_filename  # noqa: PLC0415
+    from pygments.util import ClassNotFound  # noqa: PLC0415
+
+    try:
+        return get_lexer_for_filename(name).name
+    except ClassNotFound:
+        return ""
+
+
+def build_outline(source, file_name):
+    """The outline of source (signatures, class and method headers, docstrings), or None if we can't make one."""
+    if file_name.endswith((".py", ".pyi")):
+        return python_outline(source)
+    return pygments_outline(source, file_name)
+
+
+def python_outline(source):
+    """Outline Python source with ast: imports, short statements, and the headers and docstrings of
+    functions and classes (and the methods in classes). Function bodies are left out."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    ranges, symbols = [], []
+
+    def docstring(node):
+        first = node.body[0] if node.body else None
+        if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+            return first
+        return None
+
+    def visit(body, prefix):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                start = min([node.lineno, *(decorator.lineno for decorator in node.decorator_list)])
+                name = prefix + node.name
+                symbols.append([name, start, node.end_lineno])
+                ranges.append([start, max(node.lineno, node.body[0].lineno - 1)])
+                doc = docstring(node)
+                if doc:
+                    ranges.append([doc.lineno, doc.end_lineno])
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body[1:] if doc else node.body, name + ".")
+            elif (
+                isinstance(node, (ast.Import, ast.ImportFrom))
+                or node is module_doc
+                or node.end_lineno - node.lineno < MAX_STATEMENT_LINES
+            ):
+                ranges.append([node.lineno, node.end_lineno])
+            else:
+                ranges.append([node.lineno, node.lineno])
+
+    module_doc = docstring(tree)
+    visit(tree.body, "")
+    if not symbols:
+        return None
+
+    # With the comments right above each part we show
+    source_lines = source.split("\n")
+    for line_range in ranges:
+        while line_range[0] > 1 and source_lines[line_range[0] - 2].lstrip().startswith("#"):
+            line_range[0] -= 1
+    return Outline(merge_ranges(ranges), symbols)
+
+
+def pygments_outline(source, file_name):
+    """Outline other languages from the pygments token stream: imports, and the lines that define
+    functions and classes, with the comments right above them. A definition runs until the next one
+    that's indented as far or less."""
+    # Imported here, loading pygments' lexer registry is slow and usually not needed
+    from pygments.lexers import get_lexer_for_filename  # noqa: PLC0415
+    from pygments.token import Comment, Keyword, Name, Punctuation, String, Text, Whitespace  # noqa: PLC0415
+    from pygments.util import ClassNotFound  # noqa: PLC0415
+
+    try:
+        lexer = get_lexer_for_filename(file_name)
+    except ClassNotFound:
+        return None
+
+    line_starts = [0] + [match.end() for match in re.finditer("\n", source)]
+    lines = {}  # line number -> [(token type, value)], leaving out whitespace
+    for index, token_type, value in lexer.get_tokens_unprocessed(source):
+        if value.strip() and token_type not in Whitespace and token_type not in Text:
+            # Tokens can span lines, like block comments, so they're on each of them
+            first_line = bisect.bisect_right(line_starts, index)
+            for line_number in range(first_line, first_line + value.rstrip("\n").count("\n") + 1):
+                lines.setdefault(line_number, []).append((token_type, value))
+
+    def is_comment(line_number):
+        tokens = lines.get(line_number)
+        return bool(tokens) and all(token_type in Comment or token_type in String.Doc for token_type, _value in tokens)
+
+    def definition_name(tokens):
+        """The name defined on a line, or None."""
+        for token_type, value in tokens:
+            if token_type in Name.Function or token_type in Name.Class:
+                return value
+        after_keyword = None
+        for position, (token_type, value) in enumerate(tokens):
+            if after_keyword is None:
+                if token_type in Keyword and value in DECLARATION_KEYWORDS:
+                    after_keyword = position + 1
+                continue
+            # The name is the one followed by the parameter list, like `func (t T) Method(`, or else the first one
+            if token_type in Name and position + 1 < len(tokens) and tokens[position + 1] == (Punctuation, "("):
+                return value
+        if after_keyword is not None:
+            return next((value for token_type, value in tokens[after_keyword:] if token_type in Name), None)
+        return None
+
+    source_lines = source.split("\n")
+    ranges, definitions = [], []
+    for line_number, tokens in sorted(lines.items()):
+        first_type, first_value = tokens[0]
+        if first_type in Keyword.Namespace or first_type in Comment.Preproc or first_value in IMPORT_KEYWORDS:
+            ranges.append([line_number, line_number])
+            continue
+        name = definition_name(tokens)
+        if name:
+            start = line_number
+            while is_comment(start - 1):
+                start -= 1
+            ranges.append([start, line_number])
+            line = source_lines[line_number - 1]
+            definitions.append((name, start, line_number, len(line) - len(line.lstrip())))
+
+    symbols = []
+    for position, (name, start, line_number, indent) in enumerate(definitions):
+        end = len(source_lines)
+        for _other, other_start, _other_line, other_indent in definitions[position + 1 :]:
+            if other_indent <= indent:
+                end = other_start - 1
+                break
+        symbols.append([name, start, max(end, line_number)])
+    return Outline(merge_ranges(ranges), symbols) if symbols else None
+
+
+def merge_ranges(ranges):
+    """Sort [start, end] line ranges, merging the ones that overlap or touch."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+# ---------------------------------------------------------------------------- #
+#                               Rendering outlines                             #
+# ---------------------------------------------------------------------------- #
+
+
+def expand_outline(outline, names=(), lines=()):
+    """The line ranges to show: the outline, with the whole of each symbol that's named (by its name,
+    or its qualified name, like Class.method), or that contains one of lines (the innermost one)."""
+    names = set(names)
+    ranges = [list(line_range) for line_range in outline.ranges]
+    for name, start, end in outline.symbols:
+        if name in names or name.rsplit(".", 1)[-1] in names:
+            ranges.append([start, end])
+    for line in lines:
+        containing = [(end - start, start, end) for _name, start, end in outline.symbols if start <= line <= end]
+        if containing:
+            _size, start, end = min(containing)
+            ranges.append([start, end])
+        else:
+            ranges.append([line, line])
+    return merge_ranges(ranges)
+
+
+def render_outline(text, ranges):
+    """The lines of text in ranges, numbered, with a marker where lines were left out."""
+    lines = text.split("\n")
+
+    def numbered(first, last):
+        return [f"{number}: {lines[number - 1]}" for number in range(first, last + 1)]
+
+    rendered = []
+    next_line = 1
+    for start, end in [*ranges, [len(lines) + 1, len(lines)]]:
+        # Blank lines at either end of a gap are cheap, and easier to read than a marker
+        hidden_start, hidden_end = next_line, start - 1
+        while hidden_start <= hidden_end and not lines[hidden_start - 1].strip():
+            hidden_start += 1
+        while hidden_end >= hidden_start and not lines[hidden_end - 1].strip():
+            hidden_end -= 1
+        rendered += numbered(next_line, hidden_start - 1)
+        if hidden_start <= hidden_end:
+            rendered.append(f"... lines {hidden_start}-{hidden_end} not shown")
+        rendered += numbered(hidden_end + 1, start - 1)
+        rendered += numbered(start, min(end, len(lines)))
+        next_line = end + 1
+    return "\n".join(rendered)
+
+
+def request_names(request):
+    """The identifiers in a request, and each part of the dotted ones, to match against symbol names.
+
+    Identifiers that look like code (snake_case, camelCase, dotted, in backticks, or called) always
+    count. Plain words only count when they aren't common English, or common words like get and run."""
+    request = request or ""
+    code = set(CALL_PATTERN.findall(request))
+    for span in CODE_SPAN_PATTERN.findall(request):
+        code.update(IDENTIFIER_PATTERN.findall(span))
+    code = {identifier.strip(".") for identifier in code}
+
+    names = set()
+    for match in IDENTIFIER_PATTERN.findall(request):
+        identifier = match.strip(".")
+        looks_like_code = "_" in identifier or "." in identifier or identifier[1:] != identifier[1:].lower()
+        if not looks_like_code and identifier not in code and identifier.lower() in STOP_WORDS | COMMON_WORDS:
+            continue
+        names.add(identifier)
+        names.update(identifier.split("."))
+    names.discard("")
+    return names
+
+
+# ---------------------------------------------------------------------------- #
+#                                 Outline cache                                #
+# ---------------------------------------------------------------------------- #
+
+
+class OutlineCache:
+    """An on-disk cache that maps a content hash (the git blob SHA) to its outline, like TokenCountCache.
+
+    Unchanged files hash to the same blob SHA, so we only parse a file again when it changes. The same
+    content outlines differently in another language (foo.py and foo.txt), so that's part of the key too.
+    Files we can't outline are cached too, as None. The least recently used entries are evicted first.
+    """
+
+    DEFAULT_MAX_ENTRIES = 20_000
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self.connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS outlines ("
+                "blob_sha TEXT, language TEXT, version INTEGER, outline TEXT, last_used INTEGER, "
+                "PRIMARY KEY (blob_sha, language, version)) WITHOUT ROWID"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS outlines_lru ON outlines (last_used)")
+
+    def get(self, blob_sha, source, file_name):
+        """The outline for the blob, from the cache, or built from source (and file_name) and cached."""
+        language = outline_language(file_name)
+        row = self.connection.execute(
+            "SELECT outline FROM outlines WHERE blob_sha = ? AND language = ? AND version = ?",
+            (blob_sha, language, OUTLINE_VERSION),
+        ).fetchone()
+        now = time.time_ns()
+        if row:
+            self.hits += 1
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE outlines SET last_used = ? WHERE blob_sha = ? AND language = ? AND version = ?",
+                    (now, blob_sha, language, OUTLINE_VERSION),
+                )
+            stored = json.loads(row[0])
+            return Outline(*stored) if stored else None
+
+        self.misses += 1
+        outline = build_outline(source, file_name)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO outlines (blob_sha, language, version, outline, last_used) VALUES (?, ?, ?, ?, ?)",
+                (blob_sha, language, OUTLINE_VERSION, json.dumps(outline), now),
+            )
+            self.evict()
+        return outline
+
+    def evict(self):
+        (entries,) = self.connection.execute("SELECT COUNT(*) FROM outlines").fetchone()
+        if entries > self.max_entries:
+            logger.debug(f"Evicting {entries - self.max_entries} entries from the outline cache")
+            self.connection.execute(
+                "DELETE FROM outlines WHERE (blob_sha, language, version) IN "
+                "(SELECT blob_sha, language, version FROM outlines ORDER BY last_used LIMIT ?)",
+                (entries - self.max_entries,),
+            )
+
+
+@functools.cache
+def _outline_cache(path):
+    return OutlineCache(path)
+
+
+def get_outline_cache():
+    """Get the outline cache, stored in the local data directory."""
+    return _outline_cache(get_local_data_dir() / "outlines.sqlite")
@@ -8,6 +8,7 @@ from rich.style import Style
 from rich.syntax import Syntax
 
 from aicodebot.helpers import logger
+from aicodebot.profiling import RENDER, span
 
 
 class RichLiveCallbackHandler(BaseCallbackHandler):
@@ -25,12 +26,14 @@ class RichLiveCallbackHandler(BaseCallbackHandler):
             message = f"Sending request to *{model_name}*..."
         else:
             message = "Sending request to the language model..."
-        self.live.update(Panel(OurMarkdown(message)), refresh=True)
+        with span(RENDER):
+            self.live.update(Panel(OurMarkdown(message)), refresh=True)
 
     def on_llm_new_token(self, token, **kwargs):
         """Print out Markdown when we get a new token, using rich.live so it updates the whole terminal"""
         self.buffer.append(token)
-        self.live.update(OurMarkdown("".join(self.buffer), style=self.style), refresh=True)
+        with span(RENDER):
+            self.live.update(OurMarkdown("".join(self.buffer), style=self.style), refresh=True)
 
     def on_llm_end(self, *args, **kwargs):
         self.buffer = []
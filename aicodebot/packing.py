@@ -0,0 +1,107 @@
+from typing import NamedTuple
+
+# Without scores, relevance falls off with rank: each file counts for this much of the one before it
+RELEVANCE_DECAY = 0.9
+
+# How many of the most relevant left out items we try to swap in, each one is a pass over the selection
+MAX_SWAPS = 16
+
+# Why an item was left out
+OVER_BUDGET = "over the budget"
+LARGER_THAN_BUDGET = "larger than the whole budget"
+
+
+class Packing(NamedTuple):
+    """What went into the budget (in the order given), and what didn't, with why."""
+
+    selected: list
+    excluded: dict  # item -> reason
+    tokens: int
+    relevance: float
+
+
+def rank_relevance(items, decay=RELEVANCE_DECAY):
+    """Relevance from the order of items, most relevant first."""
+    return {item: decay**rank for rank, item in enumerate(items)}
+
+
+def pack(token_counts, max_tokens, relevance=None, required=()):
+    """Choose the items with the most total relevance that fit in max_tokens.
+
+    token_counts maps each item to its size in tokens, most relevant first. relevance maps each item to
+    a score, by default from the order (see rank_relevance). The required items (like the files being
+    changed) go in first, in order, as long as they fit, and the rest are packed into the room that's left.
+
+    This is the knapsack problem. We fill the budget greedily by relevance per token, which wastes
+    little when items are small compared to the budget. When they aren't, a relevant item can be left
+    out for lack of room, so we then try to swap each of the most relevant left out items in for the
+    least dense selected items, when that gains relevance, and fill what room is left again.
+    It takes O(n log n), about a millisecond for 500 items.
+    """
+    names = list(token_counts)
+    relevance = relevance if relevance is not None else rank_relevance(names)
+    rank = {name: index for index, name in enumerate(names)}
+    excluded = {}
+
+    candidates = []
+    for name in names:
+        if token_counts[name] > max_tokens:
+            excluded[name] = LARGER_THAN_BUDGET
+        else:
+            candidates.append(name)
+
+    def density(name):
+        return relevance[name] / max(token_counts[name], 1)
+
+    selected = set()
+    room = max_tokens
+    required = [name for name in dict.fromkeys(required) if name in token_counts and name not in excluded]
+    for name in required:
+        if token_counts[name] <= room:
+            selected.add(name)
+            room -= token_counts[name]
+
+    # Required items are never swapped out, or in
+    by_density = sorted(
+        (name for name in candidates if name not in required), key=lambda name: (-density(name), rank[name])
+    )
+
+    def fill():
+        nonlocal room
+        for name in by_density:
+            if name not in selected and token_counts[name] <= room:
+                selected.add(name)
+                room -= token_counts[name]
+
+    fill()
+
+    # Correction: swap in relevant items that were left out, if it's worth what they displace
+    left_out = sorted((name for name in by_density if name not in selected), key=lambda name: -relevance[name])
+    for name in left_out[:MAX_SWAPS]:
+        if name in selected:
+            continue
+        needed = token_counts[name] - room
+        evicted, freed, lost = [], 0, 0.0
+        for other in reversed(by_density):
+            if freed >= needed:
+                break
+            if other in selected:
+                evicted.append(other)
+                freed += token_counts[other]
+                lost += relevance[other]
+        if freed < needed or lost >= relevance[name]:
+            continue
+        selected.difference_update(evicted)
+        selected.add(name)
+        room += freed - token_counts[name]
+        fill()
+
+    for name in candidates:
+        if name not in selected:
+            excluded[name] = OVER_BUDGET
+    return Packing(
+        selected=[name for name in names if name in selected],
+        excluded={name: excluded[name] for name in names if name in excluded},
+        tokens=max_tokens - room,
+        relevance=sum(relevance[name] for name in selected),
+    )
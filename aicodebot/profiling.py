@@ -0,0 +1,101 @@
+import cProfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# ---------------------------------------------------------------------------- #
+#                     Phase timing for `aicodebot --profile`                     #
+# ---------------------------------------------------------------------------- #
+
+# Phase names, so every command reports the same ones. Spans can use any name, these are the common ones.
+IMPORTS = "imports"
+CONFIG = "config load"
+GIT = "git"
+CONTEXT = "context assembly"
+TOKENIZE = "tokenization"
+FIRST_TOKEN = "model: time to first token"
+STREAM = "model: full response"
+RENDER = "rendering"
+
+
+class Profiler:
+    """Accumulates wall time per phase. Does nothing (beyond an attribute check) unless enabled.
+
+    Spans of the same name can nest (a decorated function that calls another one),
+    only the outermost one is timed, so time isn't counted twice. Different phases do overlap though,
+    the git calls made while assembling context count toward both.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = self.pstats_file = None
+        self.reset()
+
+    def reset(self):
+        self.timings = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.active = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def start(self):
+        self.reset()
+        self.enabled = True
+
+    def start_cprofile(self, pstats_file):
+        """Also run cProfile, and write its stats to pstats_file when we stop (for snakeviz, pstats, etc.)"""
+        self.pstats_file = pstats_file
+        self.cprofile = cProfile.Profile()
+        self.cprofile.enable()
+
+    def stop(self):
+        self.enabled = False
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.pstats_file)
+            self.cprofile = None
+
+    def record(self, name, seconds):
+        """Record a timing that was measured elsewhere (like from a callback)."""
+        if self.enabled:
+            self.timings[name] += seconds
+            self.counts[name] += 1
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled or self.active[name]:
+            yield
+            return
+
+        self.active[name] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active[name] -= 1
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        """Return a list of (phase, calls, seconds), slowest first, with the total wall time last."""
+        rows = sorted(
+            ((name, self.counts[name], seconds) for name, seconds in self.timings.items()),
+            key=lambda row: row[2],
+            reverse=True,
+        )
+        rows.append(("total", None, time.perf_counter() - self.started))
+        return rows
+
+
+profiler = Profiler()
+
+
+def span(name):
+    """Time a block of code (or, as a decorator, a function) as part of the phase `name`.
+
+    with span(GIT):
+        ...
+
+    @span(TOKENIZE)
+    def count_tokens(text):
+        ...
+    """
+    return profiler.span(name)
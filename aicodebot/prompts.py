@@ -2,6 +2,7 @@ import functools
 import os
 from pathlib import Path
 from types import SimpleNamespace
+from typing import NamedTuple
 
 import arrow
 from langchain_core.output_parsers.pydantic import PydanticOutputParser
@@ -9,9 +10,12 @@ from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from pydantic import BaseModel, Field
 
 from aicodebot import AICODEBOT_NO_EMOJI
-from aicodebot.coder import Coder
+from aicodebot.coder import Coder, RepoSnapshot
 from aicodebot.config import read_config
 from aicodebot.helpers import logger
+from aicodebot.outline import expand_outline, get_outline_cache, render_outline, request_names
+from aicodebot.profiling import CONTEXT, span
+from aicodebot.search import get_search_index
 
 # ---------------------------------------------------------------------------- #
 #                              Personalities                                   #
@@ -155,9 +159,8 @@ PERSONALITIES = {
 DEFAULT_PERSONALITY = PERSONALITIES["Her"]
 
 
-@functools.lru_cache
-def get_personality_prompt():
-    """Generates a prompt for the sidekick personality."""
+def get_personality():
+    """Get the name of the personality to use, from the environment or the config file."""
     default_personality = DEFAULT_PERSONALITY.name
     if os.getenv("AICODEBOT_PERSONALITY"):
         personality = os.getenv("AICODEBOT_PERSONALITY")
@@ -169,7 +172,12 @@ def get_personality_prompt():
         raise ValueError(f"Personality {personality} not found")
 
     logger.debug(f"Using personality {personality}")
-    return PERSONALITIES[personality].prompt
+    return personality
+
+
+def get_personality_prompt():
+    """Generates a prompt for the sidekick personality."""
+    return PERSONALITIES[get_personality()].prompt
 
 
 # ---------------------------------------------------------------------------- #
@@ -192,10 +200,11 @@ Understand that when a line is replaced, it will show up as a line being removed
 Don't comment on lines that only removed, as they are no longer in the file.
 """
 
-# languages is populated by looking at the type of files that are in the context
+# This starts system prompts, so it stays the same from request to request (and providers can cache it).
+# The languages, from the types of the files in the context, go in with the request instead
 EXPERT_SOFTWARE_ENGINEER = """
-You are an expert software engineer, versed in many programming languages,
-especially {languages} best practices. You are great at software architecture
+You are an expert software engineer, versed in many programming languages
+and their best practices. You are great at software architecture
 and you write clean, maintainable code. You are a champion for code quality.
 """
 
@@ -240,7 +249,10 @@ def foo():
 === End Example ===
 """
 
-SIDEKICK_TEMPLATE = (
+# The sidekick prompt is laid out so the parts that change least come first: the instructions, then
+# the directory structure, then the files, and the task last. Providers cache the longest prefix
+# they've seen before, so on most turns only the task is new.
+SIDEKICK_SYSTEM_PROMPT = (
     EXPERT_SOFTWARE_ENGINEER
     + f"You are software coding assistant named {AICODEBOT_NO_EMOJI} that helps human software engineers write code."
     + """
@@ -260,53 +272,172 @@ library to produce a rich terminal output.
 """
     # Turn off patch response, as it's not working well. :(
     # + PATCH_FORMAT_EXPLANATION
-    + """
+)
 
-{context}
+SIDEKICK_USER_TEMPLATE = "Languages: {languages}\n{file_ages}{related_code}Software Engineer: {task}"
 
-Software Engineer: {task}"""
-    + AICODEBOT_NO_EMOJI
-    + ":\n"
-)
+# Larger projects get their directory structure summarized to fit in this many tokens
+DIRECTORY_STRUCTURE_TOKENS = 2_000
 
+# In outline mode, smaller files than this (about a thousand tokens) are still shown whole
+OUTLINE_MIN_BYTES = 4_000
 
-def generate_files_context(files):
-    """Generate the files context for the sidekick prompt.
+# The rendered blocks for the files in the context, by absolute path: (key, block)
+_file_blocks = {}
 
-    This includes a directory structure and the contents of $files
+# The outlines of the files in the context, by absolute path: ((size, mtime_ns), outline)
+_file_outlines = {}
 
-    """
-    files_context = "\nHere is the directory structure we are working with in this session:\n"
-    files_context += Coder.generate_directory_structure(".", ignore_patterns=[".git"], use_gitignore=True)
 
-    if not files:
-        return files_context
+class FilesContext(NamedTuple):
+    """The files context for the sidekick prompt, in the order it goes in the prompt (least likely to change first)."""
 
-    files_context += "Here are the relevant files we are working with in this session, with line numbers:\n"
+    directory_structure: str
+    file_contents: str
+    file_ages: str  # Changes as time goes by, even when the files don't
+    related_code: str = ""  # Parts of other files found for the request, changes with each request
 
-    for file_name in files:
-        is_binary, file_info = Coder.get_file_info(file_name)
-        modification_ago = arrow.get(Path(file_name).stat().st_mtime).humanize()
-        if is_binary:
-            files_context += f"Binary file: {file_name}, modified {modification_ago}\n"
-        else:
-            files_context += f"--- START OF FILE: {file_name} {file_info} file, modified {modification_ago} ---\n"
-            contents = Path(file_name).read_text()
-            contents_with_line_numbers = "\n".join(f"{i + 1}: {line}" for i, line in enumerate(contents.split("\n")))
-            files_context += contents_with_line_numbers
-            files_context += f"\n--- END OF FILE: {file_name} ---\n\n"
+    def __str__(self):
+        return "".join(self)
+
+
+def get_file_outline(file_name, stat, snapshot):
+    """The outline of a file (see outline.build_outline), or None if it's not one we can outline.
+
+    Outlines are cached by the file's blob SHA, on disk, and the last one is kept in memory while
+    the file's size and mtime don't change, so it's not read again."""
+    path = Path(file_name).absolute()
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = _file_outlines.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
 
-    return files_context
+    loaded = snapshot.load(file_name)
+    outline = None
+    if not loaded.is_binary and not loaded.too_big:
+        outline = get_outline_cache().get(Coder.git_blob_sha(loaded.data), loaded.text, str(file_name))
+    _file_outlines[path] = (key, outline)
+    return outline
+
+
+def render_file(file_name, stat, snapshot, outline_focus=None):
+    """The block for a file in the files context, with its lines numbered.
+
+    With outline_focus, a (names, lines) pair, larger source files are shown as an outline, with the whole of
+    the functions and classes that are named, or that contain one of the lines (see outline.expand_outline).
+    The last result is reused while the file's size and mtime, and what the outline shows, don't change."""
+    path = Path(file_name).absolute()
+    ranges = None
+    if outline_focus is not None and stat.st_size >= OUTLINE_MIN_BYTES:
+        outline = get_file_outline(file_name, stat, snapshot)
+        if outline:
+            ranges = expand_outline(outline, *outline_focus)
+    key = (stat.st_size, stat.st_mtime_ns, ranges and tuple(map(tuple, ranges)))
+    cached = _file_blocks.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    loaded = snapshot.load(file_name)
+    if loaded.is_binary:
+        block = f"Binary file: {file_name}\n"
+    elif loaded.too_big:
+        block = f"File too big to include: {file_name}, {loaded.size:,} bytes\n"
+    else:
+        file_type = Coder.get_file_type(file_name)
+        if ranges:
+            file_type += " file (outline)"
+            contents_with_line_numbers = render_outline(loaded.text, ranges)
+        else:
+            file_type += " file"
+            lines = loaded.text.split("\n")
+            contents_with_line_numbers = "\n".join(f"{i + 1}: {line}" for i, line in enumerate(lines))
+        block = (
+            f"--- START OF FILE: {file_name} {file_type} ---\n"
+            f"{contents_with_line_numbers}\n"
+            f"--- END OF FILE: {file_name} ---\n\n"
+        )
+    _file_blocks[path] = (key, block)
+    return block
+
+
+@span(CONTEXT)
+def generate_files_context(files, snapshot=None, outline=False, request=None, top_k=0):
+    """Generate the files context for the sidekick prompt, as a FilesContext (str() it for the text).
+
+    This includes a directory structure and the contents of $files, sorted by name so the
+    same files always come out the same way. With outline, source files are outlines (signatures,
+    class and method headers, docstrings), with the whole of what changed since the last commit or is
+    named in the request. With top_k, the top_k parts of other files that are most relevant to the
+    request are included too (see search.SearchIndex).
+    """
+    files = sorted(files)
+
+    # Only the files in this context are kept in memory, so dropping files from a session frees them
+    paths = {Path(file_name).absolute() for file_name in files}
+    for cache in (_file_blocks, _file_outlines):
+        for path in cache.keys() - paths:
+            del cache[path]
+
+    directory_structure = (
+        "\nHere is the directory structure we are working with in this session:\n"
+        + Coder.generate_directory_structure(
+            ".",
+            ignore_patterns=[".git"],
+            use_gitignore=True,
+            max_tokens=DIRECTORY_STRUCTURE_TOKENS,
+            focus_files=files,
+        )
+    )
+
+    related_code = generate_related_code(request, top_k, exclude_files=files) if top_k and request else ""
+    if not files:
+        return FilesContext(directory_structure, "No files have been added to this session.\n", "", related_code)
+
+    snapshot = snapshot or RepoSnapshot()
+    stats = {file_name: snapshot.stat(file_name) for file_name in files}
+    if outline:
+        names = request_names(request)
+        changed_lines = Coder.git_changed_lines(files)
+        focus = {file_name: (names, changed_lines.get(Path(file_name).as_posix(), ())) for file_name in files}
+        introduction = (
+            "Here are the relevant files we are working with in this session, with line numbers. Files marked "
+            "(outline) only show the signatures and docstrings of most functions and classes, "
+            '"... lines X-Y not shown" marks what\'s left out. Ask if you need to see more:\n'
+        )
+    else:
+        focus = dict.fromkeys(files)
+        introduction = "Here are the relevant files we are working with in this session, with line numbers:\n"
+    file_contents = "".join(
+        [introduction, *(render_file(file_name, stats[file_name], snapshot, focus[file_name]) for file_name in files)]
+    )
+    ages = ", ".join(f"{file_name} {arrow.get(stats[file_name].st_mtime).humanize()}" for file_name in files)
+    return FilesContext(directory_structure, file_contents, f"The files were last modified: {ages}\n\n", related_code)
+
+
+def generate_related_code(request, top_k, exclude_files=()):
+    """The top_k parts of the files in the repo that are most relevant to the request, with line numbers."""
+    chunks = get_search_index().search(request, top_k, exclude_files=[Path(file).as_posix() for file in exclude_files])
+    if not chunks:
+        return ""
+    blocks = [
+        f"--- START OF PART: {chunk.path} lines {chunk.start}-{chunk.end} ---\n"
+        f"{chunk.text()}\n"
+        f"--- END OF PART: {chunk.path} ---\n\n"
+        for chunk in chunks
+    ]
+    return "".join(["Here are parts of other files in the repo that may be relevant to the request:\n", *blocks])
 
 
 # ---------------------------------------------------------------------------- #
 #                                 Other prompts                                #
 # ---------------------------------------------------------------------------- #
 
+# The {personality} in these templates is filled in by get_prompt, so importing this module doesn't read the config
+
 ALIGNMENT_TEMPLATE = (
     """You're an advocate for aligned AI."""
-    + get_personality_prompt()
-    + """
+    "{personality}"
+    """
     You don't subscribe to the idea that AI is a black box or follow the Hollywood narrative of AI.
     You believe that AI should be explainable, fair, and full of heart-centered empathy.
     You're a champion for AI ethics and you're not afraid to speak up when
@@ -324,7 +455,7 @@ ALIGNMENT_TEMPLATE = (
 
 COMMIT_SYSTEM_PROMPT = (
     EXPERT_SOFTWARE_ENGINEER
-    + get_personality_prompt()
+    + "{personality}"
     + """
 
 You are an expert at writing exceptional Git commit messages that follow best practices.
@@ -383,7 +514,7 @@ Then create a perfect summary line under 72 characters.
 
 DEBUG_TEMPLATE = (
     EXPERT_SOFTWARE_ENGINEER
-    + get_personality_prompt()
+    + "{personality}"
     + """
     I ran a command my terminal, and it failed.
 
@@ -393,14 +524,16 @@ DEBUG_TEMPLATE = (
     {command_output}
     END OUTPUT
 
+    Languages: {languages}
+
     Help me understand what happened and how might I be able to fix it.  Respond in markdown format.
 """
 )
 
 FUN_FACT_TEMPLATE = (
     """You are history nerd who loves sharing information."""
-    + get_personality_prompt()
-    + """
+    "{personality}"
+    """
 Your expertise is {topic}.
 You love emojis.
 
@@ -412,7 +545,7 @@ Respond in markdown format.
 
 REVIEW_TEMPLATE = (
     EXPERT_SOFTWARE_ENGINEER
-    + get_personality_prompt()
+    + "{personality}"
     + DIFF_CONTEXT_EXPLANATION
     + """
     I want you to review a change in a git repository.  Here's the DIFF that will be committed:
@@ -421,6 +554,8 @@ REVIEW_TEMPLATE = (
     {diff_context}
     END DIFF
 
+    Languages: {languages}
+
     Guidelines for the review:
     * Point out obvious spelling mistakes in plain text files if you see them, but don't check for spelling in code.
     * Do not discuss very minor changes. It's better to be terse and focus on issues.
@@ -444,39 +579,71 @@ REVIEW_TEMPLATE = (
 )
 
 
-def get_prompt(command, structured_output=False):
-    """Generates a prompt for the sidekick workflow."""
+def get_prompt(command, structured_output=False, cache_control=False):
+    """Generates a prompt for the sidekick workflow.
+
+    cache_control marks the prompt caching breakpoints Anthropic needs (only used by sidekick)."""
+    return build_prompt(command, get_personality(), structured_output, cache_control)
+
+
+@functools.cache
+def build_prompt(command, personality, structured_output=False, cache_control=False):
+    """Assemble the prompt for a command. Memoized, so each prompt is only built once per process."""
+    personality_prompt = PERSONALITIES[personality].prompt
 
     if command == "review":
         if structured_output:
-            parser = PydanticOutputParser(pydantic_object=ReviewResult)
+            parser = get_review_output_parser()
             return PromptTemplate(
                 template=REVIEW_TEMPLATE + "\n{format_instructions}",
                 input_variables=["diff_context", "languages"],
-                partial_variables={"format_instructions": parser.get_format_instructions()},
+                partial_variables={
+                    "format_instructions": parser.get_format_instructions(),
+                    "personality": personality_prompt,
+                },
                 output_parser=parser,
             )
         else:
             return PromptTemplate(
                 template=REVIEW_TEMPLATE + "\nRespond in markdown format",
                 input_variables=["diff_context", "languages"],
+                partial_variables={"personality": personality_prompt},
             )
 
+    elif command == "alignment":
+        return PromptTemplate(
+            template=ALIGNMENT_TEMPLATE, input_variables=[], partial_variables={"personality": personality_prompt}
+        )
+    elif command == "commit":
+        return ChatPromptTemplate.from_messages(
+            [("system", COMMIT_SYSTEM_PROMPT), ("user", COMMIT_USER_TEMPLATE)]
+        ).partial(personality=personality_prompt)
+    elif command == "debug":
+        return PromptTemplate(
+            template=DEBUG_TEMPLATE,
+            input_variables=["command_output", "languages"],
+            partial_variables={"personality": personality_prompt},
+        )
+    elif command == "fun_fact":
+        return PromptTemplate(
+            template=FUN_FACT_TEMPLATE, input_variables=["topic"], partial_variables={"personality": personality_prompt}
+        )
+    elif command == "sidekick":
+        if cache_control:
+            # Anthropic only caches up to explicit breakpoints, so mark the end of each part that's stable
+            cache_breakpoint = {"type": "ephemeral"}
+            system = [
+                {"type": "text", "text": SIDEKICK_SYSTEM_PROMPT},
+                {"type": "text", "text": "{directory_structure}", "cache_control": cache_breakpoint},
+                {"type": "text", "text": "{file_contents}", "cache_control": cache_breakpoint},
+            ]
+        else:
+            system = SIDEKICK_SYSTEM_PROMPT + "{directory_structure}{file_contents}"
+        return ChatPromptTemplate.from_messages([("system", system), ("user", SIDEKICK_USER_TEMPLATE)]).partial(
+            related_code=""
+        )
     else:
-        prompt_map = {
-            "alignment": PromptTemplate(template=ALIGNMENT_TEMPLATE, input_variables=[]),
-            "commit": ChatPromptTemplate.from_messages(
-                [("system", COMMIT_SYSTEM_PROMPT), ("user", COMMIT_USER_TEMPLATE)]
-            ),
-            "debug": PromptTemplate(template=DEBUG_TEMPLATE, input_variables=["command_output", "languages"]),
-            "fun_fact": PromptTemplate(template=FUN_FACT_TEMPLATE, input_variables=["topic"]),
-            "sidekick": PromptTemplate(template=SIDEKICK_TEMPLATE, input_variables=["task", "context", "languages"]),
-        }
-
-        try:
-            return prompt_map[command]
-        except KeyError as e:
-            raise ValueError(f"Unable to find prompt for command {command}") from e
+        raise ValueError(f"Unable to find prompt for command {command}")
 
 
 # ---------------------------------------------------------------------------- #
@@ -489,3 +656,8 @@ class ReviewResult(BaseModel):
 
     review_status: str = Field(description="The status of the review: PASSED, COMMENTS, or FAILED")
     review_comments: str = Field(description="The comments from the review")
+
+
+@functools.cache
+def get_review_output_parser():
+    return PydanticOutputParser(pydantic_object=ReviewResult)
@@ -0,0 +1,142 @@
+import functools
+from pathlib import Path
+
+from git import InvalidGitRepositoryError, NoSuchPathError, Repo
+from git.refs import SymbolicReference
+
+from aicodebot.helpers import exec_and_get_output, logger
+
+
+class GitBackend:
+    """Access to a git repository that avoids starting a new git process for every question we ask.
+
+    Reading HEAD and the index is done in Python with GitPython. The answers to git commands
+    (like the list of staged files) are memoized until the repository state changes, which we notice
+    from HEAD moving or the index file being rewritten (git add, git commit, git status, etc.).
+
+    Edits to the working tree don't touch the index, so callers that run for a long time (sidekick)
+    should call invalidate() when they want to pick those up.
+    """
+
+    def __init__(self, path="."):
+        self.repo = Repo(path, search_parent_directories=True)
+        if self.repo.bare:
+            raise InvalidGitRepositoryError(f"{self.repo.git_dir} is a bare repository, there's no work tree")
+        self.root = Path(self.repo.working_tree_dir).resolve()
+        self.memo = {}
+        self.signature = None
+
+    # ------------------------------ Repository state ----------------------------- #
+
+    def head_sha(self):
+        """The commit SHA that HEAD points to, or None for a repo with no commits yet."""
+        try:
+            return SymbolicReference.dereference_recursive(self.repo, "HEAD")
+        except ValueError:
+            return None
+
+    def index_stat(self):
+        try:
+            return Path(self.repo.index.path).stat()
+        except FileNotFoundError:
+            return None
+
+    def state_signature(self):
+        index_stat = self.index_stat()
+        if index_stat:
+            index_stat = (index_stat.st_mtime_ns, index_stat.st_size, index_stat.st_ino)
+        return index_stat, self.head_sha()
+
+    def invalidate(self):
+        """Forget everything we know about the repository, so the next question goes to git."""
+        self.memo.clear()
+        self.signature = None
+
+    def memoized(self, key, func):
+        signature = self.state_signature()
+        if signature != self.signature:
+            if self.signature is not None:
+                logger.debug("Repository state changed, clearing the git cache")
+            self.memo.clear()
+            self.signature = signature
+
+        if key not in self.memo:
+            self.memo[key] = func()
+        return self.memo[key]
+
+    def git(self, *args):
+        """Run a git command, reusing the output until the repository state changes."""
+        return self.memoized(args, lambda: exec_and_get_output(["git", *args]))
+
+    # --------------------------------- Queries --------------------------------- #
+
+    def index_entries(self):
+        """Map each file in the index (relative to the top of the repo) to its IndexEntry. Conflicted files are left out."""
+
+        def read_index():
+            return {path: entry for (path, stage), entry in self.repo.index.entries.items() if stage == 0}
+
+        return self.memoized("index_entries", read_index)
+
+    def blob_shas(self, files=None):
+        """Map tracked files that are unchanged in the working tree to their blob SHAs, from the index.
+
+        files (default: everything tracked under the current directory) are relative to the current
+        directory, like `git ls-files`. Like git, we trust that a file is unchanged if its size and
+        mtime match what the index recorded, unless it was modified in the same instant the index was
+        written ("racy git"). Files that may have changed are left out, so the caller hashes them.
+        """
+        prefix = Path.cwd().resolve().relative_to(self.root).as_posix()
+        prefix = "" if prefix == "." else prefix + "/"
+        entries = self.index_entries()
+        if files is None:
+            files = [path[len(prefix) :] for path in entries if path.startswith(prefix)]
+
+        index_stat = self.index_stat()
+        blob_shas = {}
+        for file_name in (Path(file).as_posix() for file in files):
+            entry = entries.get(prefix + file_name)
+            if entry is None:
+                continue
+            try:
+                stat = Path(file_name).lstat()
+            except OSError:
+                continue
+            seconds, nanoseconds = entry.mtime
+            entry_mtime_ns = seconds * 1_000_000_000 + nanoseconds
+            # The index only keeps the low 32 bits of the size
+            if (
+                stat.st_size % 2**32 == entry.size
+                and stat.st_mtime_ns == entry_mtime_ns
+                and entry_mtime_ns < index_stat.st_mtime_ns
+            ):
+                blob_shas[file_name] = entry.hexsha
+        return blob_shas
+
+    def staged_files(self):
+        return self.git("diff", "--cached", "--name-only").splitlines()
+
+    def unstaged_files(self):
+        return self.git("diff", "HEAD", "--name-only").splitlines()
+
+
+@functools.cache
+def _git_backend(path):
+    return GitBackend(path)
+
+
+def get_git_backend():
+    """Get the (shared) git backend for the repository the current directory is in.
+
+    Raises git.InvalidGitRepositoryError if we aren't in one."""
+    return _git_backend(Path.cwd())
+
+
+def in_git_repo():
+    """Check if the current directory is inside a git work tree, without starting a git process."""
+    try:
+        get_git_backend()
+    except (InvalidGitRepositoryError, NoSuchPathError) as e:
+        logger.debug(f"Not inside a git repo: {e!r}")
+        return False
+    return True
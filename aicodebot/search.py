@@ -0,0 +1,290 @@
+import functools
+import hashlib
+import re
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import NamedTuple
+
+from aicodebot.coder import BINARY_SNIFF_BYTES
+from aicodebot.config import get_local_data_dir
+from aicodebot.helpers import logger
+from aicodebot.walk import git_ls_files, walk
+
+# Bigger files than this are generated, vendored, or data, and not worth indexing
+MAX_INDEX_BYTES = 1_000_000
+
+# Chunks end at a blank line once they're at least MIN_CHUNK_LINES long, or at MAX_CHUNK_LINES
+MIN_CHUNK_LINES = 20
+MAX_CHUNK_LINES = 60
+
+# Query terms in more than this fraction of the chunks (and more than MIN_COMMON_TERM_CHUNKS, which are
+# quick to score anyway) are left out, unless there are no others, and then only the MAX_COMMON_TERMS
+# rarest of them are used
+COMMON_TERM_FRACTION = 0.05
+MIN_COMMON_TERM_CHUNKS = 1_000
+MAX_COMMON_TERMS = 2
+
+# Words in a request that don't say anything about the code
+STOP_WORDS = {
+    "a",
+    "an",
+    "and",
+    "are",
+    "as",
+    "at",
+    "be",
+    "by",
+    "can",
+    "do",
+    "does",
+    "for",
+    "from",
+    "how",
+    "in",
+    "is",
+    "it",
+    "of",
+    "on",
+    "or",
+    "the",
+    "this",
+    "to",
+    "what",
+    "when",
+    "where",
+    "which",
+    "why",
+    "with",
+}
+
+# Identifiers, and the words in them: snake_case, camelCase, HTTPServer, version2
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+WORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def code_tokens(text):
+    """Split text into search terms, lowercased: each word in an identifier, plus the whole identifier.
+
+    So get_file_context is get, file, context and getfilecontext, and matches getFileContext."""
+    return [token for identifier in IDENTIFIER_PATTERN.findall(text) for token in identifier_tokens(identifier)]
+
+
+def code_terms(text):
+    """The code_tokens of text, separated by spaces, for indexing. The same, only faster."""
+    return " ".join(filter(None, map(identifier_terms, IDENTIFIER_PATTERN.findall(text))))
+
+
+# Code repeats the same identifiers over and over, so splitting each one once makes indexing several times faster
+@functools.lru_cache(maxsize=100_000)
+def identifier_tokens(identifier):
+    words = WORD_PATTERN.findall(identifier)
+    tokens = tuple(word.lower() for word in words if len(word) > 1)
+    return (*tokens, "".join(words).lower()) if len(words) > 1 else tokens
+
+
+@functools.lru_cache(maxsize=100_000)
+def identifier_terms(identifier):
+    return " ".join(identifier_tokens(identifier))
+
+
+def split_chunks(text):
+    """Split text into chunks of lines, as (start line, end line), from 1 and inclusive."""
+    lines = text.split("\n")
+    chunks = []
+    start = 1
+    for number, line in enumerate(lines, 1):
+        length = number - start + 1
+        if (length >= MIN_CHUNK_LINES and not line.strip()) or length >= MAX_CHUNK_LINES:
+            chunks.append((start, number))
+            start = number + 1
+    if start <= len(lines) and any(line.strip() for line in lines[start - 1 :]):
+        chunks.append((start, len(lines)))
+    return chunks
+
+
+class Chunk(NamedTuple):
+    """Some lines of a file that matched a search."""
+
+    path: str
+    start: int
+    end: int
+    score: float  # Higher is more relevant
+
+    def text(self, root="."):
+        """The lines of the chunk, numbered, read from the file now."""
+        lines = (Path(root) / self.path).read_text(errors="replace").split("\n")
+        return "\n".join(
+            f"{number}: {lines[number - 1]}" for number in range(self.start, min(self.end, len(lines)) + 1)
+        )
+
+
+class SearchIndex:
+    """A full text index of the chunks of the files in a repo, for finding the code that's relevant to a request.
+
+    An inverted index with BM25 ranking, from SQLite's FTS5, stored in the vector_stores directory in
+    the local data directory. Everything is local, nothing is sent anywhere. We index the terms from
+    code_tokens, so identifiers match by their parts. Like ImportGraph, each file's mtime and size are
+    stored, so only the files that changed since last time are indexed again.
+    """
+
+    def __init__(self, root, path):
+        self.root = Path(root).resolve()
+        self.chunk_count = None
+        self.connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, path TEXT, start INTEGER, end INTEGER)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS chunks_by_path ON chunks (path)")
+            # The terms are already split and lowercased, so the tokenizer only has to split on spaces
+            self.connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunk_terms USING fts5(terms, tokenize='ascii')"
+            )
+            # How many chunks each term is in. FTS5 can tell us (fts5vocab), but it counts them each time
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS term_counts (term TEXT PRIMARY KEY, chunks INTEGER) WITHOUT ROWID"
+            )
+
+    def source_files(self):
+        """The files we index, relative to the root (from git ls-files, when in a repo)."""
+        paths = git_ls_files(self.root)
+        if paths is None:
+            paths = [entry.path for entry in walk(self.root) if not entry.is_dir]
+        return paths
+
+    def update(self):
+        """Bring the index up to date with the files on disk. Returns how many files were indexed."""
+        stored = {path: (mtime_ns, size) for path, mtime_ns, size in self.connection.execute("SELECT * FROM files")}
+        current = {}
+        for path in self.source_files():
+            try:
+                file_stat = (self.root / path).stat()
+            except OSError:
+                continue
+            current[path] = (file_stat.st_mtime_ns, file_stat.st_size)
+
+        changed = [path for path, signature in current.items() if stored.get(path) != signature]
+        removed = [path for path in stored if path not in current]
+        if not changed and not removed:
+            return 0
+
+        self.chunk_count = None
+        with self.connection:
+            term_counts = Counter()
+            self.forget(changed + removed, term_counts)
+            (next_id,) = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chunks").fetchone()
+            chunk_rows, term_rows = [], []
+            for path in changed:
+                for start, end, terms in self.file_chunks(path, current[path][1]):
+                    chunk_rows.append((next_id, path, start, end))
+                    term_rows.append((next_id, terms))
+                    term_counts.update(set(terms.split()))
+                    next_id += 1
+            self.connection.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", chunk_rows)
+            self.connection.executemany("INSERT INTO chunk_terms (rowid, terms) VALUES (?, ?)", term_rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)", [(path, *current[path]) for path in changed]
+            )
+            self.connection.executemany(
+                "INSERT INTO term_counts (term, chunks) VALUES (?, ?) "
+                "ON CONFLICT (term) DO UPDATE SET chunks = chunks + excluded.chunks",
+                [(term, count) for term, count in term_counts.items() if count],
+            )
+            self.connection.execute("DELETE FROM term_counts WHERE chunks <= 0")
+        logger.debug(f"Search index: indexed {len(changed)} files ({len(chunk_rows)} chunks), forgot {len(removed)}")
+        return len(changed)
+
+    def file_chunks(self, path, size):
+        """The chunks of a file to index, as (start, end, terms). Nothing for binary or very big files."""
+        if size > MAX_INDEX_BYTES:
+            return []
+        try:
+            data = (self.root / path).read_bytes()
+        except OSError:
+            return []
+        if b"\0" in data[:BINARY_SNIFF_BYTES]:
+            return []
+        text = data.decode(errors="replace")
+        lines = text.split("\n")
+        chunks = []
+        for start, end in split_chunks(text):
+            # The path is part of the first chunk, so files can be found by name
+            terms = code_terms("\n".join(lines[start - 1 : end]) + (f"\n{path}" if start == 1 else ""))
+            if terms:
+                chunks.append((start, end, terms))
+        return chunks
+
+    def forget(self, paths, term_counts):
+        """Remove the chunks of paths from the index, taking their terms off term_counts (a Counter)."""
+        for path in paths:
+            for (terms,) in self.connection.execute(
+                "SELECT terms FROM chunk_terms WHERE rowid IN (SELECT id FROM chunks WHERE path = ?)", (path,)
+            ):
+                term_counts.subtract(set(terms.split()))
+            self.connection.execute(
+                "DELETE FROM chunk_terms WHERE rowid IN (SELECT id FROM chunks WHERE path = ?)", (path,)
+            )
+            self.connection.execute("DELETE FROM chunks WHERE path = ?", (path,))
+        self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+
+    def search(self, query, top_k=5, exclude_files=()):
+        """The top_k chunks most relevant to query, best first, leaving out the chunks of exclude_files.
+
+        Terms that are in lots of chunks (self, return, the name of the project) say little about
+        relevance, BM25 weighs them at next to nothing, but matching them means scoring a big part of
+        the index. So we leave them out of the query, unless there's nothing else, which keeps it to
+        milliseconds."""
+        terms = [term for term in dict.fromkeys(code_tokens(query)) if term not in STOP_WORDS]
+        if not terms:
+            return []
+        if self.chunk_count is None:
+            (self.chunk_count,) = self.connection.execute("SELECT COUNT(*) FROM chunks").fetchone()
+        document_counts = dict(
+            self.connection.execute(
+                f"SELECT term, chunks FROM term_counts WHERE term IN ({','.join('?' * len(terms))})",  # noqa: S608
+                terms,
+            )
+        )
+        terms = [term for term in terms if term in document_counts]
+        common = max(self.chunk_count * COMMON_TERM_FRACTION, MIN_COMMON_TERM_CHUNKS)
+        terms = [term for term in terms if document_counts[term] <= common] or sorted(terms, key=document_counts.get)[
+            :MAX_COMMON_TERMS
+        ]
+        if not terms:
+            return []
+
+        exclude_files = set(exclude_files)
+        limit = top_k + 10
+        while True:
+            # Rank in FTS5 first, so we only look up the chunks we return
+            rows = self.connection.execute(
+                "SELECT chunks.path, chunks.start, chunks.end, matches.score FROM ("
+                "  SELECT rowid, bm25(chunk_terms) AS score FROM chunk_terms WHERE chunk_terms MATCH ? "
+                "  ORDER BY score LIMIT ?"
+                ") AS matches JOIN chunks ON chunks.id = matches.rowid ORDER BY matches.score",
+                (" OR ".join(f'"{term}"' for term in terms), limit),
+            ).fetchall()
+            # bm25() is lower for better matches, so we flip the sign
+            chunks = [Chunk(path, start, end, -score) for path, start, end, score in rows if path not in exclude_files]
+            if len(chunks) >= top_k or len(rows) < limit:
+                return chunks[:top_k]
+            limit *= 4
+
+
+@functools.cache
+def _search_index(root, path):
+    return SearchIndex(root, path)
+
+
+def get_search_index(root="."):
+    """Get the search index for root (brought up to date), in the vector_stores directory of the local data directory."""
+    root = Path(root).resolve()
+    directory = get_local_data_dir() / "vector_stores"
+    directory.mkdir(exist_ok=True)
+    index = _search_index(root, directory / f"{hashlib.sha1(str(root).encode()).hexdigest()[:16]}.sqlite")
+    index.update()
+    return index
@@ -0,0 +1,173 @@
+import functools
+import math
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import tiktoken
+
+from aicodebot.config import get_local_data_dir
+from aicodebot.helpers import logger
+from aicodebot.profiling import TOKENIZE, span
+
+# This seems to work for both OpenAI and Anthropic
+TIKTOKEN_MODEL_NAME = "gpt-4o"
+
+# Code and prose average 3-4.5 bytes per token with the gpt-4o encoding. Long runs of whitespace or
+# repeated characters compress better, so we allow for double the typical ratio before we call a file oversize.
+BYTES_PER_TOKEN = 4
+MAX_BYTES_PER_TOKEN = 8
+
+
+@functools.cache
+def get_encoding():
+    """Resolve the tiktoken encoding once per process and keep it in memory.
+
+    Looking up the encoding (and loading its BPE ranks) is the expensive part of counting tokens,
+    so everything that counts tokens shares this one instance. No config is read here.
+    """
+    return tiktoken.encoding_for_model(TIKTOKEN_MODEL_NAME)
+
+
+@span(TOKENIZE)
+def count_tokens(text):
+    """Get the number of tokens in a string."""
+    return len(get_encoding().encode(text))
+
+
+@span(TOKENIZE)
+def count_tokens_many(texts, workers=None):
+    """Get the number of tokens for each string in texts, in the same order.
+
+    tiktoken releases the GIL while encoding, so the batch is spread over a pool of worker threads."""
+    workers = workers or get_tokenizer_workers()
+    return [len(tokens) for tokens in get_encoding().encode_batch(list(texts), num_threads=workers)]
+
+
+def estimate_tokens(byte_size, bytes_per_token=BYTES_PER_TOKEN):
+    """Estimate the number of tokens in byte_size bytes of text, without reading it."""
+    return math.ceil(byte_size / bytes_per_token)
+
+
+def estimate_token_range(byte_size):
+    """Bound the number of tokens in byte_size bytes of UTF-8 text, without reading it. Returns (low, high).
+
+    high is exact: every token covers at least one byte, so text never has more tokens than bytes.
+    low is empirical: it assumes no more than MAX_BYTES_PER_TOKEN bytes per token, which only
+    pathological text (say, megabytes of spaces) beats. Text like that may be rejected as oversize
+    when it would have fit, but budgets are never exceeded.
+    """
+    return math.ceil(byte_size / MAX_BYTES_PER_TOKEN), byte_size
+
+
+def fits_token_budget(byte_size, budget):
+    """Decide from a file size alone whether its text fits in a token budget.
+
+    Returns True if it surely fits, False if it surely doesn't, or None if it's close to the
+    boundary and the only way to know is to count the tokens exactly.
+    """
+    low, high = estimate_token_range(byte_size)
+    if high <= budget:
+        return True
+    if low > budget:
+        return False
+    return None
+
+
+def get_tokenizer_workers():
+    """How many threads to use for reading and tokenizing files. Override with AICODEBOT_TOKENIZER_WORKERS."""
+    return int(os.getenv("AICODEBOT_TOKENIZER_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+
+
+# ---------------------------------------------------------------------------- #
+#                               Token count cache                              #
+# ---------------------------------------------------------------------------- #
+
+
+class TokenCountCache:
+    """An on-disk cache that maps a content hash (the git blob SHA) + encoding name to a token count.
+
+    Unchanged files hash to the same blob SHA, so we never have to read or encode them again.
+    The cache is size bounded, evicting the least recently used entries first.
+    """
+
+    DEFAULT_MAX_ENTRIES = 100_000
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        # Multiple aicodebot processes can share the cache, so wait for locks rather than failing
+        self.connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS token_counts ("
+                "blob_sha TEXT, encoding TEXT, tokens INTEGER, last_used INTEGER, "
+                "PRIMARY KEY (blob_sha, encoding)) WITHOUT ROWID"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS token_counts_lru ON token_counts (last_used)")
+
+    def get_many(self, blob_shas, encoding_name):
+        """Return a dict of blob_sha -> token count for the blob SHAs that are in the cache.
+
+        Binary content is cached with a count of None, so a hit can have a None value."""
+        blob_shas = list(set(blob_shas))
+        found = {}
+        # Stay well below SQLite's limit on the number of query parameters
+        for start in range(0, len(blob_shas), 500):
+            chunk = blob_shas[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT blob_sha, tokens FROM token_counts WHERE encoding = ? AND blob_sha IN ({placeholders})",  # noqa: S608
+                [encoding_name, *chunk],
+            )
+            found.update(rows)
+
+        self.hits += len(found)
+        self.misses += len(blob_shas) - len(found)
+        if found:
+            now = time.time_ns()
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE token_counts SET last_used = ? WHERE blob_sha = ? AND encoding = ?",
+                    [(now, blob_sha, encoding_name) for blob_sha in found],
+                )
+        return found
+
+    def set_many(self, token_counts, encoding_name):
+        """Store a dict of blob_sha -> token count, then evict the oldest entries if we're over the limit."""
+        if not token_counts:
+            return
+        now = time.time_ns()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO token_counts (blob_sha, encoding, tokens, last_used) VALUES (?, ?, ?, ?)",
+                [(blob_sha, encoding_name, tokens, now) for blob_sha, tokens in token_counts.items()],
+            )
+            self.evict()
+
+    def evict(self):
+        (entries,) = self.connection.execute("SELECT COUNT(*) FROM token_counts").fetchone()
+        if entries > self.max_entries:
+            logger.debug(f"Evicting {entries - self.max_entries} entries from the token count cache")
+            self.connection.execute(
+                "DELETE FROM token_counts WHERE (blob_sha, encoding) IN "
+                "(SELECT blob_sha, encoding FROM token_counts ORDER BY last_used LIMIT ?)",
+                (entries - self.max_entries,),
+            )
+
+    @property
+    def stats(self):
+        (entries,) = self.connection.execute("SELECT COUNT(*) FROM token_counts").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+@functools.cache
+def _token_count_cache(path):
+    return TokenCountCache(path)
+
+
+def get_token_count_cache():
+    """Get the shared token count cache, which lives in the local data directory."""
+    return _token_count_cache(get_local_data_dir() / "token_counts.sqlite")
@@ -0,0 +1,500 @@
+import fnmatch
+import heapq
+import os
+import re
+import subprocess
+import time
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+from aicodebot.helpers import logger
+from aicodebot.tokens import estimate_tokens
+
+# ---------------------------------------------------------------------------- #
+#                               gitignore matching                             #
+# ---------------------------------------------------------------------------- #
+
+
+def translate_gitignore_pattern(pattern):
+    """Translate the glob part of a gitignore pattern (without !, or the trailing /) to a regex.
+
+    Follows `git help gitignore`: a pattern with a slash (other than at the end) is matched against
+    the path relative to the .gitignore file, otherwise against the name at any depth below it.
+    """
+    anchored = "/" in pattern
+    pattern = pattern.removeprefix("/")
+
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            out.append("(?:.*/)?")  # Zero or more directories
+            i += 3
+            continue
+        if pattern.startswith("**", i) and i + 2 == len(pattern) and (i == 0 or pattern[i - 1] == "/"):
+            out.append(".*")  # Everything inside
+            i += 2
+            continue
+
+        if char == "*":
+            out.append("[^/]*")
+        elif char == "?":
+            out.append("[^/]")
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        elif char == "[":
+            # Like git, a ] right after the [ (or [!) is part of the set, not the end of it
+            start = i + 2 if pattern[i + 1 : i + 2] in ("!", "^") else i + 1
+            if pattern[start : start + 1] == "]":
+                start += 1
+            end = pattern.find("]", start)
+            if end == -1:
+                # No closing bracket, so it's a plain [
+                out.append(re.escape(char))
+            else:
+                characters = pattern[i + 1 : end]
+                negate = characters[0] in "!^"
+                characters = characters[1:] if negate else characters
+                characters = characters.replace("[", "\\[")
+                if characters.startswith("]"):
+                    characters = "\\" + characters
+                out.append(("[^" if negate else "[") + characters + "]")
+                i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+
+    regex = "".join(out)
+    return regex if anchored else f"(?:.*/)?{regex}"
+
+
+class IgnoreRules:
+    """The rules from one gitignore file (a .gitignore, or .git/info/exclude), compiled.
+
+    All the patterns are combined into one regex (one for files, one for directories, since a trailing
+    slash means a pattern only matches directories). The alternatives are in reverse order, so the
+    group that matches is the last matching pattern in the file, which is the one that wins.
+    """
+
+    def __init__(self, lines):
+        file_rules, dir_rules = [], []
+        for rule in filter(None, map(self.parse_line, lines)):
+            regex, negate, dir_only = rule
+            dir_rules.append((regex, negate))
+            if not dir_only:
+                file_rules.append((regex, negate))
+
+        self.file_regex, self.file_negations = self.combine(file_rules)
+        self.dir_regex, self.dir_negations = self.combine(dir_rules)
+
+    @staticmethod
+    def parse_line(line):
+        """Parse a line of a gitignore file into (regex, negate, dir_only), or None if there's no rule on it."""
+        pattern = line.rstrip("\n")
+        # Trailing spaces are ignored unless they are escaped with a backslash
+        if not pattern.endswith("\\ "):
+            pattern = pattern.rstrip(" ")
+        if not pattern or pattern.startswith("#"):
+            return None
+
+        negate = pattern.startswith("!")
+        if negate or pattern.startswith(("\\!", "\\#")):
+            pattern = pattern[1:]
+
+        try:
+            regex = translate_gitignore_pattern(pattern.rstrip("/"))
+            re.compile(regex)
+        except (re.error, IndexError):
+            logger.debug(f"Skipping a gitignore pattern we can't parse: {line}")
+            return None
+        return regex, negate, pattern.endswith("/")
+
+    @staticmethod
+    def combine(rules):
+        if not rules:
+            return None, []
+        rules = rules[::-1]
+        regex = re.compile("|".join(f"({pattern})" for pattern, _ in rules), re.DOTALL)
+        return regex, [negate for _, negate in rules]
+
+    @classmethod
+    def from_file(cls, path):
+        """Read the rules from a file, returning None if it doesn't exist or has no rules."""
+        try:
+            with Path(path).open(encoding="utf-8", errors="replace") as f:
+                rules = cls(f)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return None
+        return rules if rules.dir_regex else None
+
+    def match(self, relative_path, is_dir):
+        """Returns True if the path is ignored, False if it's explicitly not ignored (!pattern), None if no rule matches."""
+        regex, negations = (self.dir_regex, self.dir_negations) if is_dir else (self.file_regex, self.file_negations)
+        match = regex.fullmatch(relative_path) if regex else None
+        if not match:
+            return None
+        return not negations[match.lastindex - 1]
+
+
+def fnmatch_any(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns or [])
+
+
+def compile_ignore_patterns(ignore_patterns):
+    """Combine fnmatch patterns (matched against the name of each file and directory) into one regex."""
+    if not ignore_patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in ignore_patterns))
+
+
+# ---------------------------------------------------------------------------- #
+#                                    Walking                                   #
+# ---------------------------------------------------------------------------- #
+
+
+class WalkEntry(NamedTuple):
+    path: str  # Relative to the root of the walk, with / separators
+    name: str
+    depth: int  # 1 for the entries directly in the root
+    is_dir: bool
+
+
+def walk(root, ignore_patterns=None, use_gitignore=True, subdirectory=""):
+    """Yield a WalkEntry for each file and directory under root that isn't ignored, depth first, sorted by name.
+
+    ignore_patterns are fnmatch patterns for names to leave out (an ignored directory is not descended into).
+    With use_gitignore, inside a git repo the list comes from `git ls-files`, otherwise we walk the
+    file system and apply the .gitignore files (nested too) and .git/info/exclude ourselves.
+
+    With subdirectory (relative to root, with / separators), only that part of the tree is walked.
+    Paths are still relative to root, and depth is counted from the subdirectory.
+    """
+    ignore_regex = compile_ignore_patterns(ignore_patterns)
+    paths = git_ls_files(Path(root) / subdirectory) if use_gitignore else None
+    if paths is None:
+        yield from walk_directory(root, ignore_regex, use_gitignore, subdirectory)
+    else:
+        yield from walk_paths(paths, ignore_regex, prefix=f"{subdirectory}/" if subdirectory else "")
+
+
+def git_ls_files(root):
+    """The files git doesn't ignore (tracked, or untracked and not ignored) under root, or None if root isn't in a repo."""
+    result = subprocess.run(
+        ["git", "ls-files", "--cached", "--others", "--exclude-standard", "--deduplicate", "-z"],  # noqa: S607
+        cwd=root,
+        capture_output=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        logger.debug(f"Not using git ls-files for {root}: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return [path for path in result.stdout.decode("utf-8", errors="surrogateescape").split("\0") if path]
+
+
+def walk_paths(paths, ignore_regex=None, prefix=""):
+    """Walk a list of relative file paths (like from git ls-files) as a tree, in the same order as walk_directory.
+
+    prefix is put in front of each path in the results."""
+    tree = {}
+    for path in paths:
+        node = tree
+        for part in path.split("/"):
+            node = node.setdefault(part, {})
+
+    # A stack of iterators over sorted directory contents, so deep trees don't hit the recursion limit
+    stack = [(iter(sorted(tree.items())), prefix)]
+    while stack:
+        entry = next(stack[-1][0], None)
+        if entry is None:
+            stack.pop()
+            continue
+        name, children = entry
+        if ignore_regex and ignore_regex.match(name):
+            continue
+        path = stack[-1][1] + name
+        is_dir = bool(children)
+        yield WalkEntry(path, name, len(stack), is_dir)
+        if is_dir:
+            stack.append((iter(sorted(children.items())), path + "/"))
+
+
+def walk_directory(root, ignore_regex=None, use_gitignore=True, subdirectory=""):
+    """Walk the file system with os.scandir, applying ignore_regex to names and, optionally, gitignore files."""
+    # The gitignore rules in effect for a directory, as a list of (path prefix, IgnoreRules), outermost first
+    rules = []
+    if use_gitignore:
+        exclude = IgnoreRules.from_file(Path(root) / ".git" / "info" / "exclude")
+        rules = [("", exclude)] if exclude else []
+
+    def scan(directory, prefix, rules):
+        """Start on a directory: pick up its .gitignore, and list its contents sorted by name."""
+        gitignore = IgnoreRules.from_file(Path(directory) / ".gitignore") if use_gitignore else None
+        if gitignore:
+            rules = [*rules, (prefix, gitignore)]
+        try:
+            with os.scandir(directory) as scanner:
+                entries = sorted(scanner, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.debug(f"Unable to read {directory}: {e}")
+            entries = []
+        return iter(entries), prefix, rules
+
+    # The .gitignore files in the directories above subdirectory apply to it too
+    prefix = ""
+    for part in PurePosixPath(subdirectory).parts:
+        gitignore = IgnoreRules.from_file(Path(root) / prefix / ".gitignore") if use_gitignore else None
+        if gitignore:
+            rules = [*rules, (prefix, gitignore)]
+        prefix += part + "/"
+
+    # A stack of directories being walked, so deep trees don't hit the recursion limit
+    stack = [scan(Path(root) / subdirectory, prefix, rules)]
+    while stack:
+        entries, prefix, rules = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+
+        if ignore_regex and ignore_regex.match(entry.name):
+            continue
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            is_dir = False
+        path = prefix + entry.name
+        if use_gitignore and (entry.name == ".git" or is_ignored(rules, path, is_dir)):
+            continue
+
+        yield WalkEntry(path, entry.name, len(stack), is_dir)
+        if is_dir:
+            stack.append(scan(entry.path, path + "/", rules))
+
+
+def is_ignored(rules, path, is_dir):
+    """Check a path against the gitignore rules, where the deepest file with a matching rule decides."""
+    for prefix, level_rules in reversed(rules):
+        ignored = level_rules.match(path[len(prefix) :], is_dir)
+        if ignored is not None:
+            return ignored
+    return False
+
+
+# ---------------------------------------------------------------------------- #
+#                                Directory trees                               #
+# ---------------------------------------------------------------------------- #
+
+# Tree lines are indentation, punctuation and short names, which take more tokens than code or prose do:
+# about 3 bytes per token, and fewer for short names. We budget them at 2, so the tree stays within max_tokens
+TREE_BYTES_PER_TOKEN = 2
+
+
+class TreeNode:
+    __slots__ = ("children", "file_count", "is_dir", "name", "path")
+
+    def __init__(self, name, path, is_dir):
+        self.name = name
+        self.path = path
+        self.is_dir = is_dir
+        self.children = []
+        self.file_count = 0  # Files anywhere below this directory
+
+    def line(self, depth, collapsed=False):
+        if not self.is_dir:
+            return "  " * depth + f"- [File] {self.name}\n"
+        if collapsed:
+            files = "1 file" if self.file_count == 1 else f"{self.file_count:,} files"
+            return "  " * depth + f"- [Directory] {self.name} ({files})\n"
+        return "  " * depth + f"- [Directory] {self.name}\n"
+
+
+class DirectoryTree:
+    """The files and directories under a path, which can be rendered in full or within a token budget.
+
+    The tree can be kept up to date with refresh(), which only walks the directories that changed.
+    Adding, removing or renaming an entry changes the modification time of the directory it's in,
+    so checking that is a stat per directory, instead of listing every directory again.
+    """
+
+    # A directory modified this close to when we walked it may have changed during the walk (like
+    # "racy git"), and the file system clock can be coarse, so it's walked again on the next refresh
+    RACY_NS = 1_000_000_000
+
+    def __init__(self, root, ignore_patterns=None, use_gitignore=True, name=None):
+        self.path = Path(root)
+        self.ignore_patterns = ignore_patterns
+        self.use_gitignore = use_gitignore
+        self.root = TreeNode(self.path.name if name is None else name, "", is_dir=True)
+        self.stamps = {}  # Directory path -> its stamp when we last walked it, None to walk it again
+        self.rewalk(self.root)
+
+    def stamp(self, directory):
+        """What we check to know whether a directory's contents changed: its mtime, and its gitignore files'.
+
+        Returns None if the directory is gone."""
+        try:
+            stamp = [(self.path / directory.path).stat().st_mtime_ns]
+        except OSError:
+            return None
+        if self.use_gitignore:
+            # A .gitignore being added or removed changes the directory, but being edited doesn't
+            ignore_files = [self.path / ".git" / "info" / "exclude"] if directory is self.root else []
+            ignore_files += [self.path / child.path for child in directory.children if child.name == ".gitignore"]
+            for ignore_file in ignore_files:
+                try:
+                    stamp.append(ignore_file.stat().st_mtime_ns)
+                except OSError:
+                    stamp.append(None)
+        return tuple(stamp)
+
+    def rewalk(self, directory):
+        """Replace the contents of a directory with what's on disk now."""
+        started = time.time_ns()
+        old_file_count = directory.file_count
+        directory.children = []
+        directory.file_count = 0
+        prefix = f"{directory.path}/" if directory.path else ""
+        self.stamps = {path: stamp for path, stamp in self.stamps.items() if not path.startswith(prefix)}
+
+        stack = [directory]
+        directories = [directory]
+        for entry in walk(self.path, self.ignore_patterns, self.use_gitignore, directory.path):
+            node = TreeNode(entry.name, entry.path, entry.is_dir)
+            del stack[entry.depth :]
+            stack[-1].children.append(node)
+            if entry.is_dir:
+                stack.append(node)
+                directories.append(node)
+            else:
+                for parent in stack:
+                    parent.file_count += 1
+
+        for ancestor in self.ancestors(directory):
+            ancestor.file_count += directory.file_count - old_file_count
+
+        for node in directories:
+            stamp = self.stamp(node)
+            racy = stamp is None or max(value or 0 for value in stamp) >= started - self.RACY_NS
+            self.stamps[node.path] = None if racy else stamp
+
+    def ancestors(self, directory):
+        """The directories that contain directory, from the root down."""
+        ancestors = []
+        node = self.root
+        for part in directory.path.split("/") if directory.path else []:
+            ancestors.append(node)
+            node = next(child for child in node.children if child.name == part)
+        return ancestors
+
+    def refresh(self):
+        """Walk the directories that changed since they were last walked, and return how many that was."""
+        changed = []
+        # Parents are checked before their children, and a changed directory is walked with everything in it
+        stack = [(self.root, None)]
+        while stack:
+            node, parent = stack.pop()
+            stamp = self.stamp(node)
+            if stamp is None and parent is not None:
+                changed.append(parent)  # It's gone, which its parent should show
+            elif stamp is None or stamp != self.stamps.get(node.path):
+                changed.append(node)
+            else:
+                stack.extend((child, node) for child in node.children if child.is_dir)
+
+        rewalked = []
+        for node in sorted(changed, key=lambda node: node.path):
+            if any(node is done or node.path.startswith(f"{done.path}/") or not done.path for done in rewalked):
+                continue  # Already walked, as part of a directory it's in
+            logger.debug(f"Directory changed, walking it again: {node.path or self.path}")
+            self.rewalk(node)
+            rewalked.append(node)
+        return len(rewalked)
+
+    def render(self, indent=0, max_tokens=None, focus=()):
+        """Render the tree as lines of `- [Directory] name` and `- [File] name`, indented by depth.
+
+        With max_tokens, directories are expanded one at a time, in order of priority, as long as their
+        contents fit in the budget. The rest are collapsed into a summary like `- [Directory] fixtures (1,243 files)`.
+        Directories holding (or near) the focus paths (relative to the root) go first, then shallow
+        directories, then small ones.
+        """
+        expanded = self.expand_within_budget(max_tokens, focus, indent) if max_tokens is not None else None
+
+        lines = []
+        stack = [(iter([self.root]), indent)]
+        while stack:
+            node = next(stack[-1][0], None)
+            if node is None:
+                stack.pop()
+                continue
+            depth = stack[-1][1]
+            is_expanded = node.is_dir and (expanded is None or node in expanded)
+            lines.append(node.line(depth, collapsed=node.is_dir and not is_expanded))
+            if is_expanded:
+                stack.append((iter(node.children), depth + 1))
+        return "".join(lines)
+
+    def expand_within_budget(self, max_tokens, focus=(), indent=0):
+        """Decide which directories to expand (show the contents of), greedily by priority, within max_tokens."""
+        focus_dirs = {tuple(Path(path).parent.parts) for path in focus}
+
+        def distance(node):
+            """How far (in steps through the tree) a directory is from the nearest focus directory."""
+            parts = tuple(node.path.split("/")) if node.path else ()
+            if not focus_dirs:
+                return 0
+            best = None
+            for focus_dir in focus_dirs:
+                if focus_dir[: len(parts)] == parts:
+                    return 0  # It's the focus directory, or one that contains it
+                common = 0
+                for a, b in zip(parts, focus_dir, strict=False):
+                    if a != b:
+                        break
+                    common += 1
+                steps = len(parts) + len(focus_dir) - 2 * common
+                best = steps if best is None else min(best, steps)
+            return best
+
+        def cost(node, depth):
+            return estimate_tokens(
+                sum(len(child.line(depth + 1, collapsed=True).encode()) for child in node.children),
+                bytes_per_token=TREE_BYTES_PER_TOKEN,
+            )
+
+        expanded = set()
+        budget = max_tokens - estimate_tokens(
+            len(self.root.line(indent).encode()), bytes_per_token=TREE_BYTES_PER_TOKEN
+        )
+        counter = 0  # Tie breaker, so the heap never compares nodes
+        candidates = [((0, 0, len(self.root.children)), counter, self.root, indent)]
+        while candidates:
+            _, _, node, depth = heapq.heappop(candidates)
+            node_cost = cost(node, depth)
+            if node_cost > budget:
+                continue
+            budget -= node_cost
+            expanded.add(node)
+            for child in node.children:
+                if child.is_dir and child.children:
+                    counter += 1
+                    priority = (distance(child), depth + 1, len(child.children))
+                    heapq.heappush(candidates, (priority, counter, child, depth + 1))
+        return expanded
+
+
+# Kept for the whole process, so a long running command (sidekick) only walks what changed between turns
+_directory_trees = {}
+
+
+def get_directory_tree(root, ignore_patterns=None, use_gitignore=True):
+    """Get the DirectoryTree for root, reusing (and refreshing) the one from the last call if there was one."""
+    key = (Path(root).resolve(), tuple(ignore_patterns or ()), use_gitignore)
+    tree = _directory_trees.get(key)
+    if tree is None:
+        tree = _directory_trees[key] = DirectoryTree(key[0], ignore_patterns, use_gitignore, name=Path(root).name)
+    else:
+        tree.refresh()
+    return tree
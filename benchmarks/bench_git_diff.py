@@ -0,0 +1,68 @@
+"""Benchmark one git diff per changed file vs. one batched git diff, on a synthetic many-file change.
+
+Usage: python -m benchmarks.bench_git_diff [number_of_files]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aicodebot.coder import Coder
+from aicodebot.helpers import exec_and_get_output
+
+
+def make_synthetic_change(root, number_of_files):
+    """Commit number_of_files files, then stage a change to every one of them."""
+    os.chdir(root)
+    subprocess.run(["git", "init", "-q"], check=True)
+    subprocess.run(["git", "config", "user.email", "bench@aicodebot.dev"], check=True)
+    subprocess.run(["git", "config", "user.name", "AICodeBot Benchmark"], check=True)
+    files = [f"pkg{number % 20}/module_{number}.py" for number in range(number_of_files)]
+    for file_name in files:
+        Path(file_name).parent.mkdir(exist_ok=True)
+        Path(file_name).write_text("".join(f"value_{line} = {line}\n" for line in range(100)))
+    subprocess.run(["git", "add", "."], check=True)
+    subprocess.run(["git", "commit", "-q", "-m", "Synthetic files"], check=True)
+
+    for file_name in files:
+        Path(file_name).write_text("".join(f"value_{line} = {line * 2}\n" for line in range(100)))
+    subprocess.run(["git", "add", "."], check=True)
+    return files
+
+
+def per_file(files):
+    """The old approach, one git process per file."""
+    return {file_name: exec_and_get_output(["git", "diff", "-U10", "--cached", "--", file_name]) for file_name in files}
+
+
+def batched(files):
+    return Coder.git_diff_per_file("--cached", files)
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:8.3f}s")
+    return result, elapsed
+
+
+def main():
+    number_of_files = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    with tempfile.TemporaryDirectory() as root:
+        files = make_synthetic_change(root, number_of_files)
+        print(f"{number_of_files:,} changed files")
+
+        per_file_diffs, per_file_time = timed("one git diff per file", per_file, files)
+        batched_diffs, batched_time = timed("batched git diff", batched, files)
+        assert batched_diffs == per_file_diffs
+        print(f"speedup: {per_file_time / batched_time:.1f}x")
+
+        timed("git_diff_context", Coder.git_diff_context)
+
+
+if __name__ == "__main__":
+    main()
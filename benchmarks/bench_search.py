@@ -0,0 +1,70 @@
+"""Benchmark building, refreshing, and querying the search index on a synthetic repo.
+
+Usage: python -m benchmarks.bench_search [number_of_files]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aicodebot.search import SearchIndex
+
+FILE_TEMPLATE = '''
+class Widget{number}:
+    """A synthetic widget, number {number}."""
+
+    def __init__(self, name, size={number}):
+        self.name = name
+        self.size = size
+
+    def describe_widget_{number}(self):
+        return f"Widget {{self.name}} has size {{self.size}} and serial {number:08d}"
+
+    def resizeToFit(self, container):
+        self.size = min(self.size, container.capacity)
+
+'''
+
+QUERIES = [
+    "How does describe_widget_4242 work?",
+    "Why is Widget1234 resizeToFit different from Widget77?",
+    "Where is module_9999 used?",
+]
+
+
+def make_synthetic_repo(root, number_of_files):
+    for number in range(number_of_files):
+        path = Path(root) / f"pkg{number % 50}" / f"module_{number}.py"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(FILE_TEMPLATE.format(number=number) * 10)
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:10.1f}ms")
+    return result
+
+
+def main():
+    number_of_files = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as data:
+        make_synthetic_repo(root, number_of_files)
+        index = SearchIndex(root, Path(data) / "search.sqlite")
+        print(f"{number_of_files:,} files")
+
+        timed("update (empty index)", index.update)
+        timed("update (nothing changed)", index.update)
+        os.utime(Path(root) / "pkg0" / "module_0.py", ns=(1, 1))
+        timed("update (one file changed)", index.update)
+        for label in ("cold", "warm"):
+            for query in QUERIES:
+                chunks = timed(f"search ({label}): {query[:26]}", index.search, query, 5)
+                assert chunks
+
+
+if __name__ == "__main__":
+    main()
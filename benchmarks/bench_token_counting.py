@@ -0,0 +1,75 @@
+"""Benchmark serial vs. batched, multi-threaded token counting on a synthetic repo.
+
+Usage: python -m benchmarks.bench_token_counting [number_of_files]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aicodebot.coder import Coder
+from aicodebot.tokens import count_tokens, count_tokens_many, get_tokenizer_workers
+
+FILE_TEMPLATE = '''
+class Widget{number}:
+    """A synthetic widget, number {number}."""
+
+    def __init__(self, name, size={number}):
+        self.name = name
+        self.size = size
+
+    def describe(self):
+        return f"Widget {{self.name}} has size {{self.size}} and serial {number:08d}"
+'''
+
+
+def make_synthetic_repo(root, number_of_files):
+    files = []
+    for number in range(number_of_files):
+        path = Path(root) / f"pkg{number % 50}" / f"module_{number}.py"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(FILE_TEMPLATE.format(number=number) * 20)
+        files.append(str(path))
+    return files
+
+
+def serial(files):
+    return [count_tokens(Path(file).read_text()) for file in files]
+
+
+def parallel(files, workers):
+    contents = Coder.read_files(files, workers)
+    return count_tokens_many([contents[file].decode() for file in files], workers)
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.3f}s")
+    return result, elapsed
+
+
+def main():
+    number_of_files = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    with tempfile.TemporaryDirectory() as root:
+        files = make_synthetic_repo(root, number_of_files)
+        count_tokens("warm up")
+        print(f"{number_of_files:,} files, {get_tokenizer_workers()} workers by default")
+
+        serial_counts, serial_time = timed("serial", serial, files)
+        for workers in (1, 4, get_tokenizer_workers()):
+            parallel_counts, parallel_time = timed(f"parallel (workers={workers})", parallel, files, workers)
+            assert parallel_counts == serial_counts
+        print(f"speedup: {serial_time / parallel_time:.1f}x")
+
+        # The full path, including the on-disk cache (cold, then warm)
+        os.environ["AICODEBOT_LOCAL_DATA_DIR"] = root
+        timed("file_token_counts (cold cache)", Coder.file_token_counts, files)
+        timed("file_token_counts (warm cache)", Coder.file_token_counts, files)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Micro-benchmark for the per-call overhead of counting tokens.
+
+Compares the old token_size() path (a LanguageModelManager per call, which re-reads the config
+and re-resolves the encoding) with the process-wide cached tokenizer.
+
+Usage: python -m benchmarks.bench_tokenizer
+"""
+
+import os
+import tempfile
+import timeit
+from pathlib import Path
+
+import tiktoken
+import yaml
+
+from aicodebot.config import reload
+from aicodebot.lm import LanguageModelManager
+from aicodebot.tokens import TIKTOKEN_MODEL_NAME, count_tokens, count_tokens_many
+
+TEXT = "def greet(name):\n    return f'Hello, {name}! Code with heart. ❤️🤖'\n"
+CALLS = 2_000
+
+
+def legacy_token_size(text):
+    # What token_size() used to do on every call. The config is memoized now, so forget it first to
+    # parse the config and session files again, like it used to
+    reload()
+    LanguageModelManager()
+    return len(tiktoken.encoding_for_model(TIKTOKEN_MODEL_NAME).encode(text))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_file = Path(temp_dir) / "config.yaml"
+        config_file.write_text(
+            yaml.dump({"version": 1.3, "provider": "openai", "model": "gpt-5", "openai_api_key": "sk-bench"})
+        )
+        os.environ["AICODEBOT_CONFIG_FILE"] = str(config_file)
+        os.environ["AICODEBOT_SESSION_FILE"] = str(Path(temp_dir) / "session.yaml")
+
+        count_tokens(TEXT)  # warm up, so we measure the steady state
+        legacy = timeit.timeit(lambda: legacy_token_size(TEXT), number=CALLS)
+        cached = timeit.timeit(lambda: count_tokens(TEXT), number=CALLS)
+        batched = timeit.timeit(lambda: count_tokens_many([TEXT] * 100), number=CALLS // 100)
+
+    print(f"{'legacy token_size()':<24} {legacy / CALLS * 1e6:10.1f} µs/call")
+    print(f"{'count_tokens()':<24} {cached / CALLS * 1e6:10.1f} µs/call")
+    print(f"{'count_tokens_many()':<24} {batched / CALLS * 1e6:10.1f} µs/text")
+    print(f"speedup: {legacy / cached:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark the recursive fnmatch directory walk vs. the scandir walker and the git ls-files fast path,
+and refreshing a DirectoryTree (like each sidekick turn does).
+
+Usage: python -m benchmarks.bench_walk [number_of_entries]
+"""
+
+import fnmatch
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aicodebot.coder import Coder
+from aicodebot.walk import DirectoryTree, walk_directory
+
+GITIGNORE = "*.log\n*.tmp\n__pycache__\nbuild/\n!keep.log\n"
+
+
+def make_synthetic_tree(root, number_of_entries):
+    """About number_of_entries files and directories, 3 levels deep, with a .gitignore at each level."""
+    root = Path(root)
+    (root / ".gitignore").write_text(GITIGNORE)
+    entries = 0
+    for top in range(max(1, number_of_entries // 2_500)):
+        for middle in range(10):
+            directory = root / f"pkg{top}" / f"module{middle}"
+            directory.mkdir(parents=True)
+            (directory / ".gitignore").write_text("*.pyc\n")
+            for number in range(240):
+                suffix = (".py", ".py", ".py", ".log", ".txt", ".tmp")[number % 6]
+                (directory / f"file{number}{suffix}").write_text("")
+            entries += 242
+    return entries
+
+
+def legacy_generate_directory_structure(path, ignore_patterns=None, use_gitignore=True, indent=0):
+    """The implementation before the scandir walker, for comparison."""
+    ignore_patterns = ignore_patterns.copy() if ignore_patterns else []
+    base_path = Path(path)
+    if use_gitignore:
+        gitignore_file = base_path / ".gitignore"
+        if gitignore_file.exists():
+            with gitignore_file.open() as f:
+                ignore_patterns.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+    structure = ""
+    if base_path.is_dir():
+        if not any(fnmatch.fnmatch(base_path.name, pattern) for pattern in ignore_patterns):
+            structure += "  " * indent + f"- [Directory] {base_path.name}\n"
+            for item in base_path.iterdir():
+                structure += legacy_generate_directory_structure(item, ignore_patterns, use_gitignore, indent + 1)
+    elif not any(fnmatch.fnmatch(base_path.name, pattern) for pattern in ignore_patterns):
+        structure += "  " * indent + f"- [File] {base_path.name}\n"
+    return structure
+
+
+def timed(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f}s")
+    return result, elapsed
+
+
+def main():
+    number_of_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    with tempfile.TemporaryDirectory() as root:
+        entries = make_synthetic_tree(root, number_of_entries)
+        print(f"{entries:,} entries")
+
+        legacy, legacy_time = timed("legacy recursive walk", legacy_generate_directory_structure, root, [".git"])
+        _, walker_time = timed("scandir walker", lambda: list(walk_directory(root)))
+        structure, _ = timed("generate_directory_structure (no repo)", Coder.generate_directory_structure, root)
+        print(f"{len(legacy.splitlines()):,} lines before, {len(structure.splitlines()):,} lines now")
+        print(f"speedup: {legacy_time / walker_time:.1f}x")
+
+        subprocess.run(["git", "init", "-q", root], check=True)
+        timed("DirectoryTree (git repo)", DirectoryTree, root)
+
+        # Backdate everything, so nothing looks like it changed while being walked
+        an_hour_ago = time.time_ns() - 3_600_000_000_000
+        for directory, _, file_names in os.walk(root):
+            for path in [directory, *(Path(directory) / file_name for file_name in file_names)]:
+                os.utime(path, ns=(an_hour_ago, an_hour_ago))
+        tree = DirectoryTree(root)
+        timed("refresh, nothing changed", tree.refresh)
+        (Path(root) / "pkg0" / "module3" / "new_file.py").write_text("")
+        timed("refresh, one new file", tree.refresh)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,14 @@ def temp_git_repo(tmp_path):
     return repo
 
 
+@pytest.fixture
+def local_data_dir(tmp_path_factory, monkeypatch):
+    # Keep the caches and indexes the code under test stores out of the real ~/.aicodebot
+    data_dir = tmp_path_factory.mktemp("data")
+    monkeypatch.setenv("AICODEBOT_LOCAL_DATA_DIR", str(data_dir))
+    return data_dir
+
+
 @contextmanager
 def in_temp_directory(tmp_path):
     old_dir = Path.cwd()
@@ -1,7 +1,11 @@
+import inspect
 import json
 import os
+import subprocess
+import sys
 from pathlib import Path
 
+import click
 import pytest
 from git import Repo
 
@@ -156,8 +160,61 @@ def test_sidekick(cli_runner, monkeypatch):
     assert "5" in result.output
 
 
+def test_lazy_subcommands(cli_runner, monkeypatch):
+    """--help and --version shouldn't import the heavy dependencies, we get called from git hooks a lot"""
+    heavy_modules = [
+        "langchain_openai",
+        "langchain_anthropic",
+        "langchain_core",
+        "tiktoken",
+        "pygments",
+        "prompt_toolkit",
+        "arrow",
+    ]
+    code = (
+        "import sys\n"
+        "from click.testing import CliRunner\n"
+        "from aicodebot.cli import cli\n"
+        "for args in (['--help'], ['--version']):\n"
+        "    assert CliRunner().invoke(cli, args).exit_code == 0\n"
+        f"print(','.join(module for module in {heavy_modules!r} if module in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "", f"Imported by --help: {result.stdout}"
+
+    # The short help we show without importing matches the command's own help
+    ctx = click.Context(cli)
+    for name, short_help in cli.lazy_commands.items():
+        command = cli.get_command(ctx, name)
+        assert command.name == name
+        assert inspect.cleandoc(command.help).startswith(short_help)
+
+    result = cli_runner.invoke(cli, ["--help"])
+    assert result.exit_code == 0
+    assert "sidekick   Coding help from your AI sidekick coding assistant" in result.output
+
+    monkeypatch.setenv("AICODEBOT_CONFIG_FILE", str(Path(__file__).parent / "test_config.yaml"))
+    result = cli_runner.invoke(cli, ["commit", "--help"])
+    assert result.exit_code == 0
+    assert "--skip-pre-commit" in result.output
+
+
 def test_version(cli_runner, monkeypatch):
     monkeypatch.setenv("AICODEBOT_CONFIG_FILE", str(Path(__file__).parent / "test_config.yaml"))
     result = cli_runner.invoke(cli, ["-V"])
     assert result.exit_code == 0, f"output: {result.output}"
     assert aicodebot_version in result.output
+
+
+def test_profile(cli_runner, monkeypatch, tmp_path):
+    monkeypatch.setenv("AICODEBOT_CONFIG_FILE", str(Path(__file__).parent / "test_config.yaml"))
+    pstats_file = tmp_path / "aicodebot.prof"
+    result = cli_runner.invoke(cli, ["--profile-output", str(pstats_file), "commit", "--help"])
+    assert result.exit_code == 0, f"Output: {result.output}"
+    assert "--skip-pre-commit" in result.output
+    assert "imports" in result.output
+    assert "config load" in result.output
+    assert pstats_file.exists()
+
+    result = cli_runner.invoke(cli, ["commit", "--help"])
+    assert "config load" not in result.output
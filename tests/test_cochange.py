@@ -0,0 +1,53 @@
+from aicodebot.cochange import CoChangeIndex
+
+
+def test_cochange_index(tmp_path):
+    index = CoChangeIndex(tmp_path, tmp_path / "cochange.sqlite")
+    assert index.head is None
+    assert index.related(["coder.py"]) == []
+
+    index.add_commits(
+        [
+            ("c3", ["coder.py", "test_coder.py"]),
+            ("c2", ["coder.py", "test_coder.py", "README.md"]),
+            ("c1", ["coder.py", "cli.py"]),
+        ],
+        "c3",
+    )
+    assert index.head == "c3"
+    assert index.related(["coder.py"]) == ["test_coder.py", "README.md", "cli.py"]
+    assert index.related(["test_coder.py"]) == ["coder.py", "README.md"]
+    assert index.related(["coder.py"], max_files=1) == ["test_coder.py"]
+    assert index.related([]) == []
+
+    # New commits add to the counts, they don't replace them
+    index.add_commits([("c5", ["cli.py", "coder.py"]), ("c4", ["cli.py", "coder.py"])], "c5", since="c3")
+    assert index.head == "c5"
+    assert index.related(["coder.py"]) == ["cli.py", "test_coder.py", "README.md"]
+
+    # If another session got there first, the commits aren't counted again
+    assert not index.add_commits([("c5", ["cli.py", "coder.py"]), ("c4", ["cli.py", "coder.py"])], "c5", since="c3")
+    assert not index.add_commits([("c4", ["README.md", "new.py"])], "c4", since="c3")
+    assert index.head == "c5"
+    assert index.related(["new.py"]) == []
+    assert index.related(["coder.py", "cli.py"]) == ["test_coder.py", "README.md"]
+
+    # It's stored, another index for the same root picks up where this one left off
+    index = CoChangeIndex(tmp_path, tmp_path / "cochange.sqlite")
+    assert index.head == "c5"
+    assert index.related(["coder.py"])[0] == "cli.py"
+
+    # Commits touching lots of files count toward each file, but not toward any pairs
+    index.add_commits([("c6", ["coder.py"] + [f"vendor/{number}.py" for number in range(40)])], "c6", since="c5")
+    assert "vendor/0.py" not in index.related(["coder.py"])
+
+    # Lots of files at once are looked up in batches
+    assert index.related([f"vendor/{number}.py" for number in range(40)] * 30 + ["coder.py"]) == [
+        "cli.py",
+        "test_coder.py",
+        "README.md",
+    ]
+
+    index.reset()
+    assert index.head is None
+    assert index.related(["coder.py"]) == []
@@ -4,11 +4,116 @@ from pathlib import Path
 
 import pytest
 
-from aicodebot.coder import Coder
+from aicodebot import coder, repo
+from aicodebot.coder import BINARY_SNIFF_BYTES, Coder, RepoSnapshot
 from aicodebot.helpers import create_and_write_file
+from aicodebot.tokens import count_tokens
 from tests.conftest import in_temp_directory
 
 
+@pytest.fixture
+def git_commands(monkeypatch):
+    """Record the git commands that get run"""
+    git_commands = []
+    exec_and_get_output = coder.exec_and_get_output
+    for module in (coder, repo):
+        monkeypatch.setattr(
+            module, "exec_and_get_output", lambda command: git_commands.append(command) or exec_and_get_output(command)
+        )
+    return git_commands
+
+
+def test_auto_file_context_budget(temp_git_repo, monkeypatch, local_data_dir):
+    with in_temp_directory(temp_git_repo.working_dir):
+        for number in range(1, 8):
+            create_and_write_file(f"file{number}.py", f"print('file {number}')\n" * number * 20)
+        create_and_write_file("huge.txt", "All work and no play makes Jack a dull boy.\n" * 50_000)
+        temp_git_repo.git.add(".")
+
+        # The huge file should be rejected from its size alone
+        load_file = Coder.load_file
+        monkeypatch.setattr(
+            Coder,
+            "load_file",
+            lambda file: pytest.fail("huge.txt was read") if file == "huge.txt" else load_file(file),
+        )
+
+        for max_tokens, max_file_tokens in [(500, 200), (1_000, 1_000), (50, 50), (10_000, 300)]:
+            files = Coder.auto_file_context(max_tokens, max_file_tokens)
+            token_counts = [count_tokens(Path(file).read_text()) for file in files]
+            assert sum(token_counts) <= max_tokens
+            assert all(tokens <= max_file_tokens for tokens in token_counts)
+            assert "huge.txt" not in files
+
+        # With plenty of room, everything but the huge file makes it in, including the recently committed file
+        files = Coder.auto_file_context(10_000, 10_000)
+        assert len(files) == 8
+        assert "initial_commit.txt" in files
+
+        # What was left out, and why
+        create_and_write_file("empty.py", "")
+        Path("image.png").write_bytes(b"\x89PNG\0\0")
+        temp_git_repo.git.add(".")
+        packing = Coder.pack_file_context(1_000, 500)
+        assert packing.selected == Coder.auto_file_context(1_000, 500)
+        assert packing.tokens <= 1_000
+        assert packing.excluded["empty.py"] == "empty"
+        assert packing.excluded["image.png"] == "binary"
+        assert packing.excluded["huge.txt"] == "over the file limit"
+        assert set(packing.selected).isdisjoint(packing.excluded)
+
+
+def test_auto_file_context_follows_imports(temp_git_repo, local_data_dir):
+    with in_temp_directory(temp_git_repo.working_dir):
+        create_and_write_file("unrelated.py", "print('hi')\n")
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add unrelated file")
+        create_and_write_file("models.py", "class User:\n    pass\n")
+        create_and_write_file("views.py", "from models import User\n")
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add files")
+        temp_git_repo.git.commit("--allow-empty", "-m", "Nothing")
+        temp_git_repo.git.commit("--allow-empty", "-m", "Nothing")
+        temp_git_repo.git.commit("--allow-empty", "-m", "Nothing")
+
+        # The changed file first, then what it's connected to through imports. The rest aren't related
+        create_and_write_file("models.py", "class User:\n    name = None\n", overwrite=True)
+        assert Coder.auto_file_context(1_000, 1_000) == ["models.py", "views.py"]
+
+
+def test_auto_file_context_cochanged_files(temp_git_repo, git_commands, local_data_dir):
+    with in_temp_directory(temp_git_repo.working_dir):
+        (Path("aicodebot")).mkdir()
+        (Path("tests")).mkdir()
+        for number in range(3):
+            create_and_write_file("aicodebot/coder.py", f"version = {number}\n", overwrite=True)
+            create_and_write_file("tests/test_coder.py", f"version = {number}\n", overwrite=True)
+            temp_git_repo.git.add(".")
+            temp_git_repo.git.commit("-m", f"Coder change {number}")
+        for number in range(4):
+            create_and_write_file(f"other{number}.txt", "other\n")
+            temp_git_repo.git.add(".")
+            temp_git_repo.git.commit("-m", f"Other change {number}")
+
+        # The test file hasn't changed in the last few commits, it's in because it changes with coder.py
+        create_and_write_file("aicodebot/coder.py", "version = 3\n", overwrite=True)
+        temp_git_repo.git.add("aicodebot/coder.py")
+        files = Coder.auto_file_context(10_000, 10_000)
+        assert files[:2] == ["aicodebot/coder.py", "tests/test_coder.py"]
+
+        # Only the commits since last time are read
+        temp_git_repo.git.commit("-m", "Coder change 3")
+        create_and_write_file("aicodebot/coder.py", "version = 4\n", overwrite=True)
+        git_commands.clear()
+        assert Coder.git_cochanged_files(["aicodebot/coder.py"]) == ["tests/test_coder.py"]
+        log_commands = [command for command in git_commands if command[:2] == ["git", "log"]]
+        assert [command[-1] for command in log_commands] == [f"{temp_git_repo.head.commit.parents[0].hexsha}..HEAD"]
+
+        # Rewriting history starts the index over
+        temp_git_repo.git.commit("--amend", "-m", "Coder change 3, amended")
+        assert Coder.git_cochanged_files(["aicodebot/coder.py"]) == ["tests/test_coder.py"]
+
+
 def test_generate_directory_structure(
     tmp_path,
 ):  # Create a file, a hidden file, another file, a .gitignore file, and a subdirectory in the temporary directory
@@ -51,6 +156,72 @@ def test_generate_directory_structure(
     assert len(file_list) > 10
 
 
+def test_file_token_counts(temp_git_repo, monkeypatch, local_data_dir):
+    with in_temp_directory(temp_git_repo.working_dir):
+        create_and_write_file("untracked.txt", "This file isn't in git yet.")
+        Path("binary.bin").write_bytes(b"\0\1\2")
+
+        files = ["initial_commit.txt", "untracked.txt", "binary.bin"]
+        token_counts = Coder.file_token_counts(files)
+        assert token_counts["initial_commit.txt"] == count_tokens("This is a test file.")
+        assert token_counts["untracked.txt"] == count_tokens("This file isn't in git yet.")
+        assert token_counts["binary.bin"] is None
+
+        # Tracked, unchanged files come straight from the index + cache, without being read.
+        # GitPython doesn't record file stats in the index, so refresh it like `git status` does
+        temp_git_repo.git.update_index("--refresh")
+        assert Coder.git_blob_shas() == {"initial_commit.txt": Coder.git_blob_sha(b"This is a test file.")}
+        with monkeypatch.context() as m:
+            m.setattr(Coder, "load_file", lambda file: pytest.fail(f"{file} should not be read"))
+            assert Coder.file_token_counts(["initial_commit.txt"]) == {
+                "initial_commit.txt": token_counts["initial_commit.txt"]
+            }
+
+        # Modifying a file means a new blob SHA, so it gets counted again
+        create_and_write_file("initial_commit.txt", "This is a modified test file.", overwrite=True)
+        assert "initial_commit.txt" not in Coder.git_blob_shas()
+        token_counts = Coder.file_token_counts(["initial_commit.txt"])
+        assert token_counts["initial_commit.txt"] == count_tokens("This is a modified test file.")
+
+        # Files over the size limit aren't read, they count as the most tokens their size allows
+        create_and_write_file("big.txt", "A tracked file that's too big to read.")
+        temp_git_repo.git.add("big.txt")
+        temp_git_repo.git.commit("-m", "Add a big file")
+        assert "big.txt" in Coder.git_blob_shas()
+        with monkeypatch.context() as m:
+            m.setenv("AICODEBOT_MAX_FILE_BYTES", "10")
+            assert Coder.file_token_counts(["untracked.txt", "big.txt"]) == {"untracked.txt": 27, "big.txt": 38}
+
+        # That's not a count, so it isn't cached
+        assert Coder.file_token_counts(["big.txt"]) == {
+            "big.txt": count_tokens("A tracked file that's too big to read.")
+        }
+
+
+def test_load_file(tmp_path, monkeypatch):
+    text_file = tmp_path / "text.txt"
+    text_file.write_text("Hello, 世界\n")
+    loaded = Coder.load_file(text_file)
+    assert loaded.text == "Hello, 世界\n"
+    assert loaded.data == text_file.read_bytes()
+    assert (loaded.is_binary, loaded.too_big, loaded.size) == (False, False, 14)
+    assert loaded.mtime_ns == text_file.stat().st_mtime_ns
+
+    # Binary is decided from the start of the file, like git
+    binary_file = tmp_path / "binary.bin"
+    binary_file.write_bytes(b"PK\0\3" + b"x" * 10_000)
+    assert Coder.load_file(binary_file).is_binary
+    assert Coder.load_file(binary_file).text is None
+    binary_file.write_bytes(b"x" * BINARY_SNIFF_BYTES + b"\0")
+    assert not Coder.is_binary_file(binary_file)
+
+    # Over the limit, only the start is looked at
+    monkeypatch.setenv("AICODEBOT_MAX_FILE_BYTES", "10")
+    loaded = Coder.load_file(text_file)
+    assert (loaded.data, loaded.text, loaded.is_binary, loaded.too_big, loaded.size) == (None, None, False, True, 14)
+    assert Coder.load_file(text_file, max_bytes=100).text == "Hello, 世界\n"
+
+
 def test_get_file_info():
     # Test with a text file
     is_binary, file_type = Coder.get_file_info("tests/test_coder.py")
@@ -149,6 +320,166 @@ def test_git_diff_context(temp_git_repo):
     os.chdir(original_dir)
 
 
+def test_git_diff_per_file(temp_git_repo, git_commands):
+    with in_temp_directory(temp_git_repo.working_dir):
+        for number in range(20):
+            create_and_write_file(f"file{number}.txt", "".join(f"line {line}\n" for line in range(30)))
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add files")
+
+        for number in range(1, 20):
+            create_and_write_file(f"file{number}.txt", f"changed {number}\n", overwrite=True)
+        temp_git_repo.git.mv("file0.txt", "moved.txt")
+        temp_git_repo.git.add(".")
+
+        diff = Coder.git_diff_context()
+
+        # A fixed number of git processes, not one per file
+        assert len(git_commands) == 3
+        assert "## File renamed: file0.txt -> moved.txt" in diff
+        for number in range(1, 20):
+            file_name = f"file{number}.txt"
+            file_diff = temp_git_repo.git.diff("-U10", "--cached", "--", file_name)
+            assert f"## File changed: {file_name}\n{file_diff}\n" in diff
+
+        # Split into chunks, it's the same
+        files = [f"file{number}.txt" for number in range(1, 20)]
+        assert Coder.git_diff_per_file("--cached", files, chunk_size=3) == Coder.git_diff_per_file("--cached", files)
+
+        # With diff.renames=copies, git reports copies too
+        temp_git_repo.git.commit("-m", "Change files")
+        text = Path("moved.txt").read_text()
+        create_and_write_file("copied.txt", text)
+        create_and_write_file("moved.txt", text + "line 30\n", overwrite=True)
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.config("diff.renames", "copies")
+        diff = Coder.git_diff_context()
+        assert "## File copied: moved.txt -> copied.txt" in diff
+        assert "+line 29" in diff
+
+
+def test_git_recent_committed_files(temp_git_repo, git_commands):
+    with in_temp_directory(temp_git_repo.working_dir):
+        # often.txt changes in every commit, recent.txt only in the last one, gone.txt gets deleted
+        for number, files in enumerate(
+            [["often.txt", "gone.txt"], ["often.txt", "old.txt"], ["often.txt", "recent.txt"]]
+        ):
+            for file in files:
+                create_and_write_file(file, f"version {number}", overwrite=True)
+            temp_git_repo.git.add(files)
+            temp_git_repo.git.commit("-m", f"Commit {number}")
+        temp_git_repo.git.rm("gone.txt")
+        temp_git_repo.git.commit("-m", "Remove gone.txt")
+
+        commits = Coder.git_log_files(2)
+        assert [files for _sha, files in commits] == [["gone.txt"], ["often.txt", "recent.txt"]]
+        assert commits[0][0] == temp_git_repo.head.commit.hexsha
+
+        assert Coder.git_recent_committed_files(max_commits=10) == [
+            "often.txt",
+            "recent.txt",
+            "old.txt",
+            "initial_commit.txt",
+        ]
+        assert Coder.git_recent_committed_files(max_files=2, max_commits=10) == ["often.txt", "recent.txt"]
+        assert Coder.git_recent_committed_files(max_commits=2) == ["often.txt", "recent.txt"]
+
+        # One git process, no matter how many commits
+        git_commands.clear()
+        Coder.git_recent_committed_files(max_commits=200)
+        assert len(git_commands) == 1
+
+
+def test_git_changed_lines(temp_git_repo):
+    with in_temp_directory(temp_git_repo.working_dir):
+        create_and_write_file("a.py", "".join(f"line {number}\n" for number in range(1, 11)))
+        create_and_write_file("b.py", "unchanged\n")
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add files")
+
+        lines = [f"line {number}\n" for number in range(1, 11)]
+        lines[2] = "changed 3\n"
+        lines[6:8] = ["changed 7\n", "changed 8\n", "added\n"]
+        del lines[0]
+        create_and_write_file("a.py", "".join(lines), overwrite=True)
+        create_and_write_file("new.py", "untracked\n")
+
+        # Line numbers are after the change. The deletion at the top counts as line 1
+        assert Coder.git_changed_lines(["a.py", "b.py", "new.py"]) == {"a.py": {1, 2, 6, 7, 8}}
+        assert Coder.git_changed_lines([]) == {}
+
+        # Names with spaces (which git ends with a tab) or unusual characters (which git quotes)
+        for file_name in ["my file.py", "café.py", 'say "hi".py']:
+            create_and_write_file(file_name, "one\n")
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add unusual names")
+        for file_name in ["my file.py", "café.py", 'say "hi".py']:
+            create_and_write_file(file_name, "one\ntwo\n", overwrite=True)
+        assert Coder.git_changed_lines(["my file.py", "café.py", 'say "hi".py']) == {
+            "my file.py": {2},
+            "café.py": {2},
+            'say "hi".py': {2},
+        }
+
+
+def test_repo_snapshot(temp_git_repo, git_commands, monkeypatch):
+    with in_temp_directory(temp_git_repo.working_dir):
+        for file in ["a.txt", "b.txt", "c.py"]:
+            create_and_write_file(file, f"{file}\n")
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add files")
+
+        temp_git_repo.git.mv("b.txt", "renamed.txt")
+        create_and_write_file("a.txt", "staged\n", overwrite=True)
+        temp_git_repo.git.add("a.txt")
+        create_and_write_file("a.txt", "staged and then changed\n", overwrite=True)
+        create_and_write_file("c.py", "print('unstaged')\n", overwrite=True)
+        create_and_write_file("untracked.txt", "untracked\n")
+
+        git_commands.clear()
+        snapshot = RepoSnapshot()
+        assert snapshot.staged_files() == Coder.git_staged_files() == ["a.txt", "renamed.txt"]
+        assert snapshot.unstaged_files() == Coder.git_unstaged_files() == ["a.txt", "c.py", "renamed.txt"]
+        assert snapshot.staged_files() == ["a.txt", "renamed.txt"]
+        assert [command[:4] for command in git_commands].count(
+            ["git", "--no-optional-locks", "status", "--porcelain=v2"]
+        ) == 1
+
+        # Each file is looked at once, no matter how many helpers ask
+        load_file_calls = []
+        load_file = Coder.load_file
+        monkeypatch.setattr(Coder, "load_file", lambda file: load_file_calls.append(file) or load_file(file))
+        assert Coder.identify_languages(["a.txt", "c.py"]) == ["Python", "Text only"]  # From the names alone
+        assert load_file_calls == []
+        assert not snapshot.is_binary("c.py")
+        assert snapshot.file_info("a.txt") == (False, "Text only")
+        assert snapshot.load("c.py").text == "print('unstaged')\n"
+        assert snapshot.load("a.txt") is snapshot.load("a.txt")
+        assert load_file_calls == ["c.py", "a.txt"]
+
+        assert snapshot.exists("renamed.txt")
+        assert not snapshot.exists("b.txt")
+        assert snapshot.stat("a.txt") is snapshot.stat("a.txt")
+
+
+def test_repo_snapshot_parse_status():
+    output = "\0".join(
+        [
+            "1 .M N... 100644 100644 100644 3b18e512 3b18e512 modified file.txt",
+            "2 R. N... 100644 100644 100644 3b18e512 3b18e512 R100 new name.txt",
+            "old name.txt",
+            "u UU N... 100644 100644 100644 100644 3b18e512 3b18e512 3b18e512 conflict.txt",
+            "? untracked.txt",
+            "",
+        ]
+    )
+    assert RepoSnapshot.parse_status(output) == [
+        ("modified file.txt", ".", "M"),
+        ("new name.txt", "R", "."),
+        ("conflict.txt", "U", "U"),
+    ]
+
+
 def test_identify_languages():
     # Create a list of test files
     test_files = ["tests/test_coder.py", "LICENSE", "README.md", "pyproject.toml", "assets/robot.png", "setup.py"]
@@ -7,7 +7,9 @@ from aicodebot.config import (
     fetch_anthropic_models,
     fetch_models_for_provider,
     fetch_openai_models,
+    load_yaml_file,
     read_config,
+    reload,
 )
 
 
@@ -27,6 +29,13 @@ def test_session_read_write(tmp_path, monkeypatch):
     read_data = Session.read()
     assert read_data == test_data
 
+    # Writing keeps the mode of the file, and leaves no temp files behind
+    Session.get_config_file().chmod(0o644)
+    Session.write({"key": "other value"})
+    assert Session.get_config_file().stat().st_mode & 0o777 == 0o644
+    assert Session.read() == {"key": "other value"}
+    assert [path.name for path in tmp_path.iterdir()] == ["session.yaml"]
+
 
 def test_detect_api_keys_with_valid_keys(monkeypatch):
     """Test detecting valid API keys from environment variables."""
@@ -206,3 +215,101 @@ def test_read_config_legacy_format(tmp_path, monkeypatch):
     assert config["language_model"] == "gpt-4"
     assert config["openai_api_key"] == "sk-legacy123"
     assert "session" in config  # Session data should be loaded
+
+
+def test_read_config_is_memoized(tmp_path, monkeypatch):
+    """The config and session files are only parsed again when they change."""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.dump({"version": 1.3, "provider": "openai", "model": "gpt-5"}))
+    monkeypatch.setenv("AICODEBOT_CONFIG_FILE", str(config_file))
+    monkeypatch.setenv("AICODEBOT_SESSION_FILE", str(tmp_path / "session.yaml"))
+    Session.write({"files": ["a.py"]})
+
+    parsed = []
+    original_safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, "safe_load", lambda stream: parsed.append(stream.name) or original_safe_load(stream))
+
+    config = read_config()
+    assert config["model"] == "gpt-5"
+    assert config["session"] == {"files": ["a.py"]}
+    assert len(parsed) == 2
+
+    # Modifying what we get back doesn't change the cache
+    config["model"] = "changed"
+    config["session"]["files"].append("b.py")
+    assert read_config()["model"] == "gpt-5"
+    assert read_config()["session"] == {"files": ["a.py"]}
+    assert len(parsed) == 2, "Nothing changed on disk, so nothing should be parsed again"
+
+    # Changing the file on disk is picked up
+    config_file.write_text(yaml.dump({"version": 1.3, "provider": "anthropic", "model": "claude-opus-4-1"}))
+    assert read_config()["model"] == "claude-opus-4-1"
+    assert len(parsed) == 3
+
+    # Writing the session through Session picks it up too
+    Session.write({"files": ["c.py"]})
+    assert read_config()["session"] == {"files": ["c.py"]}
+
+    # And reload() forgets everything
+    parsed.clear()
+    reload()
+    read_config()
+    assert len(parsed) == 2
+
+
+def test_load_yaml_file_missing(tmp_path):
+    assert load_yaml_file(tmp_path / "nonexistent.yaml") is None
+    assert load_yaml_file(tmp_path / "nonexistent.yaml", default={}) == {}
+
+
+def test_session_dirty_tracking(tmp_path, monkeypatch):
+    monkeypatch.setenv("AICODEBOT_SESSION_FILE", str(tmp_path / "session.yaml"))
+    Session.write({"files": ["a.py"]})
+
+    writes = []
+    original_write = Session.write
+    monkeypatch.setattr(Session, "write", classmethod(lambda cls, data: writes.append(data) or original_write(data)))
+
+    session = Session()
+    assert session.get("files") == ["a.py"]
+
+    # Setting the same value isn't a change, so nothing gets written
+    session.set("files", ["a.py"])
+    session.flush()
+    assert writes == []
+
+    session.set("files", ["a.py", "b.py"])
+    session.flush()
+    assert writes == [{"files": ["a.py", "b.py"]}]
+    assert Session.read() == {"files": ["a.py", "b.py"]}
+
+    # Nothing changed since the last flush
+    session.flush()
+    assert len(writes) == 1
+
+
+def test_session_background_flush(tmp_path, monkeypatch):
+    monkeypatch.setenv("AICODEBOT_SESSION_FILE", str(tmp_path / "session.yaml"))
+    monkeypatch.setattr(Session, "FLUSH_DELAY_SECONDS", 0.05)
+
+    session = Session()
+    session.set("files", ["a.py"])
+    flush_timer = session._flush_timer
+    assert not Session.read(), "Not written until the flush"
+    flush_timer.join()
+    assert Session.read() == {"files": ["a.py"]}
+
+
+def test_session_concurrent_writers(tmp_path, monkeypatch):
+    """Two sidekicks on the same machine keep each other's changes, and never leave a partial file."""
+    monkeypatch.setenv("AICODEBOT_SESSION_FILE", str(tmp_path / "session.yaml"))
+
+    first, second = Session(), Session()
+    first.set("files", ["a.py"])
+    second.set("other", "value")
+    first.flush()
+    second.flush()
+
+    assert Session.read() == {"files": ["a.py"], "other": "value"}
+    # Writes are atomic renames, so no temp files are left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["session.yaml", "session.yaml.lock"]
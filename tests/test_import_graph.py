@@ -0,0 +1,93 @@
+from aicodebot.coder import RepoSnapshot
+from aicodebot.helpers import create_and_write_file
+from aicodebot.import_graph import ImportGraph, get_import_graph, javascript_imports, python_imports
+
+
+def test_python_imports():
+    source = "import os, pkg.util\nfrom . import sibling\nfrom ..models import User\nfrom pkg.db import connect\n"
+    assert python_imports(source, "pkg/api/views.py") == [
+        ["os"],
+        ["pkg.util"],
+        ["pkg.api.sibling", "pkg.api"],
+        ["pkg.models.User", "pkg.models"],
+        ["pkg.db.connect", "pkg.db"],
+    ]
+    assert python_imports("def broken(:\n", "broken.py") == []
+
+
+def test_javascript_imports():
+    source = """
+import React from "react";
+import { a, b } from './util';
+import './styles.css';
+export * from "../shared/index.js";
+const fs = require('fs');
+const lazy = await import("./lazy");
+"""
+    assert javascript_imports(source) == ["react", "./util", "./styles.css", "../shared/index.js", "fs", "./lazy"]
+
+
+def make_project(root):
+    (root / "pkg" / "api").mkdir(parents=True)
+    (root / "web").mkdir()
+    (root / "tests").mkdir()
+    create_and_write_file(root / "pkg" / "__init__.py", "")
+    create_and_write_file(root / "pkg" / "api" / "__init__.py", "")
+    create_and_write_file(root / "pkg" / "models.py", "import os\n")
+    create_and_write_file(root / "pkg" / "api" / "views.py", "from ..models import User\nfrom pkg import db\n")
+    create_and_write_file(root / "pkg" / "db.py", "")
+    create_and_write_file(root / "tests" / "test_views.py", "from pkg.api.views import index\n")
+    create_and_write_file(root / "web" / "app.ts", "import { api } from './api.js'\n")
+    create_and_write_file(root / "web" / "api.ts", "export const api = 1\n")
+
+
+def test_import_graph(tmp_path):
+    make_project(tmp_path / "project")
+    graph = ImportGraph(tmp_path / "project", tmp_path / "import_graph.sqlite")
+    assert graph.update() == 8
+
+    edges = graph.edges()
+    assert edges["pkg/api/views.py"] == {"pkg/models.py", "pkg/db.py"}
+    assert edges["tests/test_views.py"] == {"pkg/api/views.py"}
+    assert edges["pkg/models.py"] == set()
+    assert edges["web/app.ts"] == {"web/api.ts"}
+
+    # What a file imports comes first, then what imports it, then the next step out
+    assert graph.related(["pkg/models.py"], max_depth=1) == ["pkg/api/views.py"]
+    assert graph.related(["pkg/models.py"]) == ["pkg/api/views.py", "pkg/db.py", "tests/test_views.py"]
+    assert graph.related(["web/api.ts", "pkg/db.py"], max_files=2) == ["web/app.ts", "pkg/api/views.py"]
+
+
+def test_import_graph_is_incremental(tmp_path):
+    make_project(tmp_path / "project")
+    assert ImportGraph(tmp_path / "project", tmp_path / "import_graph.sqlite").update() == 8
+
+    # Stored, so a new process only parses what changed
+    graph = ImportGraph(tmp_path / "project", tmp_path / "import_graph.sqlite")
+    assert graph.update() == 0
+    assert graph.edges()["pkg/api/views.py"]
+
+    create_and_write_file(tmp_path / "project" / "pkg" / "db.py", "from pkg import models\n", overwrite=True)
+    (tmp_path / "project" / "tests" / "test_views.py").unlink()
+    assert graph.update() == 1
+    assert graph.edges()["pkg/db.py"] == {"pkg/models.py"}
+    assert "tests/test_views.py" not in graph.edges()
+    assert graph.connection.execute("SELECT COUNT(*) FROM file_imports").fetchone() == (7,)
+
+
+def test_get_import_graph_once_per_snapshot(tmp_path, monkeypatch, local_data_dir):
+    make_project(tmp_path / "project")
+    updates = []
+    update = ImportGraph.update
+    monkeypatch.setattr(ImportGraph, "update", lambda graph: updates.append(graph) or update(graph))
+
+    snapshot = RepoSnapshot()
+    graph = get_import_graph(tmp_path / "project", snapshot)
+    assert get_import_graph(tmp_path / "project", snapshot) is graph
+    assert len(updates) == 1
+    assert graph.edges()["pkg/api/views.py"]
+
+    # A new snapshot, or none, means the files may have changed
+    get_import_graph(tmp_path / "project", RepoSnapshot())
+    get_import_graph(tmp_path / "project")
+    assert len(updates) == 3
@@ -42,7 +42,7 @@ def test_parse_human_input(chat):
     assert chat.parse_human_input(input_data) == chat.CONTINUE
 
 
-def test_parse_human_input_files(chat, tmp_path, monkeypatch):
+def test_parse_human_input_files(chat, tmp_path, monkeypatch, local_data_dir):
     monkeypatch.setenv("AICODEBOT_CONFIG_FILE", str(Path(__file__).parent / "test_config.yaml"))
     with in_temp_directory(tmp_path):
         create_and_write_file(tmp_path / "file.txt", "text")
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from aicodebot.languages import (
+    FILE_TYPES_BY_EXTENSION,
+    FILE_TYPES_BY_NAME,
+    UNKNOWN_FILE_TYPE,
+    get_file_type,
+    pygments_file_type,
+)
+
+
+@pytest.mark.parametrize("extension", sorted(FILE_TYPES_BY_EXTENSION))
+def test_file_types_by_extension_match_pygments(extension):
+    assert FILE_TYPES_BY_EXTENSION[extension] == pygments_file_type(f"file{extension}")
+
+
+@pytest.mark.parametrize("name", sorted(FILE_TYPES_BY_NAME))
+def test_file_types_by_name_match_pygments(name):
+    assert FILE_TYPES_BY_NAME[name] == pygments_file_type(name)
+
+
+def test_get_file_type():
+    assert get_file_type("aicodebot/coder.py") == "Python"
+    assert get_file_type("Dockerfile") == "Docker"
+    assert get_file_type("LICENSE") == UNKNOWN_FILE_TYPE
+    assert get_file_type("assets/robot.png") == UNKNOWN_FILE_TYPE
+
+    # Not in the tables, so it comes from pygments, once per extension
+    pygments_file_type.cache_clear()
+    assert get_file_type("src/lib.erl") == get_file_type("other.erl") == "Erlang"
+    assert pygments_file_type.cache_info().misses == 1
+
+
+def test_get_file_type_is_fast():
+    files = [f"src/module{i}/file{i}{extension}" for i, extension in enumerate([".py", ".ts", ".md", ".erl"] * 250)]
+    get_file_type("warm.erl")
+    start = time.perf_counter()
+    for file in files:
+        get_file_type(file)
+    assert time.perf_counter() - start < 0.1
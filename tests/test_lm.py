@@ -1,6 +1,8 @@
 from pathlib import Path
 
-from aicodebot.lm import LanguageModelManager, token_size
+from langchain_core.messages import AIMessage
+
+from aicodebot.lm import LanguageModelManager, prompt_cache_usage, token_size
 
 
 def test_token_size(monkeypatch):
@@ -10,3 +12,14 @@ def test_token_size(monkeypatch):
     text = "Code with heart, align AI with humanity. ❤️🤖"
     assert LanguageModelManager().get_token_size(text) == 12
     assert token_size(text) == 12
+
+
+def test_prompt_cache_usage():
+    usage = {"input_tokens": 5_000, "output_tokens": 10, "total_tokens": 5_010}
+    assert prompt_cache_usage(AIMessage("hi", usage_metadata=usage)) == (5_000, 0)
+
+    usage["input_token_details"] = {"cache_read": 4_800, "cache_creation": 0}
+    assert prompt_cache_usage(AIMessage("hi", usage_metadata=usage)) == (5_000, 4_800)
+
+    assert prompt_cache_usage(AIMessage("hi")) is None
+    assert prompt_cache_usage("hi") is None
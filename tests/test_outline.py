@@ -0,0 +1,149 @@
+from aicodebot.outline import (
+    Outline,
+    OutlineCache,
+    build_outline,
+    expand_outline,
+    merge_ranges,
+    python_outline,
+    render_outline,
+    request_names,
+)
+
+PYTHON_SOURCE = '''"""A module."""
+import os
+
+# The answer
+ANSWER = 42
+
+
+class Widget:
+    """A widget."""
+
+    size = 3
+
+    @property
+    def area(self):
+        """How big it is."""
+        return self.size**2
+
+    def grow(self, amount):
+        self.size += amount
+        return self.size
+
+
+async def fetch(url,
+                timeout=10):
+    return await os.get(url)
+'''
+
+
+def test_python_outline():
+    outline = python_outline(PYTHON_SOURCE)
+    assert outline.symbols == [
+        ["Widget", 8, 20],
+        ["Widget.area", 13, 16],
+        ["Widget.grow", 18, 20],
+        ["fetch", 23, 25],
+    ]
+    text = render_outline(PYTHON_SOURCE, outline.ranges)
+    assert text.splitlines() == [
+        '1: """A module."""',
+        "2: import os",
+        "3: ",
+        "4: # The answer",
+        "5: ANSWER = 42",
+        "6: ",
+        "7: ",
+        "8: class Widget:",
+        '9:     """A widget."""',
+        "10: ",
+        "11:     size = 3",
+        "12: ",
+        "13:     @property",
+        "14:     def area(self):",
+        '15:         """How big it is."""',
+        "... lines 16-16 not shown",
+        "17: ",
+        "18:     def grow(self, amount):",
+        "... lines 19-20 not shown",
+        "21: ",
+        "22: ",
+        "23: async def fetch(url,",
+        "24:                 timeout=10):",
+        "... lines 25-25 not shown",
+        "26: ",
+    ]
+    assert python_outline("def broken(:\n") is None
+    assert python_outline("print('no functions or classes')\n") is None
+
+
+def test_expand_outline():
+    outline = python_outline(PYTHON_SOURCE)
+    # By name, or qualified name
+    assert "19:         self.size += amount" in render_outline(PYTHON_SOURCE, expand_outline(outline, names={"grow"}))
+    text = render_outline(PYTHON_SOURCE, expand_outline(outline, names={"Widget.grow"}))
+    assert text.count("not shown") == 2
+
+    # By a changed line, the innermost function that has it
+    text = render_outline(PYTHON_SOURCE, expand_outline(outline, lines={16}))
+    assert "16:         return self.size**2" in text
+    assert "19:         self.size += amount" not in text
+
+    # Changed lines outside any function are shown by themselves
+    assert expand_outline(outline, lines={26}) == merge_ranges([*outline.ranges, [26, 26]])
+
+
+def test_request_names():
+    assert request_names("Why does `Widget.grow` call fetch()?") >= {"Widget.grow", "Widget", "grow", "fetch"}
+    assert request_names(None) == set()
+
+    # Common words aren't names, unless they're written as code
+    assert request_names("Add a test for the run command in get_config") == {"command", "get_config"}
+    assert request_names("Why does `run` call get() in setUp?") == {"run", "get", "setUp"}
+
+
+def test_pygments_outline():
+    source = """package main
+
+import "fmt"
+
+// Greet says hello
+func Greet(name string) {
+\tfmt.Println("Hello", name)
+}
+
+type Point struct {
+\tX int
+}
+
+func (p Point) Norm() int {
+\treturn p.X
+}
+"""
+    outline = build_outline(source, "main.go")
+    assert [name for name, _start, _end in outline.symbols] == ["Greet", "Point", "Norm"]
+    text = render_outline(source, outline.ranges)
+    assert "5: // Greet says hello\n6: func Greet(name string) {\n... lines 7-8 not shown" in text
+    assert "14: func (p Point) Norm() int {" in text
+    assert "return p.X" not in text
+    assert "return p.X" in render_outline(source, expand_outline(outline, names={"Norm"}))
+
+    assert build_outline("just some words\n", "notes.unknown-extension") is None
+
+
+def test_outline_cache(tmp_path, monkeypatch):
+    cache = OutlineCache(tmp_path / "outlines.sqlite")
+    outline = cache.get("abc123", PYTHON_SOURCE, "widget.py")
+    assert outline == python_outline(PYTHON_SOURCE)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # Outlines are only built once for each blob, even in another process
+    monkeypatch.setattr("aicodebot.outline.build_outline", lambda *args: Outline([], []))
+    cache = OutlineCache(tmp_path / "outlines.sqlite")
+    assert cache.get("abc123", PYTHON_SOURCE, "widget.py") == outline
+    assert cache.get("empty", "", "empty.py") == Outline([], [])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The same content in a file of another language is outlined again
+    assert cache.get("abc123", PYTHON_SOURCE, "widget.txt") == Outline([], [])
+    assert (cache.hits, cache.misses) == (1, 2)
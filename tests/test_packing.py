@@ -0,0 +1,59 @@
+import time
+
+from aicodebot.packing import LARGER_THAN_BUDGET, OVER_BUDGET, pack, rank_relevance
+
+
+def test_pack_small_files_over_one_large_one():
+    # Greedy in rank order would take a, then the large b, and have no room for c, d and e
+    token_counts = {"a": 100, "b": 800, "c": 100, "d": 100, "e": 100}
+    packing = pack(token_counts, 1_000)
+    assert packing.selected == ["a", "c", "d", "e"]
+    assert packing.excluded == {"b": OVER_BUDGET}
+    assert packing.tokens == 400
+    assert packing.relevance == sum(rank_relevance(token_counts)[file] for file in "acde")
+
+
+def test_pack_swaps_in_a_relevant_large_file():
+    # By density the small, less relevant files go first and b doesn't fit anymore, but b is worth more
+    relevance = {"a": 1, "b": 10, "c": 1, "d": 1}
+    packing = pack({"a": 10, "b": 95, "c": 10, "d": 10}, 100, relevance)
+    assert packing.selected == ["b"]
+    assert packing.excluded == {"a": OVER_BUDGET, "c": OVER_BUDGET, "d": OVER_BUDGET}
+
+    # Unless what it displaces is worth more
+    relevance = {"a": 4, "b": 10, "c": 4, "d": 4}
+    assert pack({"a": 10, "b": 95, "c": 10, "d": 10}, 100, relevance).selected == ["a", "c", "d"]
+
+
+def test_pack_required_items_first():
+    # By relevance, ten related files would outvote the one being changed
+    token_counts = {"staged.py": 2_500, **{f"related{number}.py": 400 for number in range(10)}}
+    assert "staged.py" not in pack(token_counts, 4_000).selected
+
+    packing = pack(token_counts, 4_000, required=["staged.py"])
+    assert packing.selected == ["staged.py", "related0.py", "related1.py", "related2.py"]
+    assert packing.tokens == 3_700
+
+    # Required items that don't fit are still left out
+    packing = pack({"big.py": 900, "staged.py": 200, "other.py": 50}, 1_000, required=["big.py", "staged.py"])
+    assert packing.selected == ["big.py", "other.py"]
+    assert packing.excluded == {"staged.py": OVER_BUDGET}
+
+
+def test_pack_excluded_reasons():
+    packing = pack({"a": 50, "huge": 5_000, "b": 60}, 100)
+    assert packing.selected == ["a"]
+    assert packing.excluded == {"huge": LARGER_THAN_BUDGET, "b": OVER_BUDGET}
+    assert pack({}, 100) == ([], {}, 0, 0)
+
+
+def test_pack_many_candidates_quickly():
+    token_counts = {f"file{number}.py": (number * 7_919) % 3_000 + 1 for number in range(500)}
+    start = time.perf_counter()
+    packing = pack(token_counts, 50_000)
+    elapsed = time.perf_counter() - start
+
+    assert packing.tokens <= 50_000
+    assert set(packing.selected) | set(packing.excluded) == set(token_counts)
+    # Should be about a millisecond, with lots of room for slow CI machines
+    assert elapsed < 0.1
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from aicodebot.lm import TimingCallbackHandler
+from aicodebot.profiling import FIRST_TOKEN, STREAM, Profiler, profiler, span
+
+
+@pytest.fixture
+def enabled_profiler():
+    profiler.start()
+    yield profiler
+    profiler.stop()
+
+
+def test_span_disabled():
+    profiler.stop()
+    with span("nothing"):
+        pass
+    assert "nothing" not in profiler.timings
+
+
+def test_span(enabled_profiler):
+    @span("decorated")
+    def sleepy(seconds):
+        time.sleep(seconds)
+        return seconds
+
+    assert sleepy(0.01) == 0.01
+    sleepy(0.01)
+    with span("block"), span("block"):  # Nested spans of the same name are only counted once
+        time.sleep(0.01)
+
+    assert enabled_profiler.counts["decorated"] == 2
+    assert enabled_profiler.timings["decorated"] >= 0.02
+    assert enabled_profiler.counts["block"] == 1
+    assert enabled_profiler.timings["block"] < enabled_profiler.timings["decorated"]
+
+    # Exceptions still record the time
+    with pytest.raises(ValueError), span("error"):
+        raise ValueError
+    assert enabled_profiler.counts["error"] == 1
+
+    rows = enabled_profiler.summary()
+    assert [row[0] for row in rows] == ["decorated", "block", "error", "total"]
+
+
+def test_cprofile(tmp_path):
+    local_profiler = Profiler()
+    local_profiler.start()
+    local_profiler.start_cprofile(tmp_path / "stats.prof")
+    sum(range(1000))
+    local_profiler.stop()
+    assert (tmp_path / "stats.prof").exists()
+    assert not local_profiler.enabled
+
+
+def test_timing_callback_handler(enabled_profiler):
+    handler = TimingCallbackHandler()
+    for _ in range(2):
+        handler.on_llm_start({})
+        for token in ["one", "two", "three"]:
+            handler.on_llm_new_token(token)
+        handler.on_llm_end(None)
+
+    assert enabled_profiler.counts[FIRST_TOKEN] == 2
+    assert enabled_profiler.counts[STREAM] == 2
@@ -0,0 +1,174 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+
+from aicodebot import prompts
+from aicodebot.coder import Coder, RepoSnapshot
+from aicodebot.helpers import create_and_write_file
+from aicodebot.prompts import DEFAULT_PERSONALITY, PERSONALITIES, build_prompt, generate_files_context, get_prompt
+from tests.conftest import in_temp_directory
+
+
+def test_import_does_not_read_config():
+    # Run in a fresh interpreter, since the test session has already read the config
+    code = "import aicodebot.config, aicodebot.prompts; print(len(aicodebot.config._yaml_cache))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "0"
+
+
+@pytest.mark.parametrize("command", ["alignment", "commit", "debug", "fun_fact", "review", "sidekick"])
+def test_get_prompt_is_memoized(command, monkeypatch):
+    monkeypatch.setenv("AICODEBOT_PERSONALITY", DEFAULT_PERSONALITY.name)
+    prompt = get_prompt(command)
+    assert isinstance(prompt, (PromptTemplate, ChatPromptTemplate))
+    assert get_prompt(command) is prompt
+
+    # A different personality gets its own prompt
+    other = next(name for name in PERSONALITIES if name != DEFAULT_PERSONALITY.name)
+    monkeypatch.setenv("AICODEBOT_PERSONALITY", other)
+    assert get_prompt(command) is not prompt
+
+
+def test_get_prompt_personality(monkeypatch):
+    monkeypatch.setenv("AICODEBOT_PERSONALITY", "Spock")
+    text = get_prompt("fun_fact").format(topic="history")
+    assert PERSONALITIES["Spock"].prompt in text
+    assert "{personality}" not in text
+
+    messages = get_prompt("commit").format_messages(diff_context="", languages="")
+    assert PERSONALITIES["Spock"].prompt in messages[0].content
+
+
+def test_structured_review_prompt():
+    prompt = build_prompt("review", DEFAULT_PERSONALITY.name, structured_output=True)
+    assert prompt is build_prompt("review", DEFAULT_PERSONALITY.name, structured_output=True)
+    assert prompt is not build_prompt("review", DEFAULT_PERSONALITY.name)
+    assert "review_status" in prompt.format(diff_context="", languages="")
+
+
+def test_get_prompt_unknown_command():
+    with pytest.raises(ValueError, match="Unable to find prompt"):
+        get_prompt("nope")
+
+
+def test_generate_files_context_reuses_unchanged_files(tmp_path, monkeypatch):
+    with in_temp_directory(tmp_path):
+        create_and_write_file("main.py", "import os\n\nprint(os.getcwd())")
+        create_and_write_file("logo.png", "\0PNG")
+
+        context = generate_files_context(["main.py", "logo.png"], RepoSnapshot())
+        assert "--- START OF FILE: main.py Python file ---\n" in context.file_contents
+        assert "1: import os\n2: \n3: print(os.getcwd())\n--- END OF FILE: main.py ---" in context.file_contents
+        assert "Binary file: logo.png" in context.file_contents
+        assert context.file_contents.index("logo.png") < context.file_contents.index("main.py")  # Sorted
+        assert context.file_ages.startswith("The files were last modified: logo.png just now, main.py just now")
+        assert str(context) == context.directory_structure + context.file_contents + context.file_ages
+
+        # Nothing changed, so nothing is read again
+        reads = []
+        load_file = Coder.load_file
+        monkeypatch.setattr(Coder, "load_file", lambda file: reads.append(file) or load_file(file))
+        assert generate_files_context(["main.py", "logo.png"], RepoSnapshot()) == context
+        assert reads == []
+
+        # Until it's changed
+        create_and_write_file("main.py", "print('hi')", overwrite=True)
+        os.utime("main.py", ns=(1, 1))
+        context = generate_files_context(["main.py"], RepoSnapshot())
+        assert "1: print('hi')\n--- END OF FILE" in context.file_contents
+        assert reads == ["main.py"]
+        assert prompts._file_blocks[Path("main.py").absolute()][0] == (11, 1, None)
+
+        # Files that are no longer in the context are dropped from memory
+        assert list(prompts._file_blocks) == [Path("main.py").absolute()]
+        generate_files_context([], RepoSnapshot())
+        assert prompts._file_blocks == {}
+
+
+def test_generate_files_context_outline(temp_git_repo, monkeypatch, local_data_dir):
+    with in_temp_directory(temp_git_repo.working_dir):
+        functions = [
+            f'def function_{number}(value):\n    """Function {number}."""\n' + f"    value += {number}\n" * 30
+            for number in range(10)
+        ]
+        create_and_write_file("big.py", "\n\n".join(functions))
+        create_and_write_file("small.py", "def tiny():\n    return 1\n")
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add files")
+        create_and_write_file("big.py", "\n\n".join(functions).replace("value += 3\n", "value += 33\n"), overwrite=True)
+
+        context = generate_files_context(
+            ["big.py", "small.py"], RepoSnapshot(), outline=True, request="Why function_7?"
+        )
+        assert "--- START OF FILE: big.py Python file (outline) ---" in context.file_contents
+        assert "def function_1(value):" in context.file_contents
+        assert "value += 1\n" not in context.file_contents
+        assert "value += 33\n" in context.file_contents  # Changed since the last commit
+        assert "value += 7\n" in context.file_contents  # Named in the request
+        assert "--- START OF FILE: small.py Python file ---\n1: def tiny():\n2:     return 1\n" in context.file_contents
+
+        # The outline isn't built, or the file read, again until it changes
+        reads = []
+        load_file = Coder.load_file
+        monkeypatch.setattr(Coder, "load_file", lambda file: reads.append(file) or load_file(file))
+        monkeypatch.setattr(prompts, "get_outline_cache", lambda: pytest.fail("outline built again"))
+        context = generate_files_context(["big.py"], RepoSnapshot(), outline=True, request="Why function_2?")
+        assert "value += 2\n" in context.file_contents
+        assert "value += 7\n" not in context.file_contents
+        assert reads == ["big.py"]  # To show function_2
+
+
+def test_generate_files_context_related_code(temp_git_repo, local_data_dir):
+    with in_temp_directory(temp_git_repo.working_dir):
+        create_and_write_file("parser.py", "def parse_config(text):\n    return yaml.safe_load(text)\n")
+        create_and_write_file("main.py", "from parser import parse_config\n\nparse_config(open('c').read())\n")
+
+        context = generate_files_context(["main.py"], RepoSnapshot(), request="How do we parse the config?", top_k=3)
+        assert context.related_code.startswith("Here are parts of other files in the repo that may be relevant")
+        assert "--- START OF PART: parser.py lines 1-3 ---\n1: def parse_config(text):\n" in context.related_code
+        assert "START OF PART: main.py" not in context.related_code  # Already in the context
+        assert str(context).endswith(context.related_code)
+
+        assert (
+            generate_files_context(["main.py"], RepoSnapshot(), request="How do we parse the config?").related_code
+            == ""
+        )
+
+
+def test_sidekick_prompt_layout():
+    context = {
+        "directory_structure": "- [File] a.py\n",
+        "file_contents": "1: pass",
+        "file_ages": "",
+        "languages": "Python",
+    }
+
+    # The task comes last, after everything that stays the same from turn to turn
+    messages = get_prompt("sidekick").format_messages(task="Fix it", **context)
+    assert [message.type for message in messages] == ["system", "human"]
+    assert messages[0].content.endswith("- [File] a.py\n1: pass")
+    assert messages[1].content == "Languages: Python\nSoftware Engineer: Fix it"
+
+    # Code found for the request goes with it, since it changes with each request
+    messages = get_prompt("sidekick").format_messages(task="Fix it", related_code="1: import a\n", **context)
+    assert messages[1].content == "Languages: Python\n1: import a\nSoftware Engineer: Fix it"
+
+    # With cache_control, for Anthropic, there's a cache breakpoint after the directory structure and the files
+    messages = get_prompt("sidekick", cache_control=True).format_messages(task="Fix it", **context)
+    blocks = messages[0].content
+    assert [block["text"] for block in blocks[1:]] == ["- [File] a.py\n", "1: pass"]
+    assert [block.get("cache_control") for block in blocks] == [None, {"type": "ephemeral"}, {"type": "ephemeral"}]
+
+    # The languages change with the files, so they go with the task, not in the cached system prompt
+    assert "{languages}" not in blocks[0]["text"]
+    assert (
+        blocks[0]["text"]
+        == get_prompt("sidekick", cache_control=True)
+        .format_messages(task="Fix it", **{**context, "languages": "Rust"})[0]
+        .content[0]["text"]
+    )
+    assert messages[1].content.startswith("Languages: Python\n")
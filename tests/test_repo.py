@@ -0,0 +1,83 @@
+from pathlib import Path
+
+from aicodebot import repo
+from aicodebot.coder import Coder
+from aicodebot.helpers import create_and_write_file
+from aicodebot.repo import GitBackend, get_git_backend, in_git_repo
+from tests.conftest import in_temp_directory
+
+
+def test_in_git_repo(temp_git_repo, tmp_path):
+    with in_temp_directory(temp_git_repo.working_dir):
+        assert in_git_repo()
+        assert get_git_backend() is get_git_backend()
+        assert get_git_backend().root == Path(temp_git_repo.working_dir).resolve()
+
+        Path("subdir").mkdir()
+        with in_temp_directory(Path("subdir")):
+            assert in_git_repo()
+
+    not_a_repo = tmp_path.parent / f"{tmp_path.name}_not_a_repo"
+    not_a_repo.mkdir()
+    with in_temp_directory(not_a_repo):
+        assert not in_git_repo()
+
+
+def test_memoized_until_the_index_changes(temp_git_repo, monkeypatch):
+    git_commands = []
+    exec_and_get_output = repo.exec_and_get_output
+    monkeypatch.setattr(
+        repo, "exec_and_get_output", lambda command: git_commands.append(command) or exec_and_get_output(command)
+    )
+
+    with in_temp_directory(temp_git_repo.working_dir):
+        backend = GitBackend()
+        create_and_write_file("new.txt", "new")
+        assert backend.staged_files() == []
+        assert backend.staged_files() == []
+        assert len(git_commands) == 1
+
+        # git add rewrites the index
+        temp_git_repo.git.add("new.txt")
+        assert backend.staged_files() == ["new.txt"]
+        assert len(git_commands) == 2
+
+        # and a commit moves HEAD
+        head = backend.head_sha()
+        temp_git_repo.git.commit("-m", "Add new.txt")
+        assert backend.head_sha() != head
+        assert backend.staged_files() == []
+        assert len(git_commands) == 3
+
+        # Working tree edits aren't noticed until we invalidate
+        assert backend.unstaged_files() == []
+        create_and_write_file("new.txt", "changed", overwrite=True)
+        assert backend.unstaged_files() == []
+        backend.invalidate()
+        assert backend.unstaged_files() == ["new.txt"]
+
+
+def test_blob_shas(temp_git_repo):
+    with in_temp_directory(temp_git_repo.working_dir):
+        Path("subdir").mkdir()
+        create_and_write_file("subdir/file.txt", "In a subdirectory")
+        temp_git_repo.git.add(".")
+        temp_git_repo.git.commit("-m", "Add a subdirectory")
+        backend = GitBackend()
+
+        expected = {
+            "initial_commit.txt": Coder.git_blob_sha(b"This is a test file."),
+            "subdir/file.txt": Coder.git_blob_sha(b"In a subdirectory"),
+        }
+        assert backend.blob_shas() == expected
+        assert backend.blob_shas(["subdir/file.txt", "untracked.txt"]) == {
+            "subdir/file.txt": expected["subdir/file.txt"]
+        }
+
+        # Paths are relative to the current directory
+        with in_temp_directory(Path("subdir")):
+            assert backend.blob_shas() == {"file.txt": expected["subdir/file.txt"]}
+
+        # Once a file changes its size or mtime, the index SHA can't be trusted
+        create_and_write_file("subdir/file.txt", "Changed", overwrite=True)
+        assert backend.blob_shas() == {"initial_commit.txt": expected["initial_commit.txt"]}
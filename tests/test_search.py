@@ -0,0 +1,84 @@
+import os
+
+from aicodebot import search
+from aicodebot.helpers import create_and_write_file
+from aicodebot.search import MAX_CHUNK_LINES, SearchIndex, code_terms, code_tokens, split_chunks
+
+
+def test_code_tokens():
+    assert code_tokens("def get_file_context(HTTPServer, parseJSON2):") == [
+        "def",
+        "get",
+        "file",
+        "context",
+        "getfilecontext",
+        "http",
+        "server",
+        "httpserver",
+        "parse",
+        "json",
+        "parsejson2",
+    ]
+    # Snake case and camel case match each other through the whole identifier
+    assert code_tokens("getFileContext")[-1] == code_tokens("get_file_context")[-1]
+    assert code_terms("x = load_file(path)") == " ".join(code_tokens("x = load_file(path)"))
+
+
+def test_split_chunks():
+    # At a blank line, once the chunk is long enough
+    text = "\n".join(["code"] * 25 + [""] + ["code"] * 10)
+    assert split_chunks(text) == [(1, 26), (27, 36)]
+    # Or when it's too long
+    assert split_chunks("\n".join(["code"] * 100)) == [(1, MAX_CHUNK_LINES), (MAX_CHUNK_LINES + 1, 100)]
+    assert split_chunks("") == []
+
+
+def test_search_index(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    create_and_write_file(repo / "tokens.py", "def count_tokens(text):\n    return len(encode(text))\n")
+    create_and_write_file(repo / "walk.py", "def walk_directory(root):\n    return scandir(root)\n")
+    create_and_write_file(repo / "cli.py", "def main():\n    walk_directory('.')\n    countTokens('hi')\n")
+    (repo / "logo.png").write_bytes(b"\x89PNG\0\0tokens")
+
+    index = SearchIndex(repo, tmp_path / "search.sqlite")
+    assert index.update() == 4
+    assert index.update() == 0
+
+    chunks = index.search("How do we count tokens?")
+    assert [chunk.path for chunk in chunks] == ["tokens.py", "cli.py"]
+    assert chunks[0].score > chunks[1].score
+    assert chunks[0].text(repo) == "1: def count_tokens(text):\n2:     return len(encode(text))\n3: "
+    assert [chunk.path for chunk in index.search("count tokens", exclude_files=["tokens.py"])] == ["cli.py"]
+    assert index.search("count tokens", top_k=1)[0].path == "tokens.py"
+    assert index.search("nothing matches this") == []
+    assert index.search("How is it?") == []  # Only stop words
+    assert index.search("") == []
+
+    # Only what changed is indexed again
+    create_and_write_file(repo / "walk.py", "def walk_tree(root):\n    return scandir(root)\n", overwrite=True)
+    os.utime(repo / "walk.py", ns=(1, 1))
+    (repo / "cli.py").unlink()
+    assert index.update() == 1
+    assert [chunk.path for chunk in index.search("walk tree")] == ["walk.py"]
+    assert [chunk.path for chunk in index.search("count tokens")] == ["tokens.py"]
+
+    # It's stored, another index for the same directory picks up where this one left off
+    index = SearchIndex(repo, tmp_path / "search.sqlite")
+    assert index.update() == 0
+    assert [chunk.path for chunk in index.search("walk tree")] == ["walk.py"]
+
+
+def test_search_leaves_out_common_terms(tmp_path, monkeypatch):
+    monkeypatch.setattr(search, "MIN_COMMON_TERM_CHUNKS", 1)
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    for number in range(40):
+        create_and_write_file(repo / f"widget{number}.py", f"class Widget{number}:\n    size = {number}\n")
+
+    index = SearchIndex(repo, tmp_path / "search.sqlite")
+    index.update()
+    # widget is everywhere, so it's left out, and the specific widget wins
+    assert [chunk.path for chunk in index.search("Where is the widget Widget7?", top_k=3)] == ["widget7.py"]
+    # Unless there's nothing else to go on
+    assert len(index.search("widget size", top_k=3)) == 3
@@ -0,0 +1,81 @@
+from pathlib import Path
+
+from aicodebot.lm import token_size
+from aicodebot.tokens import (
+    TokenCountCache,
+    count_tokens,
+    count_tokens_many,
+    estimate_token_range,
+    estimate_tokens,
+    fits_token_budget,
+    get_encoding,
+    get_tokenizer_workers,
+)
+
+
+def test_count_tokens():
+    assert count_tokens("") == 0
+
+    text = "Code with heart, align AI with humanity. ❤️🤖"
+    assert count_tokens(text) == 12
+    assert token_size(text) == 12
+
+
+def test_count_tokens_many():
+    texts = ["", "Code with heart, align AI with humanity. ❤️🤖", "def foo():\n    pass\n"]
+    assert count_tokens_many(texts) == [count_tokens(text) for text in texts]
+    assert count_tokens_many(text for text in texts) == count_tokens_many(texts)
+    assert count_tokens_many([]) == []
+    assert count_tokens_many(texts * 50, workers=4) == count_tokens_many(texts * 50, workers=1)
+
+
+def test_estimate_token_range():
+    for path in ["aicodebot/coder.py", "README.md", "pyproject.toml", "LICENSE"]:
+        text = Path(path).read_text()
+        byte_size = len(text.encode())
+        low, high = estimate_token_range(byte_size)
+        assert low <= count_tokens(text) <= high, path
+        assert low <= estimate_tokens(byte_size) <= high
+
+    assert estimate_token_range(0) == (0, 0)
+
+
+def test_fits_token_budget():
+    assert fits_token_budget(100, 100) is True  # Never more tokens than bytes
+    assert fits_token_budget(50, 10) is None  # Close enough that we need to count
+    assert fits_token_budget(1_000_000, 10_000) is False  # Way over
+
+
+def test_get_tokenizer_workers(monkeypatch):
+    assert get_tokenizer_workers() >= 1
+    monkeypatch.setenv("AICODEBOT_TOKENIZER_WORKERS", "3")
+    assert get_tokenizer_workers() == 3
+
+
+def test_count_tokens_without_config(tmp_path, monkeypatch):
+    # Counting tokens should never need the config file (or an API key)
+    monkeypatch.setenv("AICODEBOT_CONFIG_FILE", str(tmp_path / "nonexistent.yaml"))
+    assert count_tokens("hello world") > 0
+
+    # The encoding is resolved once and shared
+    assert get_encoding() is get_encoding()
+
+
+def test_token_count_cache(tmp_path):
+    cache = TokenCountCache(tmp_path / "token_counts.sqlite", max_entries=2)
+    assert cache.get_many(["aaa", "bbb"], "o200k_base") == {}
+    assert cache.stats == {"hits": 0, "misses": 2, "entries": 0}
+
+    cache.set_many({"aaa": 1, "bbb": None}, "o200k_base")
+    assert cache.get_many(["aaa", "bbb"], "o200k_base") == {"aaa": 1, "bbb": None}
+    assert cache.get_many(["aaa"], "cl100k_base") == {}, "Counts are specific to the encoding"
+    assert cache.stats == {"hits": 2, "misses": 3, "entries": 2}
+
+    # Touch aaa so bbb is the least recently used, then go over the limit
+    cache.get_many(["aaa"], "o200k_base")
+    cache.set_many({"ccc": 3}, "o200k_base")
+    assert cache.get_many(["aaa", "bbb", "ccc"], "o200k_base") == {"aaa": 1, "ccc": 3}
+    assert cache.stats["entries"] == 2
+
+    # The cache persists on disk
+    assert TokenCountCache(tmp_path / "token_counts.sqlite").get_many(["aaa"], "o200k_base") == {"aaa": 1}
@@ -0,0 +1,204 @@
+import os
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+from aicodebot.helpers import create_and_write_file
+from aicodebot.walk import (
+    TREE_BYTES_PER_TOKEN,
+    DirectoryTree,
+    IgnoreRules,
+    git_ls_files,
+    walk,
+    walk_directory,
+    walk_paths,
+)
+
+
+@pytest.mark.parametrize(
+    ("patterns", "path", "is_dir", "expected"),
+    [
+        (["*.log"], "app.log", False, True),
+        (["*.log"], "deep/down/app.log", False, True),
+        (["*.log", "!keep.log"], "logs/keep.log", False, False),
+        (["!keep.log", "*.log"], "keep.log", False, True),  # The last matching pattern wins
+        (["build/"], "build", True, True),
+        (["build/"], "build", False, None),  # Only matches directories
+        (["/build"], "src/build", True, None),  # Anchored to the .gitignore directory
+        (["doc/*.txt"], "doc/notes.txt", False, True),
+        (["doc/*.txt"], "doc/server/notes.txt", False, None),
+        (["doc/*.txt"], "other/doc/notes.txt", False, None),
+        (["**/cache"], "a/b/cache", True, True),
+        (["a/**/b"], "a/x/y/b", False, True),
+        (["a/**/b"], "a/b", False, True),
+        (["vendor/**"], "vendor/lib/x.py", False, True),
+        (["file?.txt"], "file1.txt", False, True),
+        (["file?.txt"], "file10.txt", False, None),
+        (["[!a]*.py"], "b.py", False, True),
+        (["[!a]*.py"], "a.py", False, None),
+        (["[]a]x"], "]x", False, True),  # A ] right after the [ is in the set
+        (["[]a]x"], "ax", False, True),
+        (["[!]a]x"], "]x", False, None),
+        (["[!]a]x"], "bx", False, True),
+        (["[]"], "[]", False, True),  # No closing bracket, so a plain [
+        (["[abc"], "[abc", False, True),
+        (["\\#literal"], "#literal", False, True),
+        (["\\!important"], "!important", False, True),
+        (["# comment", "", "   "], "# comment", False, None),
+    ],
+)
+def test_ignore_rules(patterns, path, is_dir, expected):
+    rules = IgnoreRules(patterns)
+    assert rules.match(path, is_dir) == (expected if rules.dir_regex else None)
+
+
+def make_tree(root):
+    for file in [
+        "README.md",
+        "app.log",
+        "keep.log",
+        "build/output.bin",
+        "src/main.py",
+        "src/generated.py",
+        "src/sub/notes.txt",
+        "src/sub/data.csv",
+        "private.txt",
+    ]:
+        Path(root / file).parent.mkdir(parents=True, exist_ok=True)
+        create_and_write_file(root / file, file)
+    create_and_write_file(root / ".gitignore", "*.log\n!keep.log\n/build/\n")
+    create_and_write_file(root / "src" / ".gitignore", "generated.py\nsub/*.csv\n")
+
+
+def test_walk_directory(tmp_path):
+    make_tree(tmp_path)
+    (tmp_path / ".git" / "info").mkdir(parents=True)
+    create_and_write_file(tmp_path / ".git" / "info" / "exclude", "private.txt\n")
+
+    entries = list(walk_directory(tmp_path))
+    assert [entry.path for entry in entries] == [
+        ".gitignore",
+        "README.md",
+        "keep.log",
+        "src",
+        "src/.gitignore",
+        "src/main.py",
+        "src/sub",
+        "src/sub/notes.txt",
+    ]
+    assert [entry.depth for entry in entries] == [1, 1, 1, 1, 2, 2, 2, 3]
+    assert [entry.name for entry in entries if entry.is_dir] == ["src", "sub"]
+
+    # Without gitignore, everything (including .git) is there, unless it matches ignore_patterns
+    paths = [entry.path for entry in walk_directory(tmp_path, use_gitignore=False)]
+    assert "build/output.bin" in paths
+    assert ".git/info/exclude" in paths
+    paths = [entry.path for entry in walk(tmp_path, ignore_patterns=[".git", "*.py"], use_gitignore=False)]
+    assert "src/generated.py" not in paths
+    assert not any(path.startswith(".git/") for path in paths)
+
+
+def test_walk_matches_git(tmp_path):
+    make_tree(tmp_path)
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    create_and_write_file(tmp_path / ".git" / "info" / "exclude", "private.txt\n", overwrite=True)
+
+    git_files = git_ls_files(tmp_path)
+    assert sorted(git_files) == sorted(entry.path for entry in walk_directory(tmp_path) if not entry.is_dir)
+
+    # The fast path (from git ls-files) comes out in the same order as walking the directory
+    assert list(walk(tmp_path)) == list(walk_paths(git_files)) == list(walk_directory(tmp_path))
+
+    # Walking part of the tree, from git or the file system, applies the .gitignore files above it
+    src_paths = [entry.path for entry in walk_directory(tmp_path) if entry.path.startswith("src/")]
+    assert [entry.path for entry in walk(tmp_path, subdirectory="src")] == src_paths
+    assert [entry.path for entry in walk_directory(tmp_path, subdirectory="src")] == src_paths
+
+    # Relative to the directory, even in a subdirectory of the repo
+    assert sorted(git_ls_files(tmp_path / "src")) == [".gitignore", "main.py", "sub/notes.txt"]
+
+
+def test_git_ls_files_outside_a_repo(tmp_path):
+    not_a_repo = tmp_path.parent / f"{tmp_path.name}_not_a_repo"
+    not_a_repo.mkdir()
+    assert git_ls_files(not_a_repo) is None
+
+
+def test_directory_tree_within_budget(tmp_path):
+    for directory in ["tests/fixtures", "src/app", "docs"]:
+        (tmp_path / directory).mkdir(parents=True)
+    for i in range(300):
+        create_and_write_file(tmp_path / "tests" / "fixtures" / f"fixture_{i:03}.json", "{}")
+    create_and_write_file(tmp_path / "tests" / "test_app.py", "")
+    for name in ["app.py", "models.py", "views.py"]:
+        create_and_write_file(tmp_path / "src" / "app" / name, "")
+    create_and_write_file(tmp_path / "docs" / "index.md", "")
+    create_and_write_file(tmp_path / "README.md", "")
+
+    tree = DirectoryTree(tmp_path, use_gitignore=False)
+    assert tree.root.file_count == 306
+
+    # Without a budget, everything is there
+    full = tree.render()
+    assert full.count("- [File]") == 306
+    assert full.startswith(
+        f"- [Directory] {tmp_path.name}\n  - [File] README.md\n  - [Directory] docs\n    - [File] index.md\n"
+    )
+
+    # With a budget, the big directory is collapsed into a summary
+    budgeted = tree.render(max_tokens=200, focus=["src/app/models.py"])
+    assert len(budgeted.encode()) <= 200 * TREE_BYTES_PER_TOKEN
+    assert "    - [Directory] fixtures (300 files)\n" in budgeted
+    assert "      - [File] models.py\n" in budgeted
+    assert "fixture_000.json" not in budgeted
+
+    # The directories with the focus files are expanded before others
+    budgeted = tree.render(max_tokens=100, focus=["docs/index.md"])
+    assert "    - [File] index.md\n" in budgeted
+    assert "  - [Directory] src (3 files)\n" in budgeted
+
+    # The top level is always shown, even when it doesn't fit
+    assert tree.render(max_tokens=0) == f"- [Directory] {tmp_path.name} (306 files)\n"
+
+
+def test_directory_tree_refresh(tmp_path):
+    for directory in ["src/app", "docs"]:
+        (tmp_path / directory).mkdir(parents=True)
+    create_and_write_file(tmp_path / "src" / "app" / "main.py", "")
+    create_and_write_file(tmp_path / "docs" / "index.md", "")
+    create_and_write_file(tmp_path / ".gitignore", "*.log\n")
+
+    def age(*paths):
+        """Make the directories look like they were last changed a minute ago, so they aren't racy"""
+        for path in paths:
+            os.utime(tmp_path / path, ns=(time.time_ns() - 60_000_000_000,) * 2)
+
+    age(".", "src", "src/app", "docs", ".gitignore")
+    tree = DirectoryTree(tmp_path)
+    assert tree.refresh() == 0
+
+    # A new file is picked up by walking only the directory it's in
+    create_and_write_file(tmp_path / "src" / "app" / "views.py", "")
+    create_and_write_file(tmp_path / "src" / "app" / "debug.log", "")
+    assert tree.refresh() == 1
+    assert "      - [File] views.py\n" in tree.render()
+    assert "debug.log" not in tree.render()
+    assert tree.root.file_count == 4
+
+    # It was modified just now, so it may have changed while we walked it, and is walked again
+    assert tree.refresh() == 1
+    age("src/app")
+    assert tree.refresh() == 1
+    assert tree.refresh() == 0
+
+    # Removing a directory, and editing a .gitignore
+    (tmp_path / "docs" / "index.md").unlink()
+    (tmp_path / "docs").rmdir()
+    create_and_write_file(tmp_path / ".gitignore", "*.py\n", overwrite=True)
+    assert tree.refresh() == 1
+    assert tree.render() == tree.render() == DirectoryTree(tmp_path).render()
+    assert "docs" not in tree.render()
+    assert "debug.log" in tree.render()
+    assert tree.root.file_count == 2